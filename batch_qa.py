@@ -0,0 +1,228 @@
+# batch_qa.py
+"""Answer a file of questions about a document without the interactive chat.
+
+The document is indexed once, all questions are encoded in one model call and
+retrieved with one matrix product, and answers are generated concurrently at batch
+priority. Each answer is appended to the output JSONL as soon as it is ready, so an
+interrupted run picks up where it left off:
+    python batch_qa.py --questions questions.txt --file uploads/report.pdf --output answers.jsonl
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import TOP_K_CHUNKS, RERANK_CANDIDATES, LLM_URLS, BATCH_QA_CONCURRENCY
+from llm import run_llm
+from logger import logger
+from pipeline import doc_processor, context_compressor, build_prompt
+from scheduler import llm_scheduler, OverloadedError, BATCH
+from system_monitor import system_monitor
+
+
+def read_questions(path):
+    """Return [(id, question)] from a text file (one per line) or JSONL ({"question", optional "id"}).
+
+    Questions without an id are identified by their text.
+    """
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                question = record["question"].strip()
+                questions.append((str(record.get("id", question)), question))
+            else:
+                questions.append((line, line))
+    return questions
+
+
+def answered_ids(path):
+    """Ids already answered without an error in an earlier run's output."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of an interrupted run
+                continue
+            if "error" in record:
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+    return done
+
+
+class AnswerWriter:
+    """Appends answer records to a JSONL file from several threads, one flushed line each."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        # don't glue the first record onto a line cut off by an interruption
+        partial = os.path.exists(path) and os.path.getsize(path) > 0 and not _ends_with_newline(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        if partial:
+            self._file.write("\n")
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def retrieve(questions, top_k=TOP_K_CHUNKS):
+    """Return each question's context chunks, encoding and scoring all questions at once.
+
+    With the context compressor on, each question's candidates are then filtered,
+    reranked and cut down to their most relevant sentences, as in run_pipeline.
+    """
+    query_embeddings = doc_processor.embed_queries(questions)
+    if context_compressor is None:
+        ids, scores = doc_processor.search_embeddings(query_embeddings, top_k, questions)
+        return [doc_processor.merge_overlapping(i, s) for i, s in zip(ids, scores)]
+    ids, _ = doc_processor.search_embeddings(query_embeddings, max(top_k, RERANK_CANDIDATES), questions)
+    return [
+        context_compressor.select(question, embedding, doc_processor, candidates, top_k)[1]
+        for question, embedding, candidates in zip(questions, query_embeddings, ids)
+    ]
+
+
+@system_monitor.monitor
+def generate(prompt, question, relevant_chunks, url=None, timings=None):
+    """Generate one answer at batch priority; recorded in the metrics like a chat query.
+
+    The scheduler slot is taken inside the monitored call, so queue time and shedding
+    land in this query's metrics; the wait is also stored in timings["queue_time"].
+    """
+    system_monitor.annotate(batch=True)
+    with system_monitor.span("prompt"):
+        full_prompt = build_prompt(prompt, question, relevant_chunks)
+    try:
+        queue_time = llm_scheduler.acquire(BATCH)
+    except OverloadedError as e:
+        # the scheduler has annotated shed=True
+        logger.warning(str(e))
+        return f"Error: {str(e)}"
+    if timings is not None:
+        timings["queue_time"] = queue_time
+    start = time.perf_counter()
+    try:
+        return run_llm(full_prompt, url=url)
+    finally:
+        llm_scheduler.release(time.perf_counter() - start)
+
+
+def answer_one(question_id, question, relevant_chunks, retrieval_time, url=None):
+    """Answer a question and return its output record."""
+    start = time.perf_counter()
+    record = {"id": question_id, "question": question}
+    timings = {}
+    response = generate(f"Human: {question}\nAssistant:", question, relevant_chunks, url, timings)
+    total = time.perf_counter() - start
+    queue_time = timings.get("queue_time")
+    if response.startswith("Error"):
+        record["error"] = response
+    else:
+        record["answer"] = response
+    record.update({
+        "scores": [score for _, score in relevant_chunks],
+        "retrieval_time": retrieval_time,
+        "queue_time": queue_time,
+        "generation_time": total - queue_time if queue_time is not None else None,
+        "total_time": total
+    })
+    return record
+
+
+def run_batch(questions_path, output_path, file_path=None, top_k=TOP_K_CHUNKS, concurrency=None, url=None):
+    """Answer every question in questions_path not yet answered in output_path; return a run summary."""
+    start = time.perf_counter()
+    questions = read_questions(questions_path)
+    done = answered_ids(output_path)
+    pending = list({qid: (qid, q) for qid, q in questions if qid not in done}.values())
+    logger.info(f"Batch: {len(questions)} questions, {len(questions) - len(pending)} already answered")
+    summary = {"questions": len(questions), "skipped": len(questions) - len(pending), "answered": 0, "errors": 0}
+    if not pending:
+        return summary
+
+    contexts = [[] for _ in pending]
+    retrieval_time = 0.0
+    if file_path:
+        index_start = time.perf_counter()
+        doc_processor.process_document(file_path)
+        doc_processor.wait_until_searchable()
+        summary["index_time"] = time.perf_counter() - index_start
+        retrieval_start = time.perf_counter()
+        contexts = retrieve([q for _, q in pending], top_k)
+        # one encode call and matrix product served every question
+        retrieval_time = (time.perf_counter() - retrieval_start) / len(pending)
+        summary["retrieval_time"] = retrieval_time * len(pending)
+
+    writer = AnswerWriter(output_path)
+    workers = concurrency or BATCH_QA_CONCURRENCY or llm_scheduler.slots
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    written = set()
+
+    def write(future):
+        record = future.result()
+        writer.write(record)
+        written.add(future)
+        summary["errors" if "error" in record else "answered"] += 1
+
+    try:
+        futures = [
+            executor.submit(answer_one, qid, question, chunks, retrieval_time, url)
+            for (qid, question), chunks in zip(pending, contexts)
+        ]
+        for future in as_completed(futures):
+            write(future)
+    finally:
+        # on interruption, questions that haven't started are dropped (a rerun answers
+        # them) and the ones being generated are finished and kept
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future in futures:
+            if future not in written and future.done() and not future.cancelled() and future.exception() is None:
+                write(future)
+        writer.close()
+    summary["elapsed"] = time.perf_counter() - start
+    summary["questions_per_second"] = len(pending) / summary["elapsed"]
+    logger.info(f"Batch finished: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions about a document")
+    parser.add_argument("--questions", required=True, help="text file with one question per line, or JSONL")
+    parser.add_argument("--file", help="PDF or TXT document to answer from")
+    parser.add_argument("--output", required=True, help="JSONL file answers are appended to")
+    parser.add_argument("--top-k", type=int, default=TOP_K_CHUNKS)
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="questions generated at once (default: BATCH_QA_CONCURRENCY or every LLM slot)")
+    parser.add_argument("--llm-url", nargs="+", default=LLM_URLS, help="completion endpoints to balance across")
+    args = parser.parse_args()
+
+    try:
+        summary = run_batch(args.questions, args.output, args.file, args.top_k, args.concurrency, args.llm_url)
+        print(json.dumps(summary, indent=2))
+    except KeyboardInterrupt:
+        print("\nInterrupted; rerun the same command to answer the remaining questions.")
+    finally:
+        system_monitor.save_summary()
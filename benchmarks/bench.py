@@ -0,0 +1,222 @@
+# benchmarks/bench.py
+"""End-to-end benchmark: replay questions through run_pipeline against a stub LLM server.
+
+Questions are the recorded inputs in logs/metrics_*.jsonl, or with --synthetic N are
+generated from the document's chunks. Reports model load and ingestion time, retrieval
+latency, end-to-end p50/p95/p99, throughput and peak RSS as JSON, for comparing commits.
+The index and response caches are off unless --warm-index / --response-cache are given;
+--no-compression sends retrieved chunks without the context compressor, for comparison.
+With --backends N requests are balanced across N stub servers (the scheduler admits
+--slots per server) and the report includes each backend's load and latency.
+Run from the repository root:
+    python -m benchmarks.bench --synthetic 200 --concurrency 8 --output bench.json
+"""
+import argparse
+import glob
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import psutil
+from config import UPLOAD_DIR, LOG_DIR
+from stub_llm_server import start_stub_server
+
+SAMPLE_PDF = UPLOAD_DIR / "A_Brief_Introduction_To_AI.pdf"
+
+
+def recorded_prompts(pattern, limit=None):
+    """Recorded "Human: ...\\nAssistant:" inputs from metrics files, oldest session first."""
+    prompts = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    prompt = json.loads(line).get("input")
+                except ValueError:
+                    # a line still being written
+                    continue
+                if prompt:
+                    prompts.append(prompt)
+    return prompts[:limit] if limit else prompts
+
+
+def synthetic_prompts(chunks, count, seed=0):
+    """Questions about the opening words of random chunks."""
+    rng = np.random.default_rng(seed)
+    prompts = []
+    for i in rng.integers(len(chunks), size=count):
+        topic = " ".join(chunks[i].split()[:8])
+        prompts.append(f"Human: What does the document say about {topic}?\nAssistant:")
+    return prompts
+
+
+class PeakRSS:
+    """Samples the process's resident memory in a background thread and keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def percentiles(values, scale=1.0):
+    """Summary of a list of durations (in seconds, times scale), or None if empty."""
+    if not values:
+        return None
+    values = np.asarray(values) * scale
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max())
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", default=str(SAMPLE_PDF), help="document to ask about")
+    parser.add_argument("--no-document", action="store_true", help="replay without document context")
+    parser.add_argument("--logs", default=str(LOG_DIR / "metrics_*.jsonl"), help="metrics files to replay")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate this many questions instead")
+    parser.add_argument("--limit", type=int, default=None, help="replay at most this many recorded questions")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="stream responses and measure time to first token")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="stub generation rate")
+    parser.add_argument("--max-tokens", type=int, default=32, help="stub tokens per response")
+    parser.add_argument("--slots", type=int, default=4, help="completions each stub serves in parallel")
+    parser.add_argument("--backends", type=int, default=1, help="stub servers to balance requests across")
+    parser.add_argument("--warm-index", action="store_true", help="allow the index cache during ingestion")
+    parser.add_argument("--response-cache", action="store_true", help="allow cached answers")
+    parser.add_argument("--no-compression", action="store_true",
+                        help="send the retrieved chunks as they are, without the context compressor")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # recorded before the run, so the run's own metrics can't be replayed
+    prompts = [] if args.synthetic else recorded_prompts(args.logs, args.limit)
+    if not args.synthetic and not prompts:
+        parser.error(f"no recorded inputs match {args.logs}; use --synthetic N")
+
+    import pipeline
+    from embedding_model import get_embedding_model
+    from llm import get_client
+    from system_monitor import system_monitor
+
+    # keep the benchmark's metrics out of logs/ and keep all of them for the report
+    metrics_dir = tempfile.TemporaryDirectory()
+    system_monitor.log_dir = metrics_dir.name
+    system_monitor.metrics = deque()
+    if not args.warm_index:
+        pipeline.doc_processor.index_cache = None
+    if not args.response_cache:
+        pipeline.response_cache_enabled = False
+    if args.no_compression:
+        pipeline.context_compressor = None
+
+    servers, urls = zip(*[start_stub_server(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                            max_tokens=args.max_tokens, slots=args.slots)
+                          for _ in range(args.backends)])
+    urls = list(urls)
+    pipeline.llm_scheduler.resize(args.slots * args.backends)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": vars(args)
+    }
+
+    with PeakRSS() as rss:
+        file_path = None if args.no_document else args.file
+        if file_path:
+            start = time.perf_counter()
+            get_embedding_model()
+            report["model_load_s"] = time.perf_counter() - start
+            start = time.perf_counter()
+            pipeline.doc_processor.process_document(file_path)
+            report["ingestion"] = {
+                "seconds": time.perf_counter() - start,
+                "pages": len(pipeline.doc_processor.pages),
+                "chunks": len(pipeline.doc_processor.chunks)
+            }
+        if args.synthetic:
+            if not file_path:
+                parser.error("--synthetic needs a document")
+            prompts = synthetic_prompts(pipeline.doc_processor.chunks, args.synthetic)
+
+        def ask(prompt):
+            start = time.perf_counter()
+            response = pipeline.run_pipeline(prompt, file_path, stream=args.stream, url=urls)
+            if args.stream:
+                response = "".join(response)
+            return time.perf_counter() - start, response.startswith("Error")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(ask, prompts))
+        elapsed = time.perf_counter() - start
+        system_monitor.flush()
+
+    metrics = list(system_monitor.metrics)
+    retrieval = [span["duration"] for m in metrics for span in m.get("spans", []) if span["name"] == "retrieval"]
+    context = [span["duration"] for m in metrics for span in m.get("spans", []) if span["name"] == "context"]
+    raw_chars = sum(m.get("context_chars_raw", 0) for m in metrics)
+    report.update({
+        "questions": len(prompts),
+        "errors": sum(error for _, error in results),
+        "end_to_end_s": percentiles([latency for latency, _ in results]),
+        "retrieval_ms": percentiles(retrieval, 1000),
+        "context_compression_ms": percentiles(context, 1000),
+        "context_reduction": 1 - sum(m.get("context_chars", 0) for m in metrics) / raw_chars if raw_chars else None,
+        "queue_s": percentiles([m["queue_time"] for m in metrics if m.get("queue_time") is not None]),
+        "time_to_first_token_s": percentiles([m["time_to_first_token"] for m in metrics
+                                              if m.get("time_to_first_token") is not None]),
+        "throughput_qps": len(prompts) / elapsed if elapsed > 0 else None,
+        "peak_rss_mb": rss.peak / 1024 / 1024,
+        "stub_max_active": [server.max_active for server in servers],
+        "backends": get_client(urls).endpoints.status()
+    })
+    for server in servers:
+        server.shutdown()
+    metrics_dir.cleanup()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_ann.py
+"""Ingestion, recall and latency of the multi-document CorpusIndex against brute force.
+
+Synthetic documents are added one at a time with CorpusIndex.add_chunks, so the switch
+to IVF search at ANN_MIN_CHUNKS and the retraining as the corpus doubles are exercised.
+Pass --files to also index real documents with add_document and search them by text.
+Run from the repository root:
+    python -m benchmarks.bench_ann --chunks 200000 --queries 200
+"""
+import argparse
+import time
+import numpy as np
+from config import ANN_MIN_CHUNKS
+from corpus_index import CorpusIndex
+from utils import top_k_indices
+
+
+def synthetic_embeddings(n, dim, clusters, rng):
+    """Normalized vectors drawn around random cluster centres, like real topic structure."""
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ingest(corpus, vectors, doc_chunks):
+    """Add vectors as documents of doc_chunks chunks; return (seconds, IVF trainings)."""
+    trainings = 0
+    start = time.perf_counter()
+    for n, first in enumerate(range(0, len(vectors), doc_chunks)):
+        rows = vectors[first:first + doc_chunks]
+        source = f"synthetic_{n}.pdf"
+        meta = [{"source": source, "page": i // 10 + 1, "offset": i * 500} for i in range(len(rows))]
+        trained = corpus.ivf
+        corpus.add_chunks(source, [f"{source} chunk {i}" for i in range(len(rows))], rows, meta)
+        trainings += corpus.ivf is not trained
+    return time.perf_counter() - start, trainings
+
+
+def search_files(files, queries, top_k):
+    """Index real documents through add_document and time text queries."""
+    corpus = CorpusIndex()
+    start = time.perf_counter()
+    for file_path in files:
+        corpus.add_document(file_path)
+    print(f"\n{len(corpus.documents)} files, {len(corpus.chunks)} chunks indexed in {time.perf_counter() - start:.2f}s")
+    for query in queries:
+        start = time.perf_counter()
+        results = corpus.search(query, top_k)
+        print(f"{query!r}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        for chunk, score, meta in results:
+            print(f"  {score:.3f} {meta['source']} p.{meta['page']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--doc-chunks", type=int, default=5000, help="chunks per synthetic document")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-ann-chunks", type=int, default=ANN_MIN_CHUNKS)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--files", nargs="+", help="real PDF/TXT documents to index and search by text")
+    parser.add_argument("--query", nargs="+", default=["What is artificial intelligence?"],
+                        help="text queries for --files")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_embeddings(args.chunks, args.dim, 1000, rng)
+    queries = synthetic_embeddings(args.queries, args.dim, 1000, rng)
+
+    corpus = CorpusIndex(min_ann_chunks=args.min_ann_chunks)
+    ingest_s, trainings = ingest(corpus, vectors, args.doc_chunks)
+    print(f"{len(corpus.documents)} documents, {len(corpus.chunks)} chunks x {args.dim} dims, top-{args.top_k}")
+    print(f"ingest: {ingest_s:.2f}s, IVF trained {trainings} times"
+          f"{f' ({corpus.ivf.nlist} lists)' if corpus.ivf is not None else ''}")
+
+    # brute force over the same matrix is the ground truth
+    embeddings = corpus.embeddings
+    start = time.perf_counter()
+    truth = [set(top_k_indices(embeddings @ q, args.top_k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+    print(f"{'method':<16}{'recall':>8}{'ms/query':>10}")
+    print(f"{'exact':<16}{1.0:>8.3f}{exact_ms:>10.3f}")
+
+    for nprobe in args.nprobe if corpus.ivf is not None else []:
+        corpus.ivf.nprobe = nprobe
+        start = time.perf_counter()
+        found = [set(corpus.search_embedding(q, args.top_k)[0].tolist()) for q in queries]
+        ivf_ms = (time.perf_counter() - start) * 1000 / args.queries
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall:>8.3f}{ivf_ms:>10.3f}")
+
+    # every result carries the document and page it came from
+    ids, _ = corpus.search_embedding(queries[0], args.top_k)
+    print("sample result sources:", [(corpus.chunk_meta[i]["source"], corpus.chunk_meta[i]["page"]) for i in ids])
+
+    if args.files:
+        search_files(args.files, args.query, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
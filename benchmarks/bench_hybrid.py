@@ -0,0 +1,86 @@
+# benchmarks/bench_hybrid.py
+"""BM25 + vector (hybrid) retrieval against vector-only search.
+
+Queries ask about rare terms (identifiers, names, numbers) taken from the document; a
+query is answered when a retrieved chunk contains all of its terms. Reports BM25 build
+time, query latency, answer recall@k and the prompt tokens needed to reach vector
+search's recall at TOP_K_CHUNKS. Run from the repository root:
+    python -m benchmarks.bench_hybrid --queries 200
+"""
+import argparse
+import time
+import numpy as np
+from bm25 import BM25Index, tokenize
+from config import UPLOAD_DIR, TOP_K_CHUNKS, CHARS_PER_TOKEN
+from document_processor import DocumentProcessor
+
+SAMPLE_PDF = UPLOAD_DIR / "A_Brief_Introduction_To_AI.pdf"
+KS = [1, 2, 3, 5, 8, 10]
+
+
+def rare_term_queries(chunks, lexical, count, seed=0):
+    """Build (query, terms) pairs from the two rarest terms of random chunks."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(len(chunks), size=count):
+        terms = sorted(set(t for t in tokenize(chunks[i]) if len(t) > 3),
+                       key=lambda t: len(lexical.postings[t][0]))[:2]
+        if terms:
+            queries.append((f"What does the document say about {' and '.join(terms)}?", terms))
+    return queries
+
+
+def evaluate(processor, queries, hybrid):
+    """Return (recall at each k, mean prompt tokens at each k, ms per query)."""
+    chunks = processor.chunks
+    hits = np.zeros((len(queries), len(KS)))
+    tokens = np.zeros((len(queries), len(KS)))
+    elapsed = 0.0
+    for row, (query, terms) in enumerate(queries):
+        start = time.perf_counter()
+        embedding = processor.embed_query(query)
+        ids, _ = processor.search_embedding(embedding, max(KS), query=query if hybrid else None)
+        elapsed += time.perf_counter() - start
+        answered = [all(t in set(tokenize(chunks[i])) for t in terms) for i in ids]
+        lengths = [len(chunks[i]) // CHARS_PER_TOKEN for i in ids]
+        for col, k in enumerate(KS):
+            hits[row, col] = any(answered[:k])
+            tokens[row, col] = sum(lengths[:k])
+    return hits.mean(axis=0), tokens.mean(axis=0), elapsed / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", default=str(SAMPLE_PDF))
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    processor = DocumentProcessor(use_cache=False, hybrid=True)
+    processor.process_document(args.file)
+    start = time.perf_counter()
+    lexical = BM25Index()
+    lexical.add(processor.chunks)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"{len(processor.chunks)} chunks, {len(lexical.postings)} terms, BM25 build {build_ms:.1f} ms")
+
+    queries = rare_term_queries(processor.chunks, lexical, args.queries)
+    results = {name: evaluate(processor, queries, hybrid) for name, hybrid in [("vector", False), ("hybrid", True)]}
+
+    print(f"\n{'':<8}{'ms/query':>9}" + "".join(f"{'R@' + str(k):>7}" for k in KS))
+    for name, (recall, _, latency) in results.items():
+        print(f"{name:<8}{latency:>9.1f}" + "".join(f"{r:>7.2f}" for r in recall))
+
+    # smallest k at which each method matches vector search's recall at TOP_K_CHUNKS
+    target = np.interp(TOP_K_CHUNKS, KS, results["vector"][0])
+    print(f"\nprompt tokens to reach recall {target:.2f}:")
+    for name, (recall, tokens, _) in results.items():
+        reached = np.flatnonzero(recall >= target - 1e-9)
+        if len(reached):
+            col = reached[0]
+            print(f"  {name:<8} k={KS[col]:<3} {tokens[col]:.0f} tokens")
+        else:
+            print(f"  {name:<8} not reached within k={KS[-1]}")
+
+
+if __name__ == "__main__":
+    main()
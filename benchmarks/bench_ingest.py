@@ -0,0 +1,71 @@
+# benchmarks/bench_ingest.py
+"""PDF extraction throughput (pages/sec) against the number of worker processes.
+
+Run from the repository root:
+    python -m benchmarks.bench_ingest --copies 40
+"""
+import argparse
+import os
+import tempfile
+import time
+import PyPDF2
+from config import UPLOAD_DIR
+from document_processor import extract_pdf_pages
+
+SAMPLE_PDF = UPLOAD_DIR / "A_Brief_Introduction_To_AI.pdf"
+
+
+def synthetic_pdf(source, copies, path):
+    """Write a large PDF made of the source PDF's pages repeated copies times."""
+    reader = PyPDF2.PdfReader(str(source))
+    writer = PyPDF2.PdfWriter()
+    for _ in range(copies):
+        for page in reader.pages:
+            writer.add_page(page)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def worker_counts(max_workers):
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+
+def bench(path, workers, repeats):
+    """Return the best pages/sec over a few runs."""
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pages = extract_pdf_pages(str(path), workers=workers)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(pages) / elapsed)
+    return len(pages), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--copies", type=int, default=40, help="repeats of the sample PDF in the synthetic one")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        large = os.path.join(tmp, "synthetic.pdf")
+        synthetic_pdf(SAMPLE_PDF, args.copies, large)
+
+        for name, path in [("sample", SAMPLE_PDF), ("synthetic", large)]:
+            print(f"\n{name}: {path}")
+            print(f"{'workers':>8}{'pages':>8}{'pages/s':>10}{'speedup':>9}")
+            baseline = None
+            for workers in worker_counts(args.max_workers):
+                pages, rate = bench(path, workers, args.repeats)
+                baseline = baseline or rate
+                print(f"{workers:>8}{pages:>8}{rate:>10.1f}{rate / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
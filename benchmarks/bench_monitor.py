@@ -0,0 +1,60 @@
+# benchmarks/bench_monitor.py
+"""Per-call overhead of SystemMonitor.monitor with the background writer and with synchronous writes.
+
+A monitored no-op returns a fixed-size response; the cost per call is compared with
+the undecorated function at 1 and 8 threads. Run from the repository root:
+    python -m benchmarks.bench_monitor --calls 20000
+"""
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from system_monitor import SystemMonitor
+
+
+def per_call_us(func, calls, threads):
+    """Mean wall time per call in microseconds when `threads` threads share the calls."""
+    prompts = [f"Human: question {i}\nAssistant:" for i in range(calls)]
+    start = time.perf_counter_ns()
+    if threads == 1:
+        for prompt in prompts:
+            func(prompt)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(func, prompts))
+    return (time.perf_counter_ns() - start) / calls / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--response-chars", type=int, default=2000)
+    parser.add_argument("--max-output-chars", type=int, default=None)
+    args = parser.parse_args()
+
+    response = "x" * args.response_chars
+
+    def answer(prompt):
+        return response
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        monitors = [
+            ("background", SystemMonitor(log_dir, max_output_chars=args.max_output_chars)),
+            ("synchronous", SystemMonitor(log_dir, max_output_chars=args.max_output_chars, background=False)),
+        ]
+        print(f"{args.calls} calls, {args.response_chars} char responses")
+        print(f"\n{'threads':>7}{'bare us':>10}" + "".join(f"{name + ' us':>17}" for name, _ in monitors))
+        for threads in [1, 8]:
+            row = f"{threads:>7}{per_call_us(answer, args.calls, threads):>10.2f}"
+            for _, monitor in monitors:
+                row += f"{per_call_us(monitor.monitor(answer), args.calls, threads):>17.2f}"
+            print(row)
+
+        start = time.perf_counter()
+        monitors[0][1].flush()
+        print(f"\nbackground writer caught up {(time.perf_counter() - start) * 1000:.0f} ms after the last call")
+        print(f"metrics kept in memory: {len(monitors[0][1].metrics)} (ring buffer)")
+
+
+if __name__ == "__main__":
+    main()
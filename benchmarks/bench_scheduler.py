@@ -0,0 +1,70 @@
+# benchmarks/bench_scheduler.py
+"""Queue times and load shedding of the LLM scheduler against a slow stub server.
+
+Fires a burst of interactive and batch requests at once, with and without the
+scheduler in front of the server. Run from the repository root:
+    python -m benchmarks.bench_scheduler --requests 40 --slo 2
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from llm import run_llm
+from scheduler import LLMScheduler, OverloadedError, INTERACTIVE, BATCH
+from stub_llm_server import start_stub_server
+
+
+def burst(url, requests, scheduler=None):
+    """Send every request at once; return (priority, latency or None if shed) per request."""
+    def one(i):
+        priority = BATCH if i % 2 else INTERACTIVE
+        start = time.perf_counter()
+        try:
+            if scheduler is None:
+                run_llm(f"Question {i}?", url=url)
+            else:
+                with scheduler.slot(priority):
+                    run_llm(f"Question {i}?", url=url)
+        except OverloadedError:
+            return priority, None
+        return priority, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        return list(executor.map(one, range(requests)))
+
+
+def report(name, results, server):
+    print(f"\n{name}: most requests served at once = {server.max_active}")
+    print(f"{'priority':>12}{'done':>6}{'shed':>6}{'p50 ms':>9}{'p99 ms':>9}")
+    for priority, label in [(INTERACTIVE, "interactive"), (BATCH, "batch")]:
+        latencies = [latency for p, latency in results if p == priority and latency is not None]
+        shed = sum(1 for p, latency in results if p == priority and latency is None)
+        p50, p99 = (np.percentile(latencies, [50, 99]) * 1000) if latencies else (0, 0)
+        print(f"{label:>12}{len(latencies):>6}{shed:>6}{p50:>9.0f}{p99:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--slots", type=int, default=4, help="parallel slots of the stub server")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--slo", type=float, default=2.0, help="interactive queue SLO in seconds")
+    args = parser.parse_args()
+
+    for name, scheduler in [
+        ("no scheduler", None),
+        ("scheduler", LLMScheduler(slots=args.slots, queue_slo=args.slo, batch_queue_slo=None)),
+    ]:
+        server, url = start_stub_server(latency=args.latency, slots=args.slots)
+        try:
+            report(name, burst(url, args.requests, scheduler), server)
+            if scheduler is not None:
+                stats = scheduler.get_stats()
+                print(f"avg queue time {stats['avg_queue_time']:.2f}s, "
+                      f"max {stats['max_queue_time']:.2f}s, shed {stats['shed']}")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
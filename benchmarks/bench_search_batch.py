@@ -0,0 +1,60 @@
+# benchmarks/bench_search_batch.py
+"""Search throughput with and without query micro-batching at 1, 8 and 64 concurrent queries.
+
+Run from the repository root:
+    python -m benchmarks.bench_search_batch --queries 256
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import UPLOAD_DIR, TOP_K_CHUNKS
+from document_processor import DocumentProcessor
+
+SAMPLE_PDF = UPLOAD_DIR / "A_Brief_Introduction_To_AI.pdf"
+
+QUESTIONS = [
+    "What is artificial intelligence?",
+    "Who coined the term machine learning?",
+    "How do neural networks learn?",
+    "What are the risks of AI?",
+    "Explain supervised and unsupervised learning.",
+    "What is the Turing test?",
+    "Which industries use AI today?",
+    "What is natural language processing?",
+]
+
+
+def throughput(search, queries, concurrency):
+    """Run every query through search from `concurrency` threads; return queries/sec."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(search, queries))
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--file", default=str(SAMPLE_PDF))
+    args = parser.parse_args()
+
+    processor = DocumentProcessor()
+    processor.process_document(args.file)
+    queries = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i})" for i in range(args.queries)]
+    # load and warm up the model before timing
+    processor.search_many(queries[:8])
+
+    start = time.perf_counter()
+    processor.search_many(queries, TOP_K_CHUNKS)
+    print(f"{len(processor.chunks)} chunks; search_many over all queries: "
+          f"{len(queries) / (time.perf_counter() - start):.0f} queries/s\n")
+
+    print(f"{'concurrent':>10}{'search q/s':>13}{'batched q/s':>13}{'speedup':>9}")
+    for concurrency in [1, 8, 64]:
+        single = throughput(lambda q: processor.search(q, TOP_K_CHUNKS), queries, concurrency)
+        batched = throughput(lambda q: processor.submit_search(q, TOP_K_CHUNKS).result(), queries, concurrency)
+        print(f"{concurrency:>10}{single:>13.0f}{batched:>13.0f}{batched / single:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
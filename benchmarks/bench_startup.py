@@ -0,0 +1,64 @@
+# benchmarks/bench_startup.py
+"""Cold import time of the CLI, pipeline and dashboard modules.
+
+Every import runs in a fresh interpreter so nothing is already loaded. Run from
+the repository root:
+    python -m benchmarks.bench_startup --repeats 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ["main", "pipeline", "dashboard"]
+
+# times the import inside the child so interpreter startup is not counted
+TIMER = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def cold_import(module):
+    """Import module in a new interpreter; return (seconds, -X importtime lines) or raise."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TIMER.format(module=module)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr.splitlines()
+
+
+def slowest_imports(lines, count):
+    """Return the top-level imports with the largest cumulative time (microseconds)."""
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        # only direct imports of the benchmarked module (one level of nesting)
+        if name.startswith("   ") and not name.startswith("    "):
+            imports.append((int(cumulative_us), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="slowest direct imports to list per module")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        try:
+            runs = [cold_import(module) for _ in range(args.repeats)]
+        except RuntimeError as e:
+            print(f"\n{module}: import failed ({e})")
+            continue
+        times = [seconds for seconds, _ in runs]
+        print(f"\n{module}: median {statistics.median(times) * 1000:.0f} ms, "
+              f"min {min(times) * 1000:.0f} ms over {len(times)} runs")
+        for cumulative_us, name in slowest_imports(runs[-1][1], args.top):
+            print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_storage.py
+"""Memory, recall and latency of DocumentProcessor.search per embedding storage mode.
+
+The document's index is padded with noisy copies of its own embeddings to emulate a
+large corpus. Recall@k is measured against float32 vector search (hybrid search is off). Run from the repository root:
+    python -m benchmarks.bench_storage --extra-rows 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from config import UPLOAD_DIR, TOP_K_CHUNKS
+from compact_storage import QuantizedEmbeddings, TextBuffer
+from document_processor import DocumentProcessor
+
+SAMPLE_PDF = UPLOAD_DIR / "A_Brief_Introduction_To_AI.pdf"
+
+
+def list_bytes(texts):
+    """Memory of a list of str: the list itself plus every string object."""
+    return sys.getsizeof(texts) + sum(sys.getsizeof(text) for text in texts)
+
+
+def padded_corpus(chunks, embeddings, extra_rows, seed=0):
+    """Append extra_rows perturbed copies of the document's embeddings."""
+    rng = np.random.default_rng(seed)
+    base = embeddings[rng.integers(len(embeddings), size=extra_rows)]
+    noisy = base + rng.normal(scale=0.05, size=base.shape).astype(np.float32)
+    noisy /= np.linalg.norm(noisy, axis=1, keepdims=True)
+    texts = list(chunks) + [f"{chunks[i % len(chunks)][:200]} (copy {i})" for i in range(extra_rows)]
+    return texts, np.vstack([embeddings, noisy]).astype(np.float32)
+
+
+def run_queries(processor, queries, top_k):
+    """Return the result texts per query and the mean latency in ms."""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append([chunk for chunk, _ in processor.search(query, top_k)])
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", default=str(SAMPLE_PDF))
+    parser.add_argument("--extra-rows", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=TOP_K_CHUNKS)
+    args = parser.parse_args()
+
+    # vector search only: a BM25 index over the unpadded chunks would skew recall
+    processor = DocumentProcessor(use_cache=False, hybrid=False)
+    processor.process_document(args.file)
+    texts, matrix = padded_corpus(processor.chunks, np.asarray(processor.embeddings), args.extra_rows)
+    rng = np.random.default_rng(1)
+    # the start of a chunk is a realistic query for the text around it
+    queries = [processor.chunks[i][:120] for i in rng.integers(len(processor.chunks), size=args.queries)]
+    print(f"{len(texts)} chunks, {len(queries)} queries, top_k={args.top_k}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the full precision copy lives on disk, as in the index cache
+        path = os.path.join(tmp, "embeddings.npy")
+        np.save(path, matrix)
+        full_precision = np.load(path, mmap_mode='r')
+
+        buffer = TextBuffer(texts)
+        modes = [
+            ("float32 + list", matrix, texts),
+            ("float16 + buffer", QuantizedEmbeddings(matrix, "float16", full_precision), buffer),
+            ("int8 + buffer", QuantizedEmbeddings(matrix, "int8", full_precision), buffer),
+            ("int8, no rescore", QuantizedEmbeddings(matrix, "int8", None), buffer),
+        ]
+        print(f"\n{'mode':<18}{'embeddings MB':>14}{'chunks MB':>11}{'recall@k':>10}{'ms/query':>10}")
+        exact = None
+        for name, embeddings, chunks in modes:
+            processor.chunks, processor.embeddings = chunks, embeddings
+            results, latency = run_queries(processor, queries, args.top_k)
+            exact = exact or results
+            recall = np.mean([len(set(r) & set(e)) / len(e) for r, e in zip(results, exact)])
+            chunk_bytes = chunks.nbytes if isinstance(chunks, TextBuffer) else list_bytes(chunks)
+            print(f"{name:<18}{embeddings.nbytes / 2**20:>14.1f}{chunk_bytes / 2**20:>11.1f}"
+                  f"{recall:>10.3f}{latency:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
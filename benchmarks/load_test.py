@@ -0,0 +1,90 @@
+# benchmarks/load_test.py
+"""Throughput and latency of the chat server under concurrent sessions.
+
+Starts a stub LLM server and the chat server, then drives it with concurrent
+clients. Run from the repository root:
+    python -m benchmarks.load_test --sessions 32 --messages 5
+"""
+import argparse
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+import aiohttp
+import numpy as np
+from stub_llm_server import start_stub_server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for(url, timeout=120):
+    """Poll until the server answers (model loading can take a while)."""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            try:
+                async with http.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Server at {url} did not start")
+
+
+async def client(http, base, messages, latencies):
+    """One user: open a session and send messages one after another."""
+    async with http.post(f"{base}/sessions") as response:
+        session_id = (await response.json())["session_id"]
+    for i in range(messages):
+        start = time.perf_counter()
+        async with http.post(f"{base}/sessions/{session_id}/chat", json={"message": f"Question {i}?"}) as response:
+            await response.json()
+        latencies.append(time.perf_counter() - start)
+    await http.delete(f"{base}/sessions/{session_id}")
+
+
+async def run(base, sessions, messages):
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=sessions)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http, base, messages, latencies) for _ in range(sessions)))
+        elapsed = time.perf_counter() - start
+    latencies = np.array(latencies)
+    print(f"sessions={sessions} messages={len(latencies)} time={elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency p50: {np.percentile(latencies, 50) * 1000:.0f} ms  "
+          f"p99: {np.percentile(latencies, 99) * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    args = parser.parse_args()
+
+    stub, llm_url = start_stub_server(latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second)
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), "--llm-url", llm_url
+    ])
+    base = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_for(f"{base}/health"))
+        asyncio.run(run(base, args.sessions, args.messages))
+    finally:
+        server.terminate()
+        server.wait()
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bm25.py
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+from config import BM25_K1, BM25_B, RRF_K
+from utils import top_k_indices
+
+# words, plus identifiers such as "E-1042", "part_no.3" or "v2/api" kept whole
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase tokens; compound identifiers are also split into their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.split(r"[-_./]", token))
+    return tokens
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over chunks, built incrementally."""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.total_length = 0
+        # postings converted to arrays, rebuilt after a term gets new documents
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, texts: Iterable[str]) -> None:
+        """Index texts as the next document ids."""
+        with self._lock:
+            for text in texts:
+                doc_id = len(self.doc_lengths)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    ids, tfs = self.postings.setdefault(term, ([], []))
+                    ids.append(doc_id)
+                    tfs.append(tf)
+                    self._arrays.pop(term, None)
+                length = sum(counts.values())
+                self.doc_lengths.append(length)
+                self.total_length += length
+
+    def search(self, query: str, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of the top_k matching documents, best first."""
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if n_docs == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            avg_length = self.total_length / n_docs
+            lengths = np.asarray(self.doc_lengths, dtype=np.float32)
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for term in set(tokenize(query)):
+                if term not in self.postings:
+                    continue
+                ids, tfs = self._posting_arrays(term)
+                idf = math.log((n_docs - len(ids) + 0.5) / (len(ids) + 0.5) + 1)
+                norm = self.k1 * (1 - self.b + self.b * lengths[ids] / avg_length)
+                scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        matched = np.flatnonzero(scores)
+        ids = matched[top_k_indices(scores[matched], top_k)]
+        return ids, scores[ids]
+
+    def _posting_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            ids, tfs = self.postings[term]
+            arrays = (np.asarray(ids, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+            self._arrays[term] = arrays
+        return arrays
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], top_k: int, k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)). Returns (ids, scores), best first."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank)
+    ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float32, count=len(fused))
+    order = top_k_indices(scores, top_k)
+    return ids[order], scores[order]
@@ -0,0 +1,112 @@
+# compact_storage.py
+from collections.abc import Sequence
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from config import RESCORE_FACTOR
+from utils import top_k_rows
+
+# rows converted to float32 at a time while scoring (small enough to stay in CPU cache)
+SCORE_BLOCK_ROWS = 1024
+
+
+class QuantizedEmbeddings:
+    """Embedding matrix stored as float16 or int8 scalar-quantized codes.
+
+    int8 codes use a per-dimension scale (max |value| / 127). Search scores the codes,
+    then rescores the top top_k * RESCORE_FACTOR candidates against a full precision
+    matrix (usually the index cache's memory-mapped .npy, so only those rows are read).
+    Without one, the approximate scores are returned.
+    """
+
+    def __init__(self, embeddings: np.ndarray, dtype: str = "int8", full_precision: Optional[np.ndarray] = None,
+                 rescore_factor: int = RESCORE_FACTOR):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported embedding storage: {dtype}")
+        self.dtype = dtype
+        self.full_precision = full_precision
+        self.rescore_factor = rescore_factor
+        self.scale = None
+        self.codes = np.empty((len(embeddings), embeddings.shape[1] if len(embeddings) else 0),
+                              dtype=np.float16 if dtype == "float16" else np.int8)
+        if dtype == "int8" and len(embeddings):
+            max_abs = np.abs(embeddings).max(axis=0).astype(np.float32)
+            self.scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        # quantize block by block so a memory-mapped source is never loaded whole
+        for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            if self.scale is not None:
+                block = np.clip(np.rint(block / self.scale), -127, 127)
+            self.codes[start:start + len(block)] = block
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory (the full precision matrix stays on disk)."""
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """Approximate similarity of each query (row) to every stored vector."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if self.scale is not None:
+            # (codes * scale) @ q == codes @ (q * scale)
+            queries = queries * self.scale
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        """Return the vectors at ids as float32, in full precision when available."""
+        if self.full_precision is not None:
+            return np.asarray(self.full_precision[ids], dtype=np.float32)
+        vectors = self.codes[ids].astype(np.float32)
+        return vectors * self.scale if self.scale is not None else vectors
+
+    def search(self, query_embeddings: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) per query, rescored in full precision when possible."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        approximate = self.scores(queries)
+        if self.full_precision is None or self.rescore_factor <= 1:
+            ids = top_k_rows(approximate, top_k)
+            return ids, np.take_along_axis(approximate, ids, axis=1)
+
+        candidates = top_k_rows(approximate, top_k * self.rescore_factor)
+        # reads only the candidate rows from the (memory-mapped) full precision matrix
+        vectors = np.asarray(self.full_precision[candidates.ravel()], dtype=np.float32)
+        vectors = vectors.reshape(candidates.shape + (-1,))
+        exact = np.einsum('qd,qkd->qk', queries, vectors)
+        order = np.argsort(exact, axis=1)[:, ::-1][:, :top_k]
+        return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+
+class TextBuffer(Sequence):
+    """Read-only list of strings kept as one UTF-8 buffer plus an offsets array."""
+
+    def __init__(self, texts: Iterable[str]):
+        encoded = [text.encode('utf-8') for text in texts]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=self.offsets[1:])
+        self.buffer = b"".join(encoded)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TextBuffer index out of range")
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer) + self.offsets.nbytes
@@ -13,9 +13,61 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(LOG_DIR, exist_ok=True)
 
 # Document processing
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+CHUNK_TOKENS = 200  # embedding tokenizer tokens per chunk (all-MiniLM-L6-v2 reads up to 256)
+CHUNK_OVERLAP_TOKENS = 40  # sentences repeated when a chunk is split inside a paragraph
 TOP_K_CHUNKS = 5
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 32  # chunks encoded per model call
+EMBEDDING_WARMUP = True  # load the model in the background once a document is chosen
+SEARCH_BATCH_MAX = 64  # concurrent queries encoded in one model call
+SEARCH_BATCH_WAIT = 0.002  # seconds to wait for more queries; 0 only batches queries that queued up meanwhile
+EMBEDDING_STORAGE = "float32"  # "float16" or "int8" to quantize embeddings held in memory
+RESCORE_FACTOR = 4  # quantized search rescores top_k * RESCORE_FACTOR candidates in float32
+CHUNK_TEXT_BUFFER = False  # keep chunk texts in one contiguous buffer instead of a list
+PDF_WORKERS = os.cpu_count()  # processes for PDF text extraction
+PDF_PARALLEL_MIN_PAGES = 16  # smaller PDFs are extracted in-process
+
+# Hybrid retrieval (BM25 fused with vector search by reciprocal rank fusion)
+HYBRID_SEARCH = True
+HYBRID_CANDIDATES = 50  # results taken from each retriever before fusion
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+# Context compression (after retrieval, before the prompt)
+CONTEXT_COMPRESSION = True
+CONTEXT_MIN_SIMILARITY = 0.2  # chunks less cosine-similar to the question are dropped
+RERANK_ENABLED = True  # reorder candidates with a cross-encoder (skipped if it can't be loaded)
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_CANDIDATES = 10  # chunks retrieved for reranking, of which TOP_K_CHUNKS are kept
+RERANK_CACHE_SIZE = 4096  # cached question/chunk scores
+CONTEXT_SENTENCE_BUDGET = 384  # tokens of the most relevant sentences kept from the chunks
+SENTENCE_CACHE_SIZE = 8192  # cached sentence embeddings
+
+# Corpus search (exact below ANN_MIN_CHUNKS, IVF approximate search above)
+ANN_MIN_CHUNKS = 20000
+IVF_NPROBE = 16  # lists scanned per query; higher is slower but more accurate
+IVF_TRAIN_ITERATIONS = 10
+
+# Files uploaded to the chat server, one directory per session (removed when it ends)
+SESSION_UPLOAD_DIR = UPLOAD_DIR / "sessions"
+
+# Index cache (chunks + embeddings reused across sessions)
+INDEX_CACHE_DIR = UPLOAD_DIR / ".index_cache"
+INDEX_CACHE_MAX_MB = 2048
+
+# Response cache (answers reused for repeated questions about the same document)
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_FILE = UPLOAD_DIR / ".response_cache.jsonl"
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_TTL = 24 * 3600  # seconds
+RESPONSE_CACHE_SIMILARITY = 0.95  # question similarity for a semantic hit; None for exact matches only
+
+# Metrics (written to logs/metrics_<session>.jsonl by a background thread)
+METRICS_FLUSH_INTERVAL = 1.0  # seconds between batched writes
+METRICS_BUFFER_SIZE = 1000  # most recent query metrics kept in memory
+METRICS_MAX_OUTPUT_CHARS = None  # truncate logged responses to this many characters; None keeps them whole
+METRICS_STORE_MAX_PARTS = 32  # Parquet files per day partition before they are merged into one
 
 # Caching and retries
 MAX_RETRIES = 3
@@ -25,6 +77,36 @@ RETRY_DELAY = 1
 LLM_PORT = 8080
 LLM_HOST = "localhost"
 LLM_URL = f"http://{LLM_HOST}:{LLM_PORT}/completion"
+LLM_URLS = [LLM_URL]  # completion endpoints; each request goes to the one with the fewest in flight
+LLM_AFFINITY_SLACK = 1  # extra in-flight requests tolerated to keep a session on the endpoint holding its KV cache
+LLM_AFFINITY_SESSIONS = 4096  # sessions whose last endpoint is remembered
+LLM_CONNECT_TIMEOUT = 3.05  # seconds to establish a connection
+LLM_READ_TIMEOUT = 300  # seconds without data from the server (between tokens when streaming)
+LLM_BREAKER_FAILURES = 3  # consecutive failures that open an endpoint's circuit
+LLM_BREAKER_COOLDOWN = 10  # seconds an open circuit waits before health checks may close it
+LLM_HEALTH_INTERVAL = 5  # seconds between health checks of failing endpoints
 LLM_MAX_TOKENS = 1024
 LLM_TEMPERATURE = 0.7
 LLM_STOP_WORDS = ["</s>", "Human:", "Assistant:"]
+LLM_STREAM = True  # print tokens as they are generated
+LLM_CACHE_PROMPT = True  # let the server reuse its KV cache for a shared prompt prefix
+LLM_SLOTS = 4  # parallel slots each llamafile server was started with (-np)
+LLM_POOL_SIZE = 16  # keep-alive connections held by the async client
+LLM_QUEUE_SLO = 30.0  # seconds an interactive request may wait for a slot before it is shed
+LLM_BATCH_QUEUE_SLO = None  # batch requests wait as long as it takes
+BATCH_QA_CONCURRENCY = None  # questions batch_qa.py generates at once (None: one per LLM slot)
+
+# Chat server
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 8000
+EMBED_WORKERS = 4  # threads for document processing and query encoding
+
+# Prompt construction
+SYSTEM_PROMPT = "You are a helpful assistant. Use the document context when it is relevant to the question."
+CHARS_PER_TOKEN = 4  # rough estimate when the server doesn't report token counts
+
+# Token budgets (the model's context also has to fit LLM_MAX_TOKENS of output)
+CONTEXT_TOKEN_BUDGET = 3072  # hard cap on the whole prompt
+HISTORY_TOKEN_BUDGET = 1536  # prior turns, including chunks pinned in them
+CHUNK_TOKEN_BUDGET = 1024  # newly retrieved chunks added in a single turn
+SUMMARY_KEEP_TURNS = 2  # most recent turns never folded into the summary
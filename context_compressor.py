@@ -0,0 +1,194 @@
+# context_compressor.py
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+import numpy as np
+from config import (
+    TOP_K_CHUNKS, CHARS_PER_TOKEN, CONTEXT_MIN_SIMILARITY, RERANK_ENABLED, RERANK_MODEL,
+    RERANK_CACHE_SIZE, CONTEXT_SENTENCE_BUDGET, SENTENCE_CACHE_SIZE
+)
+from document_processor import SENTENCE_END, PARAGRAPH_BREAK
+from logger import logger
+from system_monitor import system_monitor
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+    from document_processor import DocumentProcessor
+
+_reranker: Optional["CrossEncoder"] = None
+_reranker_unavailable = False
+_lock = threading.Lock()
+
+
+def get_reranker() -> Optional["CrossEncoder"]:
+    """Return the shared cross-encoder, loading it on first use; None if it can't be loaded."""
+    global _reranker, _reranker_unavailable
+    if _reranker is None and not _reranker_unavailable:
+        with _lock:
+            if _reranker is None and not _reranker_unavailable:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    logger.info("Loading cross-encoder reranker...")
+                    _reranker = CrossEncoder(RERANK_MODEL)
+                    logger.info("Reranker loaded successfully")
+                except Exception as e:
+                    # e.g. no network to download it: keep the retrieval order
+                    _reranker_unavailable = True
+                    logger.warning(f"Reranker unavailable, keeping retrieval order: {str(e)}")
+    return _reranker
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a chunk into sentences the same way the chunker does."""
+    return [
+        sentence
+        for paragraph in PARAGRAPH_BREAK.split(text)
+        for sentence in SENTENCE_END.split(" ".join(paragraph.split()))
+        if sentence
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ContextCompressor:
+    """Post-retrieval stage that shrinks the document context sent to the LLM.
+
+    Candidates less cosine-similar to the question than min_similarity are dropped,
+    the rest are reranked with a cross-encoder (scores cached per question and chunk)
+    and the best top_k kept. Overlapping chunks are merged, and only the sentences most
+    similar to the question are kept, up to token_budget tokens, in document order.
+    """
+
+    def __init__(self, min_similarity: float = CONTEXT_MIN_SIMILARITY, rerank: bool = RERANK_ENABLED,
+                 top_k: int = TOP_K_CHUNKS, token_budget: int = CONTEXT_SENTENCE_BUDGET,
+                 rerank_cache_size: int = RERANK_CACHE_SIZE, sentence_cache_size: int = SENTENCE_CACHE_SIZE):
+        self.min_similarity = min_similarity
+        self.rerank_enabled = rerank
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.rerank_cache_size = rerank_cache_size
+        self.sentence_cache_size = sentence_cache_size
+        # (question, chunk) -> cross-encoder score
+        self._rerank_scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        # sentence -> normalized embedding
+        self._sentence_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def select(self, question: str, query_embedding: np.ndarray, processor: "DocumentProcessor",
+               ids: Iterable[int], top_k: Optional[int] = None) -> Tuple[List[int], List[Tuple[str, float]]]:
+        """Return (kept chunk ids, compressed (text, score) context) for retrieved candidate ids."""
+        top_k = top_k or self.top_k
+        ids = [int(i) for i in ids]
+        chunks = processor.chunks
+        # what the prompt would have carried without this stage
+        raw = processor.merge_overlapping(ids[:top_k], range(len(ids[:top_k])))
+        raw_chars = sum(len(text) for text, _ in raw)
+
+        similarities = processor.similarities(query_embedding, ids)
+        kept = [(i, float(s)) for i, s in zip(ids, similarities) if s >= self.min_similarity]
+        if kept and self.rerank_enabled:
+            with system_monitor.span("rerank"):
+                kept = self.rerank(question, kept, chunks)
+        kept = kept[:top_k]
+
+        merged = processor.merge_overlapping([i for i, _ in kept], [s for _, s in kept])
+        with system_monitor.span("compress"):
+            context = self.compress(query_embedding, merged, processor.model)
+        chars = sum(len(text) for text, _ in context)
+        system_monitor.annotate(
+            context_candidates=len(ids),
+            context_chunks=len(kept),
+            context_chars_raw=raw_chars,
+            context_chars=chars,
+            context_tokens_saved=max(raw_chars - chars, 0) // CHARS_PER_TOKEN
+        )
+        return [i for i, _ in kept], context
+
+    def rerank(self, question: str, candidates: List[Tuple[int, float]], chunks) -> List[Tuple[int, float]]:
+        """Reorder (id, score) candidates by cross-encoder score; unchanged if there is no reranker."""
+        model = get_reranker()
+        if model is None:
+            return candidates
+        texts = [chunks[i] for i, _ in candidates]
+        with self._lock:
+            scores = [self._lookup(self._rerank_scores, (question, text)) for text in texts]
+        missing = [n for n, score in enumerate(scores) if score is None]
+        if missing:
+            predicted = model.predict([(question, texts[n]) for n in missing], show_progress_bar=False)
+            with self._lock:
+                for n, score in zip(missing, predicted):
+                    scores[n] = float(score)
+                    self._remember(self._rerank_scores, (question, texts[n]), scores[n], self.rerank_cache_size)
+        order = sorted(range(len(candidates)), key=lambda n: -scores[n])
+        return [(candidates[n][0], scores[n]) for n in order]
+
+    def compress(self, query_embedding: np.ndarray, context: List[Tuple[str, float]],
+                 model) -> List[Tuple[str, float]]:
+        """Keep the sentences most similar to the query, up to the token budget, in their original order.
+
+        Sentences skipped between kept ones are marked with "..."; chunks left without a
+        sentence are dropped. Context already within the budget is returned as is.
+        """
+        if sum(estimate_tokens(text) for text, _ in context) <= self.token_budget:
+            return context
+        sentences = [split_sentences(text) for text, _ in context]
+        flat = [sentence for chunk in sentences for sentence in chunk]
+        scores = self._sentence_vectors(flat, model) @ np.asarray(query_embedding, dtype=np.float32)
+
+        chosen = set()
+        tokens = 0
+        for n in np.argsort(-scores, kind="stable"):
+            cost = estimate_tokens(flat[n])
+            # the best sentence is kept even if it alone is over the budget
+            if chosen and tokens + cost > self.token_budget:
+                continue
+            chosen.add(int(n))
+            tokens += cost
+
+        compressed = []
+        n = 0
+        for (_, score), chunk in zip(context, sentences):
+            parts = []
+            gap = False
+            for sentence in chunk:
+                if n in chosen:
+                    parts.append(f"... {sentence}" if gap and parts else sentence)
+                    gap = False
+                else:
+                    gap = True
+                n += 1
+            if parts:
+                compressed.append((" ".join(parts), score))
+        return compressed
+
+    def _sentence_vectors(self, sentences: List[str], model) -> np.ndarray:
+        """Normalized sentence embeddings, encoding only sentences not seen before."""
+        with self._lock:
+            vectors = [self._lookup(self._sentence_embeddings, sentence) for sentence in sentences]
+        missing = list(dict.fromkeys(s for s, v in zip(sentences, vectors) if v is None))
+        if missing:
+            encoded = model.encode(missing, normalize_embeddings=True, show_progress_bar=False)
+            new = dict(zip(missing, np.asarray(encoded, dtype=np.float32)))
+            with self._lock:
+                for sentence, vector in new.items():
+                    self._remember(self._sentence_embeddings, sentence, vector, self.sentence_cache_size)
+            vectors = [new[s] if v is None else v for s, v in zip(sentences, vectors)]
+        return np.vstack(vectors)
+
+    @staticmethod
+    def _lookup(cache: OrderedDict, key):
+        """Read from an LRU cache (lock held)."""
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key, value, max_size: int) -> None:
+        """Add to an LRU cache (lock held)."""
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_size:
+            cache.popitem(last=False)
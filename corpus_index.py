@@ -0,0 +1,191 @@
+# corpus_index.py
+import argparse
+import os
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from config import TOP_K_CHUNKS, ANN_MIN_CHUNKS, IVF_NPROBE, IVF_TRAIN_ITERATIONS
+from document_processor import DocumentProcessor
+from logger import logger
+from utils import top_k_indices, EmbeddingMatrix
+
+
+class IVFIndex:
+    """Inverted-file ANN index over normalized vectors, built with spherical k-means.
+
+    Vectors are assigned to their closest centroid; a query only scores the vectors
+    in its nprobe closest lists instead of the whole matrix.
+    """
+
+    def __init__(self, nlist: int, nprobe: int = IVF_NPROBE, iterations: int = IVF_TRAIN_ITERATIONS,
+                 seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.rng = np.random.default_rng(seed)
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+
+    def train(self, vectors: np.ndarray, sample_size: int = 50000) -> None:
+        """Learn centroids with spherical k-means on a sample of the vectors."""
+        if len(vectors) > sample_size:
+            sample = vectors[self.rng.choice(len(vectors), sample_size, replace=False)]
+        else:
+            sample = np.asarray(vectors)
+        nlist = min(self.nlist, len(sample))
+        centroids = sample[self.rng.choice(len(sample), nlist, replace=False)].astype(np.float32)
+        for _ in range(self.iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            starts = np.searchsorted(assignment[order], np.arange(nlist + 1))
+            filled = starts[:-1] < starts[1:]
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[order], starts[:-1][filled], axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # keep the old centroid for lists that ended up empty
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.maximum(norms, 1e-12))
+        self.centroids = centroids.astype(np.float32)
+        self.nlist = nlist
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+
+    def add(self, vectors: np.ndarray, start_id: int) -> None:
+        """Assign vectors (with ids starting at start_id) to their closest lists."""
+        assignment = self._assign(vectors)
+        ids = np.arange(start_id, start_id + len(vectors), dtype=np.int64)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for list_id in range(self.nlist):
+            members = ids[order[bounds[list_id]:bounds[list_id + 1]]]
+            if len(members):
+                self.lists[list_id] = np.concatenate([self.lists[list_id], members])
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of the approximate top_k vectors for a query."""
+        probes = top_k_indices(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate([self.lists[i] for i in probes])
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        scores = vectors[candidates] @ query
+        best = top_k_indices(scores, top_k)
+        return candidates[best], scores[best]
+
+    def _assign(self, vectors: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """Return the closest centroid for each vector."""
+        return np.concatenate([
+            np.argmax(vectors[i:i + batch_size] @ self.centroids.T, axis=1)
+            for i in range(0, len(vectors), batch_size)
+        ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+class CorpusIndex:
+    """Searchable index over the chunks of many documents.
+
+    Documents are added incrementally. Below ANN_MIN_CHUNKS chunks search is exact;
+    above it an IVF index is trained and kept up to date as documents are added.
+    """
+
+    def __init__(self, processor: Optional[DocumentProcessor] = None,
+                 min_ann_chunks: int = ANN_MIN_CHUNKS, nprobe: int = IVF_NPROBE):
+        self.processor = processor or DocumentProcessor()
+        self.min_ann_chunks = min_ann_chunks
+        self.nprobe = nprobe
+        self.chunks: List[str] = []
+        self.chunk_meta: List[dict] = []
+        self.documents: Dict[str, int] = {}
+        # page texts per document, for citing the pages chunks came from
+        self.pages: Dict[str, List[str]] = {}
+        self.ivf: Optional[IVFIndex] = None
+        self._trained_size = 0
+        # grown by doubling so adding a document doesn't copy the whole corpus
+        self._matrix = EmbeddingMatrix()
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._matrix.view()
+
+    @property
+    def _size(self) -> int:
+        return self._matrix.size
+
+    def add_document(self, file_path: str) -> int:
+        """Index a document's chunks, skipping files that are already indexed."""
+        file_path = os.path.abspath(file_path)
+        if file_path in self.documents:
+            return 0
+        chunks, embeddings, meta, pages = self.processor.build_index(file_path)
+        return self.add_chunks(file_path, chunks, embeddings, meta, pages)
+
+    def add_chunks(self, source: str, chunks: List[str], embeddings: np.ndarray, meta: List[dict],
+                   pages: Optional[List[str]] = None) -> int:
+        """Add a document's already embedded chunks (normalized rows) under source."""
+        start = self._size
+        self._matrix.append(np.asarray(embeddings, dtype=np.float32))
+        self.chunks.extend(chunks)
+        self.chunk_meta.extend(meta)
+        self.documents[source] = len(chunks)
+        self.pages[source] = pages or []
+        logger.info(f"Added {len(chunks)} chunks from {source} to corpus ({self._size} total)")
+
+        if self._size >= self.min_ann_chunks:
+            # retrain once the corpus has doubled since the centroids were learned
+            if self.ivf is None or self._size >= 2 * self._trained_size:
+                self._train()
+            else:
+                self.ivf.add(self.embeddings[start:], start)
+        return len(chunks)
+
+    def search(self, query: str, top_k: int = TOP_K_CHUNKS) -> List[Tuple[str, float, dict]]:
+        """Search all documents, returning (chunk, score, metadata) tuples."""
+        if not self._size:
+            logger.warning("No corpus chunks available for search")
+            return []
+        query_embedding = self.processor.model.encode(query, normalize_embeddings=True, show_progress_bar=False)
+        ids, scores = self.search_embedding(np.asarray(query_embedding, dtype=np.float32), top_k)
+        return [(self.chunks[i], float(s), self.chunk_meta[i]) for i, s in zip(ids, scores)]
+
+    def search_embedding(self, query_embedding: np.ndarray, top_k: int = TOP_K_CHUNKS) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of the top_k chunks for an already encoded query."""
+        if self.ivf is not None:
+            return self.ivf.search(self.embeddings, query_embedding, top_k)
+        # small corpus: exact search is cheap enough
+        scores = self.embeddings @ query_embedding
+        ids = top_k_indices(scores, top_k)
+        return ids, scores[ids]
+
+    def _train(self) -> None:
+        """(Re)build the IVF index over the whole corpus."""
+        nlist = max(int(4 * np.sqrt(self._size)), 1)
+        logger.info(f"Training IVF index with {nlist} lists over {self._size} chunks")
+        self.ivf = IVFIndex(nlist, nprobe=self.nprobe)
+        self.ivf.train(self.embeddings)
+        self.ivf.add(self.embeddings, 0)
+        self._trained_size = self._size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search across many documents at once")
+    parser.add_argument("paths", nargs="+", help="PDF/TXT files, or directories to index every PDF/TXT in")
+    parser.add_argument("--query", action="append", help="question to search for (repeatable); "
+                                                          "without one, questions are read from stdin")
+    parser.add_argument("--top-k", type=int, default=TOP_K_CHUNKS)
+    args = parser.parse_args()
+
+    corpus = CorpusIndex()
+    for path in args.paths:
+        files = [path] if os.path.isfile(path) else sorted(
+            os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(('.pdf', '.txt'))
+        )
+        for file_path in files:
+            corpus.add_document(file_path)
+    print(f"{len(corpus.documents)} documents, {len(corpus.chunks)} chunks"
+          f"{', IVF search' if corpus.ivf is not None else ''}")
+
+    questions = args.query or (line.strip() for line in iter(lambda: input("> "), "exit"))
+    try:
+        for question in questions:
+            if not question:
+                continue
+            for chunk, score, meta in corpus.search(question, args.top_k):
+                print(f"{score:.3f}  {os.path.basename(meta.get('source', ''))} p.{meta.get('page')}: {chunk[:100]!r}")
+    except EOFError:
+        pass
@@ -4,34 +4,47 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import json
-import os
 from datetime import datetime
-from system_monitor import system_monitor
+from metrics_store import MetricsStore, latency_percentiles, queries_per_minute
+
+@st.cache_resource
+def get_metrics_store():
+    """One store per dashboard process, so reruns only load metrics written since the last one."""
+    return MetricsStore()
 
 def load_session_data():
     """Load all available session data."""
-    sessions = []
-    for file in os.listdir('logs'):
-        if file.startswith('summary_') and file.endswith('.json'):
-            # Load the summary file
-            with open(os.path.join('logs', file), 'r') as f:
-                session = json.load(f)
-                session['session_id'] = file.replace('summary_', '').replace('.json', '')
-                sessions.append(session)
-    return pd.DataFrame(sessions)
+    return get_metrics_store().sessions()
+
+def load_metrics_data():
+    """Load the metrics of every session from the columnar store."""
+    return get_metrics_store().refresh()
 
-def load_metrics_data(session_id):
-    """Load detailed metrics for a specific session."""
-    metrics_file = f'logs/metrics_{session_id}.jsonl'
-    if not os.path.exists(metrics_file):
-        return pd.DataFrame()
-    # Load the metrics file
-    metrics = []
-    with open(metrics_file, 'r') as f:
-        for line in f:
-            metric = json.loads(line)
-            metrics.append(metric)
-    return pd.DataFrame(metrics)
+def stage_durations(metrics_df):
+    """One row per recorded span: query_number, stage, parent and duration in seconds.
+
+    The server's own prompt evaluation and generation times are added as children of
+    the llm stage.
+    """
+    columns = ['query_number', 'stage', 'parent', 'duration']
+    frames = []
+    if 'spans' in metrics_df:
+        spans = metrics_df[['query_number', 'spans']].dropna(subset=['spans'])
+        spans = spans.assign(spans=spans['spans'].map(json.loads)).explode('spans').dropna(subset=['spans'])
+        if not spans.empty:
+            fields = pd.DataFrame(spans['spans'].tolist())
+            frames.append(pd.DataFrame({
+                'query_number': spans['query_number'].to_numpy(),
+                'stage': fields['name'],
+                'parent': fields['parent'],
+                'duration': fields['duration']
+            }))
+    for stage, field in [('server prompt eval', 'server_prompt_time'), ('server generation', 'server_generation_time')]:
+        if field in metrics_df:
+            timed = metrics_df.dropna(subset=[field])
+            frames.append(pd.DataFrame({'query_number': timed['query_number'], 'stage': stage,
+                                        'parent': 'llm', 'duration': timed[field]}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
 
 def create_gauge_chart(value, title, min_val=0, max_val=None):
     """Create a gauge chart for metrics."""
@@ -109,7 +122,11 @@ def main():
     seconds = int(duration % 60)
     
     # Calculate character metrics
-    metrics_df = load_metrics_data(selected_session)
+    all_metrics_df = load_metrics_data()
+    if all_metrics_df.empty:
+        metrics_df = all_metrics_df
+    else:
+        metrics_df = all_metrics_df[all_metrics_df['session_id'] == selected_session].reset_index(drop=True)
     total_input_chars = metrics_df['input_chars'].sum() if not metrics_df.empty else 0
     total_output_chars = metrics_df['output_chars'].sum() if not metrics_df.empty else 0
     total_queries = len(metrics_df) if not metrics_df.empty else 1
@@ -128,11 +145,9 @@ def main():
     st.dataframe(df, use_container_width=True)
     
     # Display detailed metrics if available
-    metrics_df = load_metrics_data(selected_session)
     if not metrics_df.empty:
-        # Add query numbering and convert timestamps
+        # Add query numbering
         metrics_df['query_number'] = range(1, len(metrics_df) + 1)
-        metrics_df['timestamp'] = pd.to_datetime(metrics_df['timestamp'])
         
         # Plot response time trend
         st.subheader("Response Time by Query")
@@ -149,17 +164,116 @@ def main():
         )
         st.plotly_chart(fig, use_container_width=True)
         
+        # Break response time down by pipeline stage
+        stages_df = stage_durations(metrics_df)
+        if not stages_df.empty:
+            st.subheader("Response Time by Stage")
+            top_level = stages_df[stages_df['parent'].isna()]
+            fig = px.bar(
+                top_level,
+                x='query_number',
+                y='duration',
+                color='stage',
+                title='Stage Durations per Query'
+            )
+            fig.update_layout(
+                xaxis_title="Query Number",
+                yaxis_title="Duration (seconds)"
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            
+            # nested stages are listed under their parent
+            stage_table = stages_df.fillna({'parent': ''}).groupby(['parent', 'stage'])['duration'].agg(
+                queries='count', mean='mean', p95=lambda d: d.quantile(0.95), max='max'
+            ).reset_index()
+            st.dataframe(stage_table, use_container_width=True)
+        
+        # Document context retrieved vs what the context compressor sent
+        if 'context_chars_raw' in metrics_df:
+            context_df = metrics_df.dropna(subset=['context_chars_raw'])
+            st.subheader("Context Compression")
+            fig = px.bar(
+                context_df.melt(id_vars='query_number', value_vars=['context_chars_raw', 'context_chars'],
+                                var_name='context', value_name='chars'),
+                x='query_number',
+                y='chars',
+                color='context',
+                barmode='group',
+                title='Document Context per Query (retrieved vs sent)'
+            )
+            fig.update_layout(
+                xaxis_title="Query Number",
+                yaxis_title="Characters"
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            raw_chars = context_df['context_chars_raw'].sum()
+            caption = (f"Context {1 - context_df['context_chars'].sum() / raw_chars:.0%} smaller, "
+                       f"{context_df['context_tokens_saved'].mean():.0f} prompt tokens saved per query"
+                       if raw_chars else "No document context retrieved")
+            if raw_chars and {'server_prompt_time', 'prefill_tokens'} <= set(metrics_df.columns):
+                # the server's own prefill rate prices the saved tokens
+                prefill = metrics_df.dropna(subset=['server_prompt_time', 'prefill_tokens'])
+                prefill = prefill[prefill['prefill_tokens'] > 0]
+                if not prefill.empty:
+                    seconds_per_token = (prefill['server_prompt_time'] / prefill['prefill_tokens']).median()
+                    caption += (f", about {context_df['context_tokens_saved'].mean() * seconds_per_token:.2f}s "
+                                f"of prompt evaluation")
+            st.caption(caption)
+
         # Display query/response history
         st.subheader("All Queries and Responses")
         all_queries = metrics_df.sort_values('timestamp', ascending=False)
         
-        for _, row in all_queries.iterrows():
+        for row in all_queries.to_dict('records'):
             with st.expander(f"Query at {row['timestamp'].strftime('%H:%M:%S')}"):
                 st.markdown("**Query:**")
                 st.info(row['input'].split('Assistant:')[0].strip()) 
                 st.markdown("**Response:**")
                 st.success(row['output'])
                 st.caption(f"Response Time: {row['inference_time']:.2f}s")
+    
+    # Distributions across all sessions rather than averages
+    if not all_metrics_df.empty:
+        st.header("All Sessions")
+        by_day = latency_percentiles(all_metrics_df.assign(day=all_metrics_df['timestamp'].dt.date), 'day')
+        st.subheader("Response Time Percentiles by Day")
+        fig = px.line(
+            by_day,
+            x='day',
+            y=['p50', 'p95', 'p99'],
+            markers=True,
+            title='p50 / p95 / p99 Response Time'
+        )
+        fig.update_layout(
+            xaxis_title="Day",
+            yaxis_title="Response Time (seconds)",
+            legend_title="Percentile"
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        
+        st.subheader("Percentiles by Session")
+        st.dataframe(latency_percentiles(all_metrics_df, 'session_id'), use_container_width=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if 'tokens_per_second' in all_metrics_df and all_metrics_df['tokens_per_second'].notna().any():
+                fig = px.histogram(
+                    all_metrics_df.dropna(subset=['tokens_per_second']),
+                    x='tokens_per_second',
+                    title='Tokens per Second (streamed responses)'
+                )
+                fig.update_layout(xaxis_title="Tokens per Second", yaxis_title="Queries")
+                st.plotly_chart(fig, use_container_width=True)
+        with col2:
+            per_minute = queries_per_minute(all_metrics_df)
+            fig = px.bar(
+                x=per_minute.index,
+                y=per_minute.values,
+                title='Queries per Minute'
+            )
+            fig.update_layout(xaxis_title="Time", yaxis_title="Queries")
+            st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
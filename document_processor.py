@@ -1,98 +1,675 @@
 # document_processor.py
+import hashlib
+import multiprocessing
 import os
+import re
+import threading
 import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
 import PyPDF2
-from typing import List, Tuple
-from sentence_transformers import SentenceTransformer
-from config import CHUNK_SIZE, CHUNK_OVERLAP, TOP_K_CHUNKS
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+from config import (
+    CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, CHARS_PER_TOKEN, TOP_K_CHUNKS, PDF_WORKERS, PDF_PARALLEL_MIN_PAGES,
+    EMBEDDING_BATCH_SIZE, SEARCH_BATCH_MAX, SEARCH_BATCH_WAIT, EMBEDDING_STORAGE, CHUNK_TEXT_BUFFER,
+    HYBRID_SEARCH, HYBRID_CANDIDATES
+)
+from bm25 import BM25Index, reciprocal_rank_fusion
+from compact_storage import QuantizedEmbeddings, TextBuffer
+from embedding_model import get_embedding_model
+from index_cache import IndexCache, index_key, file_hash
 from logger import logger
+from system_monitor import system_monitor
+from utils import top_k_rows, EmbeddingMatrix, MicroBatcher
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def _file_stat(file_path: str) -> Optional[Tuple[int, int]]:
+    """(mtime, size) of a file, or None if it can't be read."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) (runs in a worker process)."""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+# font programs don't change the extracted text, and /Parent leads back up the page tree
+_UNHASHED_KEYS = {"/FontFile", "/FontFile2", "/FontFile3", "/Parent"}
+
+def _object_digest(obj, memo: dict, visiting: set) -> bytes:
+    """Digest of a PDF object and everything it references, memoized per indirect object.
+
+    Form XObjects and ToUnicode maps are hashed with their stream data; images only by
+    their dictionary, since their pixels don't change the text.
+    """
+    if isinstance(obj, PyPDF2.generic.IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in memo:
+            return memo[key]
+        if key in visiting:
+            return b"cycle"
+        visiting.add(key)
+        digest = _object_digest(obj.get_object(), memo, visiting)
+        visiting.discard(key)
+        memo[key] = digest
+        return digest
+    h = hashlib.sha256()
+    if isinstance(obj, PyPDF2.generic.DictionaryObject):
+        if isinstance(obj, PyPDF2.generic.StreamObject) and obj.get("/Subtype") != "/Image":
+            h.update(obj.get_data())
+        for name in sorted(obj):
+            if name not in _UNHASHED_KEYS:
+                h.update(name.encode('utf-8'))
+                h.update(_object_digest(obj.raw_get(name), memo, visiting))
+    elif isinstance(obj, PyPDF2.generic.ArrayObject):
+        for item in obj:
+            h.update(_object_digest(item, memo, visiting))
+    else:
+        h.update(repr(obj).encode('utf-8'))
+    return h.digest()
+
+def pdf_page_hashes(file_path: str) -> List[str]:
+    """Hash what each PDF page's text is drawn from, which is far cheaper than extracting it.
+
+    That is the page's content streams and its /Resources: fonts (with their encodings
+    and ToUnicode maps) and Form XObjects, whose own content can carry the text.
+    """
+    hashes = []
+    # fonts and XObjects shared between pages are hashed once
+    memo = {}
+    with open(file_path, 'rb') as file:
+        for page in PyPDF2.PdfReader(file).pages:
+            digest = hashlib.sha256()
+            contents = page.get("/Contents")
+            if contents is not None:
+                contents = contents.get_object()
+                for stream in contents if isinstance(contents, list) else [contents]:
+                    digest.update(stream.get_object().get_data())
+            resources = page.raw_get("/Resources") if "/Resources" in page else None
+            if resources is not None:
+                digest.update(_object_digest(resources, memo, set()))
+            hashes.append(digest.hexdigest())
+    return hashes
+
+def page_hashes(file_path: str) -> List[str]:
+    """Content hash per page of a document (a text file is a single page)."""
+    if file_path.lower().endswith('.pdf'):
+        return pdf_page_hashes(file_path)
+    return [file_hash(file_path)]
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _page_ranges(pages: List[int], range_size: int) -> List[Tuple[int, int]]:
+    """Group sorted page numbers into contiguous [start, end) ranges of at most range_size pages."""
+    ranges = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page and page - ranges[-1][0] < range_size:
+            ranges[-1][1] = page + 1
+        else:
+            ranges.append([page, page + 1])
+    return [(start, end) for start, end in ranges]
+
+def _fill_pages(known: List[Optional[str]], ranges: List[Tuple[int, int]],
+                extracted: Iterable[List[str]]) -> Iterator[str]:
+    """Interleave known page texts with the extracted ranges, in page order."""
+    next_page = 0
+    for (start, end), page_texts in zip(ranges, extracted):
+        yield from known[next_page:start]
+        yield from page_texts
+        next_page = end
+    yield from known[next_page:]
+
+def iter_pdf_pages(file_path: str, workers: Optional[int] = PDF_WORKERS,
+                   known: Optional[List[Optional[str]]] = None) -> Iterator[str]:
+    """Yield the text of each PDF page in order, extracting page ranges in a process pool.
+
+    known optionally holds an already extracted text (or None) per page; only the
+    pages without one are extracted.
+    """
+    if known is None:
+        with open(file_path, 'rb') as file:
+            known = [None] * len(PyPDF2.PdfReader(file).pages)
+    page_count = len(known)
+    missing = [i for i, text in enumerate(known) if text is None]
+    logger.info(f"PDF has {page_count} pages, {len(missing)} to extract")
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(missing) < PDF_PARALLEL_MIN_PAGES:
+        ranges = _page_ranges(missing, page_count)
+        yield from _fill_pages(known, ranges, (_extract_page_range(file_path, *r) for r in ranges))
+        return
+
+    # a few ranges per worker so one slow range doesn't hold up the rest
+    ranges = _page_ranges(missing, max(1, -(-len(missing) // (workers * 4))))
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    # spawned, not forked: this process already runs model, indexing and metrics threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context) as executor:
+        # ranges come back in order while later ones are still being extracted
+        extracted = executor.map(_extract_page_range, [file_path] * len(ranges), starts, ends)
+        yield from _fill_pages(known, ranges, extracted)
+    logger.info(f"Extracted {len(missing)} pages with {workers} workers")
+
+def extract_pdf_pages(file_path: str, workers: Optional[int] = PDF_WORKERS) -> List[str]:
+    """Extract the text of every PDF page, fanning page ranges out to a process pool."""
+    return list(iter_pdf_pages(file_path, workers))
 
 class DocumentProcessor:
     """Processes documents into searchable chunks using embeddings."""
-    
-    def __init__(self):
-        """Initialize with sentence transformer model for embeddings."""
+
+    def __init__(self, use_cache: bool = True, model: Optional["SentenceTransformer"] = None,
+                 embedding_storage: str = EMBEDDING_STORAGE, text_buffer: bool = CHUNK_TEXT_BUFFER,
+                 hybrid: bool = HYBRID_SEARCH):
+        """Initialize with sentence transformer model for embeddings.
+
+        Pass an already loaded model to use it instead of the shared one, which is only
+        loaded when the first embedding is needed. With embedding_storage "float16" or
+        "int8" and/or text_buffer=True a finished index is kept in compact form. With
+        hybrid=True a BM25 index is built alongside and fused with vector search.
+        """
         self.chunks: List[str] = []
         self.embeddings: np.ndarray = None
-        # use model all-MiniLM-L6-v2
-        logger.info("Loading sentence transformer model...")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        logger.info("Model loaded successfully")
+        self.chunk_meta: List[dict] = []
+        # page texts of the current document, for citations
+        self.pages: List[str] = []
+        # content hash per page, to find the pages a revised document changed
+        self.page_hashes: List[str] = []
+        self.file_path: Optional[str] = None
+        # identifies the current document's content and chunking, e.g. for response caching
+        self.index_id: Optional[str] = None
+        # BM25 index over the chunks (hybrid search only)
+        self.lexical: Optional[BM25Index] = None
+        self.index_cache = IndexCache() if use_cache else None
+        # set once the first batch of chunks can be searched
+        self._searchable = threading.Event()
+        self._indexing: Optional[threading.Thread] = None
+        # (mtime, size) of the document when indexing started
+        self._file_stat: Optional[Tuple[int, int]] = None
+        self._model = model
+        self.embedding_storage = embedding_storage
+        self.text_buffer = text_buffer
+        self.hybrid = hybrid
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        """The embedding model (all-MiniLM-L6-v2 unless one was passed in)."""
+        if self._model is None:
+            self._model = get_embedding_model()
+        return self._model
+
+    @property
+    def indexing(self) -> bool:
+        """Whether a background process_document is still running."""
+        return self._indexing is not None and self._indexing.is_alive()
+
+    def process_document(self, file_path: str, background: bool = False) -> None:
+        """Process document into chunks and generate embeddings.
+
+        With background=True the work happens in a thread and chunks become
+        searchable batch by batch while the rest of the document is processed. When the
+        same path was indexed before, only its changed pages are extracted again and only
+        chunks whose text changed are embedded again.
+        """
+        previous = self._previous_index(file_path)
+        self.file_path = file_path
+        self._file_stat = _file_stat(file_path)
+        self.chunks, self.embeddings, self.chunk_meta, self.pages = [], None, [], []
+        self.page_hashes = []
+        self.index_id = None
+        self.lexical = None
+        self._searchable.clear()
+        if background:
+            self._indexing = threading.Thread(target=self._index, args=(file_path, False, previous), daemon=True)
+            self._indexing.start()
+        else:
+            with system_monitor.span("process_document"):
+                self._index(file_path, previous=previous)
+
+    def is_current(self, file_path: str) -> bool:
+        """Whether file_path is the indexed (or indexing) document and unchanged since."""
+        if file_path != self.file_path or (not self.chunks and not self.indexing):
+            return False
+        return _file_stat(file_path) == self._file_stat
 
-    def process_document(self, file_path: str) -> None:
-        """Process document into chunks and generate embeddings."""
+    def _previous_index(self, file_path: str) -> Optional[Tuple]:
+        """Return (chunks, embeddings, pages, page_hashes) of file_path's index, if it is loaded."""
+        if file_path == self.file_path and self.chunks and not self.indexing:
+            embeddings = self.embeddings
+            if isinstance(embeddings, QuantizedEmbeddings):
+                # reuse the float32 rows, not the quantized ones
+                embeddings = embeddings.full_precision
+            return self.chunks, embeddings, self.pages, self.page_hashes
+        return None
+
+    def wait_until_searchable(self, timeout: Optional[float] = None) -> bool:
+        """Block until the first chunks of the current document can be searched."""
+        return self._searchable.wait(timeout)
+
+    def _index(self, file_path: str, raise_errors: bool = True, previous: Optional[Tuple] = None) -> None:
+        """Publish each partial index of a document as it is built."""
+        try:
+            index_id = index_key(file_path)
+            hashes = page_hashes(file_path)
+            lexical = BM25Index() if self.hybrid else None
+            for chunks, embeddings, meta, pages in self.iter_index(file_path, index_id, previous, hashes):
+                if self.file_path != file_path:
+                    # a different document was requested meanwhile
+                    return
+                # chunks first, so every embedding row (and BM25 document) has its chunk
+                self.chunks, self.chunk_meta, self.pages = chunks, meta, pages
+                self.embeddings = embeddings
+                if lexical is not None:
+                    lexical.add(chunks[len(lexical):])
+                    self.lexical = lexical
+                self.index_id = index_id
+                self.page_hashes = hashes
+                self._searchable.set()
+            if self.file_path == file_path:
+                self._compact(index_id)
+        except Exception as e:
+            logger.error(f"Error processing document {file_path}: {str(e)}")
+            if raise_errors:
+                raise
+        finally:
+            self._searchable.set()
+
+    def _compact(self, index_id: str) -> None:
+        """Swap the finished index for its compact form, if one is configured."""
+        chunks, embeddings = self.chunks, self.embeddings
+        if self.text_buffer:
+            chunks = TextBuffer(chunks)
+        if self.embedding_storage != "float32" and embeddings is not None:
+            # rescore against the cached float32 matrix, which stays on disk
+            full_precision = self.index_cache.load_embeddings(index_id) if self.index_cache is not None else None
+            embeddings = QuantizedEmbeddings(embeddings, self.embedding_storage, full_precision)
+        self.chunks, self.embeddings = chunks, embeddings
+
+    def build_index(self, file_path: str) -> Tuple[List[str], np.ndarray, List[dict], List[str]]:
+        """Return the chunks, embeddings, per-chunk metadata and page texts for a document."""
+        result = None
+        for result in self.iter_index(file_path):
+            pass
+        return result
+
+    def iter_index(self, file_path: str, index_id: Optional[str] = None, previous: Optional[Tuple] = None,
+                   hashes: Optional[List[str]] = None) -> Iterator[Tuple[List[str], np.ndarray, List[dict], List[str]]]:
+        """Build a document's index, yielding the partial index after every embedding batch.
+
+        Pages stream into the chunker and chunk batches into the model while extraction
+        continues, and embeddings are written into a preallocated float32 matrix. The
+        last item yielded is the complete index. Pass index_id if the index key is already known.
+
+        previous is the (chunks, embeddings, pages, page_hashes) of an earlier version of the
+        document: pages with an unchanged content hash keep their extracted text and chunks
+        with unchanged text keep their embedding, so only the edited parts are processed.
+        Without one, the cache's last index of the same path is used. hashes are the
+        document's page hashes, if already computed.
+        """
         logger.info(f"Processing document: {file_path}")
 
+        # Reuse a previously built index for identical content
+        cache_key = None
+        if self.index_cache is not None:
+            cache_key = index_id or self.index_cache.key_for(file_path)
+            cached = self.index_cache.load(cache_key)
+            if cached is not None:
+                chunks, embeddings, meta, pages = cached
+                yield chunks, embeddings, [dict(m, source=file_path) for m in meta], pages
+                return
+            if previous is None:
+                previous = self.index_cache.load_previous(file_path)
+
+        if hashes is None:
+            hashes = page_hashes(file_path)
+        known_pages: List[Optional[str]] = [None] * len(hashes)
+        reuse = None
+        if previous is not None:
+            old_chunks, old_embeddings, old_pages, old_hashes = previous
+            if len(old_pages) == len(old_hashes):
+                old_texts = dict(zip(old_hashes, old_pages))
+                known_pages = [old_texts.get(h) for h in hashes]
+            if old_embeddings is not None and len(old_embeddings) == len(old_chunks):
+                reuse = ({_text_hash(chunk): row for row, chunk in enumerate(old_chunks)}, old_embeddings)
+            logger.info(f"Updating index: {sum(t is not None for t in known_pages)} of {len(hashes)} pages unchanged")
+
         # Extract text from PDF or TXT
         if file_path.lower().endswith('.pdf'):
             logger.info("Extracting text from PDF...")
-            text = self._extract_pdf_text(file_path)
+            page_iter = iter_pdf_pages(file_path, known=known_pages)
         elif file_path.lower().endswith('.txt'):
             logger.info("Reading text file...")
             with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
+                page_iter = iter([f.read()])
         else:
             raise ValueError(f"Unsupported file type: {file_path}")
 
-        # Clean and chunk text
-        text = text.replace('\n', ' ').strip()
-        # from config 
-        logger.info(f"Extracted {len(text)} characters")
-        logger.info("Creating text chunks...")
-        self.chunks = self._create_chunks(text)
-        logger.info(f"Created {len(self.chunks)} chunks")
-
-        # Generate embeddings in batches
-        logger.info("Generating embeddings...")
-        self.embeddings = []
-        # batch to speed up embedding generation
-        batch_size = 32
-        for i in range(0, len(self.chunks), batch_size):
-            batch = self.chunks[i:i + batch_size]
-            embeddings = self.model.encode(batch, normalize_embeddings=True, show_progress_bar=False)
-            self.embeddings.extend(embeddings)
-            logger.info(f"Processed chunk batch {i+1} to {i + len(batch)}")
-
-        self.embeddings = np.array(self.embeddings)
+        pages: List[str] = []
+        chunks: List[str] = []
+        meta: List[dict] = []
+        matrix = EmbeddingMatrix()
+        batch: List[Tuple[str, dict]] = []
+        reused = 0
+
+        # Chunk pages as they arrive and embed in batches
+        logger.info("Creating text chunks and generating embeddings...")
+        for chunk, chunk_meta in self._iter_chunks(self._collect(page_iter, pages)):
+            batch.append((chunk, dict(chunk_meta, source=file_path)))
+            # batch to speed up embedding generation
+            if len(batch) == EMBEDDING_BATCH_SIZE:
+                reused += self._embed_batch(batch, chunks, meta, matrix, reuse)
+                batch = []
+                yield chunks, matrix.view(), meta, pages
+        if batch:
+            reused += self._embed_batch(batch, chunks, meta, matrix, reuse)
+        logger.info(f"Created {len(chunks)} chunks from {len(pages)} pages")
+        if reuse is not None:
+            logger.info(f"Reused {reused} embeddings, encoded {len(chunks) - reused} changed chunks")
         logger.info("Embeddings generated successfully")
 
-    def _extract_pdf_text(self, file_path: str) -> str:
-        """Extract text from PDF pages."""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            logger.info(f"PDF has {len(pdf_reader.pages)} pages")
-            # extract text from each page
-            for i, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text() or ""
-                text += page_text + "\n"
-                logger.debug(f"Extracted {len(page_text)} characters from page {i + 1}")
-        return text
-
-    def _create_chunks(self, text: str) -> List[str]:
-        """Split text into overlapping chunks of fixed size."""
-        chunks = []
-        start = 0
-        while start < len(text):
-            # chunk size from config
-            end = min(start + CHUNK_SIZE, len(text))
-            chunks.append(text[start:end])
-            start += CHUNK_SIZE - CHUNK_OVERLAP
-        return chunks
+        embeddings = matrix.view()
+        if cache_key is not None:
+            self.index_cache.save(cache_key, chunks, embeddings, meta, pages, hashes, source=file_path)
+        yield chunks, embeddings, meta, pages
+
+    def _embed_batch(self, batch: List[Tuple[str, dict]], chunks: List[str], meta: List[dict],
+                     matrix: EmbeddingMatrix, reuse: Optional[Tuple[dict, np.ndarray]] = None) -> int:
+        """Encode a batch of chunks straight into the embedding matrix.
+
+        reuse maps chunk text hashes to rows of a previous embedding matrix; those chunks
+        are copied instead of encoded. Returns the number of reused embeddings.
+        """
+        texts = [chunk for chunk, _ in batch]
+        known = {}
+        if reuse is not None:
+            rows, old_embeddings = reuse
+            known = {i: rows[h] for i, h in enumerate(map(_text_hash, texts)) if h in rows}
+        if known:
+            vectors = np.empty((len(texts), old_embeddings.shape[1]), dtype=np.float32)
+            vectors[list(known)] = old_embeddings[list(known.values())]
+            missing = [i for i in range(len(texts)) if i not in known]
+            if missing:
+                vectors[missing] = self.model.encode([texts[i] for i in missing], normalize_embeddings=True,
+                                                     show_progress_bar=False)
+        else:
+            vectors = self.model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+        matrix.append(vectors)
+        chunks.extend(texts)
+        meta.extend(chunk_meta for _, chunk_meta in batch)
+        logger.info(f"Processed chunk batch {len(chunks) - len(batch) + 1} to {len(chunks)}")
+        return len(known)
+
+    def _collect(self, page_iter: Iterable[str], pages: List[str]) -> Iterator[str]:
+        """Pass pages through while keeping their text for citations."""
+        for page in page_iter:
+            pages.append(page)
+            yield page
+
+    def _iter_chunks(self, pages: Iterable[str]) -> Iterator[Tuple[str, dict]]:
+        """Pack streamed page text into chunks of at most CHUNK_TOKENS tokenizer tokens.
+
+        Sentences are never split (unless one alone is too long), and a chunk ends early
+        at a paragraph or page break once it is half full. Only a chunk split inside a
+        paragraph starts with the last sentences (up to CHUNK_OVERLAP_TOKENS) of the
+        previous one. Chunk texts are exact spans of the document text, with sentences
+        joined by " " and paragraphs by newlines; meta holds their offsets and pages.
+        """
+        current = []  # (text, tokens, page, offset, separator before it)
+        current_tokens = 0
+        position = 0  # offset in the document text
+        for sentence, page, boundary in self._iter_sentences(pages):
+            separator = "" if position == 0 else (" " if boundary == "sentence" else "\n")
+            for text, tokens in self._fit(sentence):
+                offset = position + len(separator)
+                if current and (current_tokens + tokens > CHUNK_TOKENS
+                                or (boundary != "sentence" and current_tokens >= CHUNK_TOKENS // 2)):
+                    yield self._make_chunk(current)
+                    current = self._overlap(current, tokens) if boundary == "sentence" else []
+                    current_tokens = sum(unit[1] for unit in current)
+                current.append((text, tokens, page, offset, separator))
+                current_tokens += tokens
+                position = offset + len(text)
+                # the rest of an over-long sentence continues after a space
+                separator, boundary = " ", "sentence"
+        if current:
+            yield self._make_chunk(current)
+
+    def _iter_sentences(self, pages: Iterable[str]) -> Iterator[Tuple[str, int, str]]:
+        """Yield (sentence, page number, break before it: "sentence", "paragraph" or "page")."""
+        for page_number, page in enumerate(pages, start=1):
+            boundary = "page"
+            for paragraph in PARAGRAPH_BREAK.split(page):
+                for sentence in SENTENCE_END.split(" ".join(paragraph.split())):
+                    if sentence:
+                        yield sentence, page_number, boundary
+                        boundary = "sentence"
+                if boundary == "sentence":
+                    boundary = "paragraph"
+
+    def _fit(self, sentence: str) -> List[Tuple[str, int]]:
+        """Return the sentence with its token count, cut into word runs if it exceeds CHUNK_TOKENS."""
+        tokens = self._count_tokens(sentence)
+        if tokens <= CHUNK_TOKENS:
+            return [(sentence, tokens)]
+        words = sentence.split(" ")
+        pieces = -(-tokens // CHUNK_TOKENS)
+        size = -(-len(words) // pieces)
+        runs = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+        return [(run, self._count_tokens(run)) for run in runs]
+
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens with the embedding model's tokenizer (estimated if it has none)."""
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(tokenizer.tokenize(text))
+
+    def _overlap(self, units: List[tuple], next_tokens: int) -> List[tuple]:
+        """Return the trailing sentences to repeat at the start of the next chunk."""
+        tail = []
+        tokens = 0
+        for unit in reversed(units):
+            if tokens + unit[1] > CHUNK_OVERLAP_TOKENS or tokens + unit[1] + next_tokens > CHUNK_TOKENS:
+                break
+            tail.insert(0, unit)
+            tokens += unit[1]
+        return tail
+
+    def _make_chunk(self, units: List[tuple]) -> Tuple[str, dict]:
+        """Join sentences into a chunk and describe where it lies in the document."""
+        text = units[0][0] + "".join(separator + unit_text for unit_text, _, _, _, separator in units[1:])
+        offset = units[0][3]
+        return text, {"page": units[0][2], "end_page": units[-1][2], "offset": offset, "end": offset + len(text)}
+
+    def merge_overlapping(self, ids: Iterable[int], scores: Iterable[float]) -> List[Tuple[str, float]]:
+        """Join retrieved chunks whose text overlaps, so shared sentences are sent only once.
+
+        Each merged chunk takes the best score of its parts and the rank of its best part.
+        """
+        chunks, meta = self.chunks, self.chunk_meta
+        hits = sorted(
+            (meta[i].get("offset", 0), meta[i].get("end"), rank, int(i), float(score))
+            for rank, (i, score) in enumerate(zip(ids, scores))
+        )
+        groups = []
+        for offset, end, rank, i, score in hits:
+            last = groups[-1] if groups else None
+            if last is not None and end is not None and last["end"] is not None and offset < last["end"]:
+                if end > last["end"]:
+                    last["text"] += chunks[i][last["end"] - offset:]
+                    last["end"] = end
+                last["rank"] = min(last["rank"], rank)
+                last["score"] = max(last["score"], score)
+            else:
+                groups.append({"text": chunks[i], "end": end, "rank": rank, "score": score})
+        return [(group["text"], group["score"]) for group in sorted(groups, key=lambda g: g["rank"])]
 
     def search(self, query: str, top_k: int = TOP_K_CHUNKS) -> List[Tuple[str, float]]:
-        """Search for most similar chunks using cosine similarity."""
-        if not self.chunks or self.embeddings is None:
+        """Return the top_k (chunk, score) pairs for a query.
+
+        Scores are cosine similarities, or with hybrid search reciprocal rank fusion
+        scores (at most 2 / (RRF_K + 1), about 0.03), which only order the results; use
+        similarities() for values to threshold on.
+        """
+        # read once: a background indexer may swap in a larger matrix meanwhile
+        embeddings = self.embeddings
+        if not self.chunks or embeddings is None or len(embeddings) == 0:
             logger.warning("No document chunks available for search")
             return []
 
         logger.info(f"Searching for: {query}")
-        query_embedding = self.model.encode(query, normalize_embeddings=True, show_progress_bar=False)
+        with system_monitor.span("search"):
+            ids, scores = self.search_embedding(self.embed_query(query), top_k, embeddings, query)
+            results = [(self.chunks[i], float(s)) for i, s in zip(ids, scores)]
+        logger.info(f"Found {len(results)} relevant chunks")
+        return results
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Encode a query into a normalized embedding."""
+        with system_monitor.span("encode_query"):
+            return self.model.encode(query, normalize_embeddings=True, show_progress_bar=False)
 
+    def search_embedding(self, query_embedding: np.ndarray, top_k: int = TOP_K_CHUNKS,
+                         embeddings: Optional[np.ndarray] = None,
+                         query: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of the top_k chunks for an already encoded query.
+
+        Pass the query text as well to fuse in BM25 results (hybrid search); the scores
+        are then RRF scores rather than cosine similarities, as in search().
+        """
+        if embeddings is None:
+            embeddings = self.embeddings
+        if embeddings is None or len(embeddings) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        queries = None if query is None else [query]
+        with system_monitor.span("similarity_search"):
+            ids, scores = self._retrieve(embeddings, self.lexical, np.asarray(query_embedding)[None, :], queries, top_k)
+        return ids[0], scores[0]
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode several queries into normalized embeddings with one model call."""
+        with system_monitor.span("encode_query"):
+            return self.model.encode(list(queries), normalize_embeddings=True, show_progress_bar=False)
+
+    def search_embeddings(self, query_embeddings: np.ndarray, top_k: int = TOP_K_CHUNKS,
+                          queries: Optional[List[str]] = None) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Return per-query (ids, scores) for encoded queries, scored with one matrix-matrix product.
+
+        Pass the query texts as well to fuse in BM25 results (hybrid search); the scores
+        are then RRF scores rather than cosine similarities, as in search().
+        """
+        embeddings = self.embeddings
+        if embeddings is None or len(embeddings) == 0:
+            count = len(query_embeddings)
+            return [np.empty(0, dtype=np.int64)] * count, [np.empty(0, dtype=np.float32)] * count
+        with system_monitor.span("similarity_search"):
+            return self._retrieve(embeddings, self.lexical, np.asarray(query_embeddings), queries, top_k)
+
+    def similarities(self, query_embedding: np.ndarray, ids: Iterable[int]) -> np.ndarray:
+        """Cosine similarity of an encoded query to the given chunks, whether or not search is hybrid."""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        embeddings = self.embeddings
+        if embeddings is None or len(ids) == 0:
+            return np.empty(0, dtype=np.float32)
+        if isinstance(embeddings, QuantizedEmbeddings):
+            vectors = embeddings.rows(ids)
+        else:
+            vectors = np.asarray(embeddings[ids], dtype=np.float32)
+        return vectors @ np.asarray(query_embedding, dtype=np.float32)
+
+    def search_many(self, queries: List[str], top_k: int = TOP_K_CHUNKS) -> List[List[Tuple[str, float]]]:
+        """Search several queries with one encode call and one matrix-matrix product."""
+        if not queries:
+            return []
+        return self._rank(self.embed_queries(queries), [top_k] * len(queries), list(queries))
+
+    def submit_search(self, query: str, top_k: int = TOP_K_CHUNKS) -> Future:
+        """Queue a search on the shared micro-batcher and return a Future of its results.
+
+        Queries submitted within SEARCH_BATCH_WAIT of each other (from any thread or
+        processor) are encoded together, so concurrent searches share one model call.
+        """
+        return _query_batcher.submit((self, query, top_k))
+
+    def _rank(self, query_embeddings: np.ndarray, top_ks: List[int],
+              queries: Optional[List[str]] = None) -> List[List[Tuple[str, float]]]:
+        """Score encoded queries against all chunks at once and return each query's top chunks."""
+        # embeddings and BM25 index before chunks: a background indexer publishes chunks first
+        embeddings = self.embeddings
+        lexical = self.lexical
+        chunks = self.chunks
+        if not chunks or embeddings is None or len(embeddings) == 0:
+            logger.warning("No document chunks available for search")
+            return [[] for _ in top_ks]
+        ids, scores = self._retrieve(embeddings, lexical, query_embeddings, queries, max(top_ks))
+        return [
+            [(chunks[i], float(s)) for i, s in zip(ids[row][:k], scores[row][:k])]
+            for row, k in enumerate(top_ks)
+        ]
+
+    def _retrieve(self, embeddings, lexical: Optional[BM25Index], query_embeddings: np.ndarray,
+                  queries: Optional[List[str]], top_k: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Return per-query (ids, scores), fusing vector and BM25 rankings when both are available.
+
+        Fused scores are reciprocal rank fusion scores rather than cosine similarities.
+        """
+        if lexical is None or len(lexical) == 0 or queries is None:
+            ids, scores = self._top_k(embeddings, query_embeddings, top_k)
+            return list(ids), list(scores)
+        depth = max(top_k, HYBRID_CANDIDATES)
+        with system_monitor.span("vector_search"):
+            vector_ids, _ = self._top_k(embeddings, query_embeddings, depth)
+        with system_monitor.span("bm25_search"):
+            lexical_ids = [lexical.search(query, depth)[0] for query in queries]
+        fused = [
+            reciprocal_rank_fusion([ranking, lexical_ranking], top_k)
+            for ranking, lexical_ranking in zip(vector_ids, lexical_ids)
+        ]
+        return [ids for ids, _ in fused], [scores for _, scores in fused]
+
+    def _top_k(self, embeddings, query_embeddings: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ids, scores) of each query's top_k chunks, one row per query."""
+        if isinstance(embeddings, QuantizedEmbeddings):
+            return embeddings.search(query_embeddings, top_k)
         # Find most similar chunks using cosine similarity
-        similarities = np.dot(self.embeddings, query_embedding)
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        scores = np.asarray(query_embeddings, dtype=np.float32) @ embeddings.T
+        ids = top_k_rows(scores, top_k)
+        return ids, np.take_along_axis(scores, ids, axis=1)
 
-        results = [(self.chunks[i], float(similarities[i])) for i in top_indices]
-        logger.info(f"Found {len(results)} relevant chunks")
-        return results
+def _search_batch(requests: List[Tuple[DocumentProcessor, str, int]]) -> List[List[Tuple[str, float]]]:
+    """Serve a batch of queued searches: one encode call per model, one matrix product per processor."""
+    results = [None] * len(requests)
+    by_model = {}
+    for i, (processor, _, _) in enumerate(requests):
+        by_model.setdefault(id(processor.model), []).append(i)
+    for positions in by_model.values():
+        model = requests[positions[0]][0].model
+        query_embeddings = model.encode(
+            [requests[i][1] for i in positions], normalize_embeddings=True, show_progress_bar=False
+        )
+        by_processor = {}
+        for row, i in enumerate(positions):
+            by_processor.setdefault(id(requests[i][0]), []).append((row, i))
+        for group in by_processor.values():
+            processor = requests[group[0][1]][0]
+            ranked = processor._rank(
+                query_embeddings[[row for row, _ in group]],
+                [requests[i][2] for _, i in group],
+                [requests[i][1] for _, i in group]
+            )
+            for (_, i), result in zip(group, ranked):
+                results[i] = result
+    logger.info(f"Searched {len(requests)} queued queries in one batch")
+    return results
+
+# shared by all processors, since they normally share one model
+_query_batcher = MicroBatcher(_search_batch, SEARCH_BATCH_MAX, SEARCH_BATCH_WAIT)
@@ -0,0 +1,49 @@
+# embedding_model.py
+import threading
+from typing import TYPE_CHECKING, Optional
+from config import EMBEDDING_MODEL
+from logger import logger
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+_model: Optional["SentenceTransformer"] = None
+_lock = threading.Lock()
+_warmup: Optional[threading.Thread] = None
+
+
+def get_embedding_model() -> "SentenceTransformer":
+    """Return the shared sentence transformer, importing and loading it on first use."""
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                # torch and sentence-transformers take seconds to import, so only pay for
+                # them once embeddings are actually needed
+                from sentence_transformers import SentenceTransformer
+                logger.info("Loading sentence transformer model...")
+                _model = SentenceTransformer(EMBEDDING_MODEL)
+                logger.info("Model loaded successfully")
+    return _model
+
+
+def is_loaded() -> bool:
+    return _model is not None
+
+
+def warm_up() -> threading.Thread:
+    """Load the model in a background thread, e.g. while the user is still typing."""
+    global _warmup
+    with _lock:
+        if _warmup is None:
+            _warmup = threading.Thread(target=_load_quietly, name="embedding-warmup", daemon=True)
+            _warmup.start()
+    return _warmup
+
+
+def _load_quietly() -> None:
+    try:
+        get_embedding_model()
+    except Exception as e:
+        # the first real use will raise the error again
+        logger.error(f"Background model loading failed: {str(e)}")
@@ -0,0 +1,254 @@
+# endpoints.py
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, Iterable, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from config import (
+    LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN, LLM_HEALTH_INTERVAL, LLM_CONNECT_TIMEOUT,
+    LLM_AFFINITY_SLACK, LLM_AFFINITY_SESSIONS
+)
+from logger import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# weight of the newest request in an endpoint's moving average latency
+LATENCY_ALPHA = 0.2
+# recent request latencies kept per endpoint for percentiles
+LATENCY_WINDOW = 256
+
+
+class CircuitBreaker:
+    """Stops traffic to an endpoint after consecutive failures until it is healthy again.
+
+    Closed: requests flow. After `failures` consecutive failures it opens and refuses
+    requests. Once `cooldown` seconds have passed, a successful health check moves it
+    to half-open, where a single trial request decides between closed and open.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether allow() would let a request through, without claiming a half-open trial."""
+        with self._lock:
+            return self.state == CLOSED or (self.state == HALF_OPEN and not self._trial)
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now (half-open lets exactly one through)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self) -> bool:
+        """Count a failure; return True if it opened the circuit."""
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state != OPEN and (self.state == HALF_OPEN or self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def probe_due(self) -> bool:
+        """Whether a health check should run: after a failure, and for an open circuit once cooled down."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return self.state == CLOSED and self.failures > 0
+
+    def probe_result(self, healthy: bool) -> None:
+        """Apply a health check: a healthy open circuit goes half-open, a healthy closed one forgets its failures."""
+        with self._lock:
+            if not healthy:
+                if self.state == OPEN:
+                    # wait another cooldown before the next check
+                    self.opened_at = time.monotonic()
+            elif self.state == OPEN:
+                self.state = HALF_OPEN
+                self._trial = False
+            elif self.state == CLOSED:
+                self.failures = 0
+
+
+class Endpoint:
+    """One llamafile server: its completion URL, health URL, circuit breaker and load.
+
+    outstanding counts requests sent and not yet finished; latency is a moving
+    average of how long successful requests took.
+    """
+
+    def __init__(self, url: str, breaker: Optional[CircuitBreaker] = None):
+        self.url = url
+        parts = urlsplit(url)
+        self.base_url = urlunsplit((parts.scheme, parts.netloc, "", "", ""))
+        self.health_url = f"{self.base_url}/health"
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.requests = 0
+        self.latency = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, latency: float) -> None:
+        if self.latencies:
+            self.latency = (1 - LATENCY_ALPHA) * self.latency + LATENCY_ALPHA * latency
+        else:
+            self.latency = latency
+        self.latencies.append(latency)
+
+    def status(self) -> Dict:
+        latencies = sorted(self.latencies)
+        return {
+            "url": self.url,
+            "state": self.breaker.state,
+            "failures": self.breaker.failures,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "latency_ms": self.latency * 1000,
+            "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+            "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None
+        }
+
+
+class EndpointPool:
+    """Load-balanced llamafile endpoints with failover and background health checks.
+
+    acquire() sends each request to the endpoint with the fewest outstanding requests,
+    skipping open circuits and preferring endpoints without recent failures; ties go to
+    the lower moving-average latency, then to configuration order. A session goes back
+    to the endpoint that served it last, whose KV cache holds its prompt prefix, unless
+    that endpoint has more than affinity_slack requests more in flight than the least
+    loaded one. Traffic moves off an endpoint as soon as it fails and back once a health
+    check passes; the health check thread starts with the first failure and probes
+    GET /health every health_interval.
+    """
+
+    def __init__(self, urls: List[str], health_interval: float = LLM_HEALTH_INTERVAL,
+                 affinity_slack: int = LLM_AFFINITY_SLACK, max_sessions: int = LLM_AFFINITY_SESSIONS):
+        if not urls:
+            raise ValueError("At least one LLM endpoint is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.affinity_slack = affinity_slack
+        self.max_sessions = max_sessions
+        # session -> endpoint that served it last, least recently used first
+        self._sessions: OrderedDict = OrderedDict()
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        self._health_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def acquire(self, session: Optional[Hashable] = None, exclude: Iterable[Endpoint] = ()) -> Optional[Endpoint]:
+        """Return the endpoint to send the next request to, or None if every circuit is open.
+
+        Endpoints in exclude (e.g. ones that already failed this request) are only
+        chosen when no other is available. The request counts as outstanding on the
+        endpoint until record() is called.
+        """
+        with self._lock:
+            available = [e for e in self.endpoints if e.breaker.available()]
+            candidates = [e for e in available if e not in exclude] or available
+            while candidates:
+                endpoint = self._choose(candidates, session)
+                # a half-open endpoint admits one trial request
+                if endpoint.breaker.allow():
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    if session is not None:
+                        self._sessions[session] = endpoint
+                        self._sessions.move_to_end(session)
+                        if len(self._sessions) > self.max_sessions:
+                            self._sessions.popitem(last=False)
+                    return endpoint
+                candidates.remove(endpoint)
+            return None
+
+    def _choose(self, candidates: List[Endpoint], session: Optional[Hashable]) -> Endpoint:
+        best = min(candidates, key=lambda e: (e.breaker.failures > 0, e.outstanding, e.latency,
+                                              self.endpoints.index(e)))
+        if session is None:
+            return best
+        previous = self._sessions.get(session)
+        if previous is None:
+            return best
+        if (previous in candidates and previous.breaker.failures == 0
+                and previous.outstanding <= best.outstanding + self.affinity_slack):
+            self.affinity_hits += 1
+            return previous
+        self.affinity_misses += 1
+        return best
+
+    def record(self, endpoint: Endpoint, ok: bool, latency: Optional[float] = None) -> None:
+        """Report the outcome of a request from acquire(), with its duration if it succeeded."""
+        with self._lock:
+            endpoint.outstanding = max(endpoint.outstanding - 1, 0)
+            if ok and latency is not None:
+                endpoint.observe(latency)
+        if ok:
+            endpoint.breaker.record_success()
+            return
+        if endpoint.breaker.record_failure():
+            logger.warning(f"Circuit opened for LLM endpoint {endpoint.url}")
+        self._start_health_checks()
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [endpoint.status() for endpoint in self.endpoints]
+
+    def affinity_stats(self) -> Dict:
+        """How often a returning session was routed back to its previous endpoint."""
+        with self._lock:
+            returning = self.affinity_hits + self.affinity_misses
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.affinity_hits,
+                "misses": self.affinity_misses,
+                "hit_rate": self.affinity_hits / returning if returning else None
+            }
+
+    def check_health(self) -> None:
+        """Probe every endpoint that is due for a health check."""
+        for endpoint in self.endpoints:
+            if endpoint.breaker.probe_due():
+                healthy = self._probe(endpoint)
+                endpoint.breaker.probe_result(healthy)
+                if healthy:
+                    logger.info(f"LLM endpoint {endpoint.url} passed its health check")
+
+    def _probe(self, endpoint: Endpoint) -> bool:
+        try:
+            response = requests.get(endpoint.health_url, timeout=LLM_CONNECT_TIMEOUT)
+        except requests.RequestException:
+            return False
+        # servers without a /health route still answered
+        return response.status_code < 500
+
+    def _start_health_checks(self) -> None:
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        while True:
+            time.sleep(self.health_interval)
+            self.check_health()
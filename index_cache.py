@@ -0,0 +1,183 @@
+# index_cache.py
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from pathlib import Path
+from typing import List, Optional, Tuple
+from config import (
+    INDEX_CACHE_DIR, INDEX_CACHE_MAX_MB, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, EMBEDDING_MODEL
+)
+from logger import logger
+
+CHUNKS_FILE = "chunks.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+LAST_USED_FILE = "last_used"
+# source path -> key of the last index built for it, to update that index when the file changes
+SOURCES_FILE = "sources.json"
+
+
+def file_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def index_key(file_path: str, model_name: str = EMBEDDING_MODEL) -> str:
+    """Identify a document's index by file contents, chunking parameters and model name."""
+    # any change to the chunking or the model invalidates the index
+    params = f"{file_hash(file_path)}:sentences:{CHUNK_TOKENS}:{CHUNK_OVERLAP_TOKENS}:{model_name}"
+    return hashlib.sha256(params.encode('utf-8')).hexdigest()
+
+
+class IndexCache:
+    """Persistent store of document chunks and embeddings keyed by content hash."""
+
+    def __init__(self, cache_dir: Path = INDEX_CACHE_DIR, max_mb: float = INDEX_CACHE_MAX_MB):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, file_path: str, model_name: str = EMBEDDING_MODEL) -> str:
+        """Build the cache key from file contents, chunking parameters and model name."""
+        return index_key(file_path, model_name)
+
+    def load(self, key: str) -> Optional[Tuple[List[str], np.ndarray, List[dict], List[str]]]:
+        """Load cached chunks, a memory-mapped embedding matrix, chunk metadata and page texts.
+
+        Returns None on a miss.
+        """
+        entry = self.cache_dir / key
+        chunks_path = entry / CHUNKS_FILE
+        embeddings_path = entry / EMBEDDINGS_FILE
+        if not (chunks_path.exists() and embeddings_path.exists()):
+            return None
+        try:
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            chunks = stored["chunks"]
+            meta = stored.get("meta") or [{} for _ in chunks]
+            pages = stored.get("pages") or []
+            # mmap so the matrix is paged in lazily instead of read up front
+            embeddings = np.load(embeddings_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Discarding unreadable index cache entry {key}: {str(e)}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        if len(chunks) != embeddings.shape[0]:
+            logger.warning(f"Discarding inconsistent index cache entry {key}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        self._touch(entry)
+        logger.info(f"Loaded {len(chunks)} chunks from index cache {key[:12]}")
+        return chunks, embeddings, meta, pages
+
+    def load_previous(self, file_path: str) -> Optional[Tuple[List[str], np.ndarray, List[str], List[str]]]:
+        """Load the chunks, embeddings, page texts and page hashes last saved for a path, or None."""
+        key = self._sources().get(os.path.abspath(file_path))
+        if key is None:
+            return None
+        cached = self.load(key)
+        if cached is None:
+            return None
+        chunks, embeddings, _, pages = cached
+        try:
+            with open(self.cache_dir / key / CHUNKS_FILE, 'r', encoding='utf-8') as f:
+                hashes = json.load(f).get("page_hashes") or []
+        except (OSError, ValueError):
+            hashes = []
+        return chunks, embeddings, pages, hashes
+
+    def load_embeddings(self, key: str) -> Optional[np.ndarray]:
+        """Memory-map just the float32 embedding matrix of an entry, or return None."""
+        try:
+            return np.load(self.cache_dir / key / EMBEDDINGS_FILE, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: str, chunks: List[str], embeddings: np.ndarray,
+             meta: Optional[List[dict]] = None, pages: Optional[List[str]] = None,
+             page_hashes: Optional[List[str]] = None, source: Optional[str] = None) -> None:
+        """Store chunks, embeddings, chunk metadata and page texts, then evict old entries.
+
+        With a source path the entry is recorded as that path's latest index.
+        """
+        entry = self.cache_dir / key
+        tmp = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            with open(tmp / CHUNKS_FILE, 'w', encoding='utf-8') as f:
+                json.dump({"chunks": chunks, "meta": meta, "pages": pages, "page_hashes": page_hashes}, f)
+            np.save(tmp / EMBEDDINGS_FILE, np.ascontiguousarray(embeddings, dtype=np.float32))
+            self._touch(tmp)
+            # swap the finished entry in so readers never see a partial index
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except OSError as e:
+            logger.warning(f"Could not write index cache entry {key}: {str(e)}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        logger.info(f"Saved {len(chunks)} chunks to index cache {key[:12]}")
+        if source is not None:
+            self._record_source(source, key)
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove least recently used entries until the cache fits its size limit."""
+        entries = []
+        total = 0
+        for entry in self.cache_dir.iterdir():
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            size = sum(p.stat().st_size for p in entry.iterdir() if p.is_file())
+            entries.append((self._last_used(entry), size, entry))
+            total += size
+
+        # oldest first
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted index cache entry {entry.name[:12]}")
+
+    def _sources(self) -> dict:
+        """Return the source path -> key map."""
+        try:
+            with open(self.cache_dir / SOURCES_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record_source(self, source: str, key: str) -> None:
+        """Point a source path at its newest index."""
+        sources = self._sources()
+        sources[os.path.abspath(source)] = key
+        tmp = self.cache_dir / f".{SOURCES_FILE}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(sources, f)
+            os.replace(tmp, self.cache_dir / SOURCES_FILE)
+        except OSError as e:
+            logger.warning(f"Could not record index cache source {source}: {str(e)}")
+
+    def _touch(self, entry: Path) -> None:
+        """Record that an entry was just used."""
+        with open(entry / LAST_USED_FILE, 'w') as f:
+            f.write(str(time.time()))
+
+    def _last_used(self, entry: Path) -> float:
+        """Return when an entry was last used, falling back to its mtime."""
+        try:
+            with open(entry / LAST_USED_FILE, 'r') as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return entry.stat().st_mtime
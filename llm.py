@@ -1,24 +1,384 @@
 # llm.py (for llamafile)
+import asyncio
 import requests
 import json
-from config import LLM_URL, LLM_MAX_TOKENS, LLM_TEMPERATURE, LLM_STOP_WORDS
+import threading
+import time
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from config import (
+    LLM_URL, LLM_URLS, LLM_MAX_TOKENS, LLM_TEMPERATURE, LLM_STOP_WORDS,
+    LLM_CACHE_PROMPT, CHARS_PER_TOKEN, LLM_POOL_SIZE, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, MAX_RETRIES
+)
+from endpoints import EndpointPool, CircuitBreaker, OPEN
+from logger import logger
+from system_monitor import system_monitor
+from utils import backoff_delay
+
+# set once the server reports it has no /tokenize endpoint, so we stop asking
+_tokenize_unavailable = False
+# other /tokenize failures pause it for a cooldown, then a single trial request decides
+_tokenize_breaker = CircuitBreaker()
+
+# one client per endpoint list, so connections and circuit breakers are shared
+_clients = {}
+_clients_lock = threading.Lock()
+
+class LLMError(Exception):
+    """An LLM request that failed."""
+
+class RetriableLLMError(LLMError):
+    """A failure worth retrying, possibly on another endpoint: connection errors, timeouts, HTTP 429 and 5xx."""
+
+def _status_error(url, status, body=""):
+    """Return the error for an HTTP status, or None if it is a success."""
+    if status == 429 or status >= 500:
+        return RetriableLLMError(f"{url} returned HTTP {status}")
+    if status >= 400:
+        return LLMError(f"{url} returned HTTP {status}: {body[:200]}")
+    return None
+
+def _failure(e):
+    """Record a failed LLM call and return the error response shown to the user."""
+    logger.error(f"LLM request failed: {str(e)}")
+    system_monitor.annotate(error=str(e))
+    return f"Error: Could not connect to LLM server. Make sure it's running on port 8080. Details: {str(e)}"
+
+def _build_payload(prompt, stream=False, slot_id=None):
+    """Build the /completion request body from the config values."""
+    payload = {
+        "prompt": prompt,
+        "n_predict": LLM_MAX_TOKENS,
+        "temperature": LLM_TEMPERATURE,
+        "stop": LLM_STOP_WORDS,
+        "stream": stream,
+        # keep the evaluated prompt in the slot's KV cache for the next turn
+        "cache_prompt": LLM_CACHE_PROMPT
+    }
+    if slot_id is not None:
+        # older llamafile builds read slot_id, newer ones id_slot
+        payload["slot_id"] = slot_id
+        payload["id_slot"] = slot_id
+    return payload
+
+def _report_prompt_stats(data):
+    """Record the server's prompt token counts and timings for the current query."""
+    timings = data.get("timings") or {}
+    if timings.get("prompt_ms") is not None and timings.get("predicted_ms") is not None:
+        # server-side split of the llm span: prompt evaluation, then token generation
+        system_monitor.annotate(
+            server_prompt_time=timings["prompt_ms"] / 1000,
+            server_generation_time=timings["predicted_ms"] / 1000,
+            server_generated_tokens=timings.get("predicted_n")
+        )
+    prompt_tokens = data.get("tokens_evaluated")
+    prefilled = timings.get("prompt_n")
+    if prompt_tokens is None or prefilled is None:
+        return
+    system_monitor.annotate(
+        prompt_tokens=prompt_tokens,
+        prefill_tokens=prefilled,
+        prefill_tokens_saved=max(prompt_tokens - prefilled, 0)
+    )
 
 # Run the LLM server on port 8080
 # using mistral-7b-instruct-v0.3-q4_0.llamafile
-def run_llm(prompt):
-    """Send prompt to the running LLM server."""
+def run_llm(prompt, stream=False, url=None, slot_id=None, session=None):
+    """Send prompt to the running LLM server.
+
+    url is one completion endpoint or a list to balance across (LLM_URLS by default);
+    requests with the same session go back to the endpoint that served it last.
+    Retriable failures are retried with backoff; a request that still fails returns an
+    "Error: ..." response. With stream=True a generator of text pieces is returned
+    instead of the full response.
+    """
+    if stream:
+        return stream_llm(prompt, url=url, slot_id=slot_id, session=session)
     try:
-        response = requests.post(
-            LLM_URL,
-            # use the config values
-            json={
-                "prompt": prompt,
-                "n_predict": LLM_MAX_TOKENS,
-                "temperature": LLM_TEMPERATURE,
-                "stop": LLM_STOP_WORDS
-            }
-        )
-        response.raise_for_status()
-        return response.json()["content"].strip()
+        with system_monitor.span("llm"):
+            data = get_client(url).complete(prompt, slot_id=slot_id, session=session)
+        _report_prompt_stats(data)
+        return data["content"].strip()
     except Exception as e:
-        return f"Error: Could not connect to LLM server. Make sure it's running on port 8080. Details: {str(e)}"
\ No newline at end of file
+        return _failure(e)
+
+def stream_llm(prompt, url=None, slot_id=None, session=None):
+    """Yield generated text pieces from the server's server-sent-events stream."""
+    try:
+        with system_monitor.span("llm"):
+            for event in get_client(url).stream(prompt, slot_id=slot_id, session=session):
+                if event.get("content"):
+                    yield event["content"]
+                if event.get("stop"):
+                    # the final event carries the prompt timings
+                    _report_prompt_stats(event)
+    except Exception as e:
+        yield _failure(e)
+
+def _endpoint_urls(url=None):
+    """Normalize a completion endpoint, list of endpoints or None (LLM_URLS) to a tuple."""
+    return tuple(LLM_URLS if url is None else [url] if isinstance(url, str) else url)
+
+def get_client(url=None):
+    """Return the shared LLMClient for a completion endpoint or list of endpoints."""
+    urls = _endpoint_urls(url)
+    with _clients_lock:
+        client = _clients.get(urls)
+        if client is None:
+            client = _clients[urls] = LLMClient(list(urls))
+        return client
+
+class LLMClient:
+    """Pooled keep-alive client for one or more llamafile servers.
+
+    Requests use connect/read timeouts and are routed by the EndpointPool: least
+    outstanding requests, with session affinity. Connection errors, timeouts and
+    429/5xx responses are retried (MAX_RETRIES attempts) on another endpoint right
+    away, with jittered backoff of RETRY_DELAY * 2**n only when every endpoint has
+    failed the request; each endpoint's circuit breaker stops traffic to a server that
+    keeps failing.
+    """
+
+    def __init__(self, urls=LLM_URLS, pool_size=LLM_POOL_SIZE, timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)):
+        self.endpoints = EndpointPool(list(urls))
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def tokenize_url(self):
+        """The /tokenize URL of the first endpoint whose circuit isn't open."""
+        endpoints = self.endpoints.endpoints
+        endpoint = next((e for e in endpoints if e.breaker.available()), endpoints[0])
+        return f"{endpoint.base_url}/tokenize"
+
+    def complete(self, prompt, slot_id=None, session=None):
+        """Return the server's JSON response for a prompt."""
+        endpoint, response, started = self._post(_build_payload(prompt, slot_id=slot_id), session=session)
+        try:
+            data = response.json()
+        except ValueError as e:
+            self.endpoints.record(endpoint, False)
+            raise LLMError(f"{endpoint.url} returned invalid JSON") from e
+        self.endpoints.record(endpoint, True, time.perf_counter() - started)
+        return data
+
+    def stream(self, prompt, slot_id=None, session=None):
+        """Yield the server-sent events of a streamed completion.
+
+        Only opening the stream is retried: once tokens have arrived, a failure ends it.
+        """
+        endpoint, response, started = self._post(_build_payload(prompt, stream=True, slot_id=slot_id),
+                                                  stream=True, session=session)
+        ok, finished = True, False
+        try:
+            with response:
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    # events look like "data: {...}", blank lines separate them
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    event = json.loads(data)
+                    yield event
+                    if event.get("stop"):
+                        break
+            finished = True
+        except (requests.RequestException, ValueError) as e:
+            ok = False
+            raise LLMError(f"Stream from {endpoint.url} failed: {str(e)}") from e
+        finally:
+            # also runs when the caller stops reading early, which ends the request
+            self.endpoints.record(endpoint, ok, time.perf_counter() - started if finished else None)
+
+    def _post(self, payload, stream=False, session=None):
+        """POST a completion request, failing over on retriable errors; return (endpoint, response, start time).
+
+        A failed request moves to an endpoint that hasn't failed it yet straight away;
+        jittered backoff only applies before retrying an endpoint that already failed it.
+        """
+        tried = set()
+        backoffs = 0
+        for attempt in range(MAX_RETRIES):
+            endpoint = self.endpoints.acquire(session, exclude=tried)
+            if endpoint is None:
+                raise LLMError("No LLM server available: every endpoint's circuit is open")
+            if endpoint in tried:
+                time.sleep(backoff_delay(backoffs))
+                backoffs += 1
+            try:
+                return self._send(endpoint, payload, stream)
+            except RetriableLLMError:
+                tried.add(endpoint)
+                if attempt == MAX_RETRIES - 1:
+                    raise
+
+    def _send(self, endpoint, payload, stream=False):
+        """POST once to an acquired endpoint; return (endpoint, response, start time)."""
+        started = time.perf_counter()
+        try:
+            response = self.session.post(endpoint.url, json=payload, stream=stream, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.endpoints.record(endpoint, False)
+            logger.warning(f"LLM request to {endpoint.url} failed: {str(e)}")
+            raise RetriableLLMError(f"{endpoint.url}: {str(e)}") from e
+        error = _status_error(endpoint.url, response.status_code, "" if stream else response.text)
+        if error is not None:
+            response.close()
+            # a 4xx means the server is up and the request is at fault
+            self.endpoints.record(endpoint, not isinstance(error, RetriableLLMError))
+            logger.warning(str(error))
+            raise error
+        return endpoint, response, started
+
+@lru_cache(maxsize=4096)
+def _tokenize(text, urls):
+    """Token count from the servers' /tokenize endpoint; failures raise and are not cached."""
+    client = get_client(urls)
+    response = client.session.post(client.tokenize_url(), json={"content": text},
+                                   timeout=(LLM_CONNECT_TIMEOUT, 5))
+    response.raise_for_status()
+    return len(response.json()["tokens"])
+
+
+def _tokenize_allowed():
+    """Whether /tokenize may be called now; an open circuit gets a trial request after its cooldown."""
+    if _tokenize_breaker.state == OPEN and _tokenize_breaker.probe_due():
+        _tokenize_breaker.probe_result(True)
+    return _tokenize_breaker.allow()
+
+
+def count_tokens(text, url=None):
+    """Count tokens with the server's /tokenize endpoint, estimating when it is unavailable.
+
+    url is the completion endpoint or list of endpoints the text will be sent to
+    (LLM_URLS by default); they all serve the same model, so any of them can count.
+    Only a 404/501 (no such endpoint) switches to estimates for good; other failures
+    fall back to estimates until the circuit breaker's cooldown has passed.
+    """
+    global _tokenize_unavailable
+    if not _tokenize_unavailable and _tokenize_allowed():
+        try:
+            count = _tokenize(text, _endpoint_urls(url))
+            _tokenize_breaker.record_success()
+            return count
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (404, 501):
+                _tokenize_unavailable = True
+                logger.warning(f"Tokenize endpoint not supported, estimating token counts: {str(e)}")
+            elif _tokenize_breaker.record_failure():
+                logger.warning(f"Tokenize endpoint failing, estimating token counts for a while: {str(e)}")
+        except Exception as e:
+            if _tokenize_breaker.record_failure():
+                logger.warning(f"Tokenize endpoint failing, estimating token counts for a while: {str(e)}")
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class AsyncLLMClient:
+    """Pooled keep-alive client for the LLM server(s), for use from asyncio code.
+
+    Uses the same timeouts, retries, routing and circuit breakers as LLMClient.
+    """
+
+    def __init__(self, url=LLM_URL, pool_size=LLM_POOL_SIZE):
+        self.urls = [url] if isinstance(url, str) else list(url)
+        self.url = self.urls[0]
+        self.pool_size = pool_size
+        self.endpoints = EndpointPool(self.urls)
+        self._session = None
+
+    async def start(self):
+        """Open the connection pool."""
+        # only the async server needs aiohttp
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(sock_connect=LLM_CONNECT_TIMEOUT, sock_read=LLM_READ_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def complete(self, prompt, slot_id=None, session=None):
+        """Return the full response for a prompt."""
+        try:
+            with system_monitor.span("llm"):
+                endpoint, response, started = await self._post(_build_payload(prompt, slot_id=slot_id), session)
+                try:
+                    async with response:
+                        data = await response.json()
+                except Exception:
+                    self.endpoints.record(endpoint, False)
+                    raise
+            self.endpoints.record(endpoint, True, time.perf_counter() - started)
+            _report_prompt_stats(data)
+            return data["content"].strip()
+        except Exception as e:
+            return self._failure(e)
+
+    async def stream(self, prompt, slot_id=None, session=None):
+        """Yield generated text pieces from the server's server-sent-events stream."""
+        try:
+            payload = _build_payload(prompt, stream=True, slot_id=slot_id)
+            with system_monitor.span("llm"):
+                endpoint, response, started = await self._post(payload, session)
+                ok, finished = True, False
+                try:
+                    async with response:
+                        async for raw_line in response.content:
+                            line = raw_line.decode('utf-8').strip()
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+                            event = json.loads(data)
+                            if event.get("content"):
+                                yield event["content"]
+                            if event.get("stop"):
+                                _report_prompt_stats(event)
+                                break
+                    finished = True
+                except Exception:
+                    ok = False
+                    raise
+                finally:
+                    self.endpoints.record(endpoint, ok, time.perf_counter() - started if finished else None)
+        except Exception as e:
+            yield self._failure(e)
+
+    async def _post(self, payload, session=None):
+        """POST to the chosen endpoint, failing over like LLMClient._post; return (endpoint, response, start time)."""
+        import aiohttp
+        tried = set()
+        backoffs = 0
+        for attempt in range(MAX_RETRIES):
+            endpoint = self.endpoints.acquire(session, exclude=tried)
+            if endpoint is None:
+                raise LLMError("No LLM server available: every endpoint's circuit is open")
+            if endpoint in tried:
+                await asyncio.sleep(backoff_delay(backoffs))
+                backoffs += 1
+            started = time.perf_counter()
+            try:
+                response = await self._session.post(endpoint.url, json=payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = RetriableLLMError(f"{endpoint.url}: {str(e) or type(e).__name__}")
+            else:
+                error = _status_error(endpoint.url, response.status,
+                                      await response.text() if 400 <= response.status < 500 else "")
+                if error is None:
+                    return endpoint, response, started
+                response.release()
+            self.endpoints.record(endpoint, not isinstance(error, RetriableLLMError))
+            logger.warning(str(error))
+            if not isinstance(error, RetriableLLMError) or attempt == MAX_RETRIES - 1:
+                raise error
+            tried.add(endpoint)
+
+    def _failure(self, e):
+        logger.error(f"LLM request failed: {str(e)}")
+        system_monitor.annotate(error=str(e))
+        return f"Error: Could not connect to LLM server at {self.url}. Details: {str(e)}"
@@ -1,8 +1,10 @@
 # main.py
 import os
 import shutil
-from pipeline import run_pipeline
-from config import UPLOAD_DIR
+from pipeline import run_pipeline, start_indexing
+from prompt_builder import PromptBuilder
+from config import UPLOAD_DIR, LLM_STREAM, EMBEDDING_WARMUP
+from embedding_model import warm_up
 from system_monitor import system_monitor
 
 def read_file():
@@ -15,6 +17,9 @@ def read_file():
     choice = input("Enter 1 or 2: ").strip()
 
     if choice == "1":
+        if EMBEDDING_WARMUP:
+            # load the embedding model while the user types the path
+            warm_up()
         file_name = input("Enter the full path to your file: ").strip()
         # Remove quotes if present
         file_name = file_name.strip("'\"")
@@ -43,7 +48,8 @@ def chat_loop(file_path=None):
     print("\nStarting chat (type 'exit' to quit, 'clear' to clear context, 'stats' for metrics)")
     print("=" * 50)
     
-    context = []
+    # keeps the conversation as an append-only prompt for the server's KV cache
+    builder = PromptBuilder()
     while True:
         # Get user input
         user_input = input("\nYou: ").strip()
@@ -55,7 +61,7 @@ def chat_loop(file_path=None):
             print("\nGoodbye!")
             break
         elif user_input.lower() == 'clear':
-            context = []
+            builder.reset()
             print("\nContext cleared!")
             continue
         elif user_input.lower() == 'stats':
@@ -64,6 +70,11 @@ def chat_loop(file_path=None):
             print("\nCurrent Metrics:")
             print(f"Total Queries: {summary['total_queries']}")
             print(f"Average Response Time: {summary['avg_inference_time']:.2f}s")
+            print(f"Average Time to First Token: {summary['avg_time_to_first_token']:.2f}s")
+            print(f"Average Tokens per Second: {summary['avg_tokens_per_second']:.1f}")
+            print(f"Average Queue Time: {summary['avg_queue_time']:.2f}s")
+            print(f"Shed Queries: {summary['shed_queries']}")
+            print(f"Response Cache Hit Rate: {summary['cache_hit_rate']:.1%}")
             print(f"Total Characters: {summary['total_chars']}")
             print(f"Average Characters per Query: {summary['avg_chars_per_query']:.1f}")
             print(f"Errors: {summary['errors']}")
@@ -71,26 +82,34 @@ def chat_loop(file_path=None):
             print(f"Session Duration: {summary['session_duration']:.1f}s")
             continue
         
-        # Add user message to context
-        context.append(f"Human: {user_input}")
-        
-        # Prepare prompt with context
-        prompt = "\n".join(context) + "\nAssistant:"
-        
         # Get response
-        response = run_pipeline(prompt, file_path)
+        if LLM_STREAM:
+            # Print tokens as they arrive
+            print("\nAssistant: ", end="", flush=True)
+            pieces = []
+            for token in run_pipeline(user_input, file_path, stream=True, builder=builder):
+                if not pieces:
+                    token = token.lstrip()
+                print(token, end="", flush=True)
+                pieces.append(token)
+            print()
+            response = "".join(pieces).strip()
+        else:
+            response = run_pipeline(user_input, file_path, builder=builder)
+            # Print response
+            print("\nAssistant:", response)
         
         # Add response to context
-        context.append(f"Assistant: {response}")
-        
-        # Print response
-        print("\nAssistant:", response)
+        builder.add_response(response)
         print("-" * 50)
 
 if __name__ == "__main__":
     try:
         # Handle file upload if any
         file_path = read_file()
+        if file_path:
+            # index while the user types the first question
+            start_indexing(file_path)
         
         # Start chat loop
         chat_loop(file_path)
@@ -0,0 +1,176 @@
+# metrics_store.py
+import io
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import pandas as pd
+from config import METRICS_STORE_MAX_PARTS
+from logger import logger
+
+# JSONL bytes already copied into the store, per metrics file
+OFFSETS_FILE = "offsets.json"
+PERCENTILES = [0.5, 0.95, 0.99]
+
+
+def _missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _normalize(frame: pd.DataFrame) -> pd.DataFrame:
+    """Make columns Parquet-friendly: nested values become JSON text, mixed types become text."""
+    for column in frame.columns[frame.dtypes == object]:
+        types = {type(value) for value in frame[column] if not _missing(value)}
+        if types & {list, dict}:
+            frame[column] = [None if _missing(v) else json.dumps(v) for v in frame[column]]
+        elif len(types) > 1:
+            frame[column] = [None if _missing(v) else str(v) for v in frame[column]]
+    return frame
+
+
+class MetricsStore:
+    """Day-partitioned Parquet copy of the metrics JSONL files, loaded incrementally.
+
+    refresh() appends only the JSONL lines written since the last call to
+    <store_dir>/day=YYYY-MM-DD/*.parquet and reads only the Parquet files it hasn't
+    read yet, so calling it on every dashboard rerun is cheap. Nested fields such as
+    spans are stored as JSON text.
+    """
+
+    def __init__(self, log_dir: str = 'logs', store_dir: Optional[str] = None,
+                 max_parts: int = METRICS_STORE_MAX_PARTS):
+        self.log_dir = Path(log_dir)
+        self.store_dir = Path(store_dir) if store_dir is not None else self.log_dir / "metrics_store"
+        self.max_parts = max_parts
+        # parquet path -> its rows, so each file is read once
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._metrics: Optional[pd.DataFrame] = None
+        # summary file name -> (mtime, summary)
+        self._summaries: Dict[str, Tuple[int, dict]] = {}
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def refresh(self) -> pd.DataFrame:
+        """Compact new metrics into the store and return every query's metrics, oldest first."""
+        self.compact()
+        paths = {str(path) for path in self.store_dir.glob("day=*/*.parquet")}
+        new_paths = paths - set(self._frames)
+        # parts merged away since the last refresh
+        removed = set(self._frames) - paths
+        for path in removed:
+            del self._frames[path]
+        for path in sorted(new_paths):
+            self._frames[path] = pd.read_parquet(path)
+        if new_paths or removed or self._metrics is None:
+            frames = [frame for frame in self._frames.values() if not frame.empty]
+            metrics = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            if not metrics.empty:
+                metrics = metrics.sort_values('timestamp', kind='stable').reset_index(drop=True)
+            self._metrics = metrics
+        return self._metrics
+
+    def compact(self) -> int:
+        """Copy the JSONL lines written since the last compaction into the store; return how many."""
+        offsets = self._load_offsets()
+        rows = 0
+        for path in sorted(self.log_dir.glob("metrics_*.jsonl")):
+            start = offsets.get(path.name, 0)
+            size = path.stat().st_size
+            if size < start:
+                # the file was replaced
+                start = 0
+            if size == start:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(size - start)
+            # a line still being written is left for the next compaction
+            end = data.rfind(b"\n") + 1
+            if end == 0:
+                continue
+            frame = pd.read_json(io.BytesIO(data[:end]), lines=True, dtype=False, convert_dates=False)
+            self._write(frame, f"{path.stem}-{start}")
+            offsets[path.name] = start + end
+            rows += len(frame)
+        if rows:
+            self._save_offsets(offsets)
+            logger.info(f"Compacted {rows} metrics into {self.store_dir}")
+        return rows
+
+    def sessions(self) -> pd.DataFrame:
+        """Session summaries (summary_*.json), oldest first, re-reading only changed files."""
+        names = set()
+        for path in self.log_dir.glob("summary_*.json"):
+            names.add(path.name)
+            mtime = path.stat().st_mtime_ns
+            cached = self._summaries.get(path.name)
+            if cached is not None and cached[0] == mtime:
+                continue
+            try:
+                with open(path, 'r') as f:
+                    session = json.load(f)
+            except (OSError, ValueError):
+                continue
+            session['session_id'] = path.stem.replace('summary_', '')
+            self._summaries[path.name] = (mtime, session)
+        for name in set(self._summaries) - names:
+            del self._summaries[name]
+        sessions = [session for _, session in self._summaries.values()]
+        return pd.DataFrame(sorted(sessions, key=lambda s: s['session_id']))
+
+    def _write(self, frame: pd.DataFrame, name: str) -> None:
+        """Write new rows into their day partitions."""
+        frame = _normalize(frame)
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+        for day, part in frame.groupby(frame['timestamp'].dt.strftime('%Y-%m-%d')):
+            day_dir = self.store_dir / f"day={day}"
+            os.makedirs(day_dir, exist_ok=True)
+            self._write_parquet(part, day_dir / f"{name}.parquet")
+            self._merge_parts(day_dir)
+
+    def _merge_parts(self, day_dir: Path) -> None:
+        """Rewrite a day's parts as one file once it has more than max_parts."""
+        parts = sorted(day_dir.glob("*.parquet"))
+        if len(parts) <= self.max_parts:
+            return
+        frame = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        self._write_parquet(_normalize(frame), day_dir / f"merged-{time.time_ns()}.parquet")
+        for part in parts:
+            part.unlink()
+
+    def _write_parquet(self, frame: pd.DataFrame, path: Path) -> None:
+        # readers only ever see complete files
+        tmp = path.with_suffix(".parquet.tmp")
+        frame.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    def _load_offsets(self) -> Dict[str, int]:
+        try:
+            with open(self.store_dir / OFFSETS_FILE, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_offsets(self, offsets: Dict[str, int]) -> None:
+        tmp = self.store_dir / f".{OFFSETS_FILE}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(offsets, f)
+        os.replace(tmp, self.store_dir / OFFSETS_FILE)
+
+
+def latency_percentiles(metrics: pd.DataFrame, by: str) -> pd.DataFrame:
+    """p50/p95/p99 response time and median tokens/sec per group (e.g. session_id or day)."""
+    grouped = metrics.groupby(by)
+    table = grouped['inference_time'].quantile(PERCENTILES).unstack()
+    table.columns = [f"p{int(q * 100)}" for q in PERCENTILES]
+    table.insert(0, 'queries', grouped.size())
+    if 'tokens_per_second' in metrics:
+        table['median_tokens_per_second'] = grouped['tokens_per_second'].median()
+    return table.reset_index()
+
+
+def queries_per_minute(metrics: pd.DataFrame) -> pd.Series:
+    """Number of queries in each minute that saw any, indexed by minute."""
+    counts = metrics.set_index('timestamp').resample('1min').size()
+    return counts[counts > 0]
@@ -1,56 +1,170 @@
 # pipeline.py
 import os
+import threading
 from system_monitor import system_monitor
 from llm import run_llm
+from scheduler import llm_scheduler, OverloadedError, INTERACTIVE
 from document_processor import DocumentProcessor
-from config import TOP_K_CHUNKS
+from response_cache import ResponseCache
+from context_compressor import ContextCompressor
+from config import TOP_K_CHUNKS, CHARS_PER_TOKEN, RESPONSE_CACHE_ENABLED, CONTEXT_COMPRESSION, RERANK_CANDIDATES
 from logger import logger
 
 # Initialize document processor
 doc_processor = DocumentProcessor()
+# loading the response cache reads and rewrites its whole file, so it waits for the first document query
+response_cache_enabled = RESPONSE_CACHE_ENABLED
+response_cache = None
+_response_cache_lock = threading.Lock()
+context_compressor = ContextCompressor() if CONTEXT_COMPRESSION else None
+
+def get_response_cache():
+    """Return the shared response cache, loading it on first use; None if it is disabled."""
+    global response_cache
+    if response_cache is None and response_cache_enabled:
+        with _response_cache_lock:
+            if response_cache is None:
+                response_cache = ResponseCache()
+    return response_cache if response_cache_enabled else None
+
+def start_indexing(file_path):
+    """Start indexing a document in the background so it is searchable sooner."""
+    doc_processor.process_document(file_path, background=True)
 
 @system_monitor.monitor
-def run_pipeline(prompt, file_path=None):
-    """Run the pipeline with optional document context."""
+def run_pipeline(prompt, file_path=None, stream=False, builder=None, priority=INTERACTIVE, url=None):
+    """Run the pipeline with optional document context.
+
+    With a PromptBuilder, prompt is just the new question and the builder assembles a
+    cache-friendly prompt from the conversation so far. Without one, prompt is the full
+    conversation ending in "Assistant:". With stream=True the response is returned as a
+    generator of text pieces. Requests wait for a free LLM slot in priority order and are
+    shed with an error message when the queue is too long. Answers to questions about a
+    document are cached, and repeated or near-duplicate questions are served from the cache.
+    Retrieved chunks are filtered, reranked and cut down to their most relevant sentences
+    by the context compressor before they go into the prompt.
+    url is the LLM server's completion endpoint, or a list to balance across (LLM_URLS by default);
+    a builder's turns go back to the server that answered the previous one.
+    """
     try:
-        # If we have a document, get relevant chunks
-        if file_path:
-            # Process document if not already done
-            if not doc_processor.chunks:
-                doc_processor.process_document(file_path)
-            
+        if builder is not None:
+            user_question = prompt
+        else:
             # Get the user's question (last line of the prompt)
             user_question = prompt.split('\n')[-2].replace('Human: ', '') if '\n' in prompt else prompt
+
+        # If we have a document, get relevant chunks
+        relevant_chunks = []
+        chunk_ids = []
+        query_embedding = None
+        if file_path:
+            # (Re)index unless this exact document is indexed or being indexed; a revised
+            # file only has its changed pages and chunks processed again
+            with system_monitor.span("document"):
+                if not doc_processor.is_current(file_path):
+                    doc_processor.process_document(file_path)
+                doc_processor.wait_until_searchable()
+
             logger.info(f"Processing question: {user_question}")
-            
-            # Find relevant chunks
-            relevant_chunks = doc_processor.search(user_question, top_k=TOP_K_CHUNKS)
-            
-            if relevant_chunks:
-                # Combine relevant chunks with their context
-                doc_context = "\n\n".join(chunk for chunk, score in relevant_chunks)
-                
-                # Add document context to the prompt
-                full_prompt = f"""Context from document:
-{doc_context}
 
-Current conversation:
-{prompt}"""
-                logger.info("Added document context to prompt")
+            with system_monitor.span("retrieval"):
+                # Find relevant chunks (the query embedding is reused by the response cache)
+                query_embedding = doc_processor.embed_query(user_question)
+                top_k = RERANK_CANDIDATES if context_compressor is not None else TOP_K_CHUNKS
+                chunk_ids, scores = doc_processor.search_embedding(query_embedding, top_k, query=user_question)
+            if context_compressor is not None:
+                with system_monitor.span("context"):
+                    chunk_ids, relevant_chunks = context_compressor.select(
+                        user_question, query_embedding, doc_processor, chunk_ids
+                    )
             else:
+                # overlapping neighbours are joined so their shared sentences are sent once
+                relevant_chunks = doc_processor.merge_overlapping(chunk_ids, scores)
+            if not relevant_chunks:
                 logger.info("No relevant document sections found, using prompt without context")
-                full_prompt = prompt
         else:
             logger.info("No document provided, using prompt without context")
-            full_prompt = prompt
-        
+
+        with system_monitor.span("prompt"):
+            full_prompt = build_prompt(prompt, user_question, relevant_chunks, builder)
+
+        # Serve repeated questions about a fully indexed document from the cache
+        cache_key = None
+        index_id = doc_processor.index_id
+        cache = get_response_cache() if file_path and not doc_processor.indexing else None
+        if cache is not None:
+            with system_monitor.span("cache_lookup"):
+                cache_key = cache.key_for(index_id, chunk_ids, user_question)
+                cached, hit = cache.get(cache_key, index_id, query_embedding)
+            system_monitor.annotate(cache_hit=hit)
+            if cached is not None:
+                logger.info(f"Serving response from cache ({hit} match)")
+                return iter([cached]) if stream else cached
+
         # Get response from LLM
         logger.info("Sending prompt to LLM...")
-        response = run_llm(full_prompt)
-        logger.info("Received response from LLM")
+        slot_id = builder.slot_id if builder is not None else None
+        session = builder.session_id if builder is not None else None
+        if stream:
+            # the slot is held until the stream is consumed
+            response = llm_scheduler.stream(
+                lambda: run_llm(full_prompt, stream=True, url=url, slot_id=slot_id, session=session), priority
+            )
+        else:
+            with llm_scheduler.slot(priority):
+                response = run_llm(full_prompt, url=url, slot_id=slot_id, session=session)
+        logger.info("Streaming response from LLM" if stream else "Received response from LLM")
+        if cache_key is not None:
+            if stream:
+                return _cache_stream(cache, response, cache_key, index_id, query_embedding, user_question)
+            if not response.startswith("Error"):
+                cache.put(cache_key, response, index_id, query_embedding, user_question)
         return response
-        
+
+    except OverloadedError as e:
+        logger.warning(str(e))
+        error = f"Error: {str(e)}"
+        return iter([error]) if stream else error
+
     except Exception as e:
         logger.error(f"Error in pipeline: {str(e)}")
-        return f"Error in pipeline: {str(e)}"
+        system_monitor.annotate(error=str(e))
+        error = f"Error in pipeline: {str(e)}"
+        return iter([error]) if stream else error
+
+def build_prompt(prompt, user_question, relevant_chunks, builder=None):
+    """Assemble the LLM prompt from the conversation and the retrieved chunks."""
+    if builder is not None:
+        # Append the new turn (and any newly retrieved chunks) to the cached prefix
+        full_prompt = builder.build(user_question, [chunk for chunk, score in relevant_chunks])
+        system_monitor.annotate(
+            prompt_chars=len(full_prompt),
+            prompt_tokens=builder.prompt_tokens,
+            reused_prompt_chars=builder.reused_chars,
+            # estimate, replaced by the server's count when it reports one
+            prefill_tokens_saved=builder.reused_chars // CHARS_PER_TOKEN
+        )
+    elif relevant_chunks:
+        # Combine relevant chunks with their context
+        doc_context = "\n\n".join(chunk for chunk, score in relevant_chunks)
+
+        # Add document context to the prompt
+        full_prompt = f"""Context from document:
+{doc_context}
+
+Current conversation:
+{prompt}"""
+        logger.info("Added document context to prompt")
+    else:
+        full_prompt = prompt
+    return full_prompt
 
+def _cache_stream(cache, tokens, cache_key, index_id, query_embedding, question):
+    """Pass a streamed response through and cache it once it has been read to the end."""
+    pieces = []
+    for token in tokens:
+        pieces.append(token)
+        yield token
+    response = "".join(pieces).strip()
+    if response and not response.startswith("Error"):
+        cache.put(cache_key, response, index_id, query_embedding, question)
@@ -0,0 +1,203 @@
+# prompt_builder.py
+import os
+import threading
+import uuid
+from typing import Callable, Iterable, List, Optional
+from config import (
+    SYSTEM_PROMPT, CONTEXT_TOKEN_BUDGET, HISTORY_TOKEN_BUDGET, CHUNK_TOKEN_BUDGET,
+    SUMMARY_KEEP_TURNS
+)
+from llm import run_llm, count_tokens
+from logger import logger
+from scheduler import llm_scheduler, OverloadedError, BATCH
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation in a few sentences, keeping names, numbers "
+    "and facts from the document context that the user asked about.\n\n{text}\n\nSummary:"
+)
+
+
+def summarize_with_llm(text: str, url=None) -> str:
+    """Summarize earlier turns with the LLM server, at batch priority behind interactive queries."""
+    with llm_scheduler.slot(BATCH):
+        summary = run_llm(SUMMARY_PROMPT.format(text=text), url=url)
+    if summary.startswith("Error:"):
+        raise RuntimeError(summary)
+    return summary
+
+
+class PromptBuilder:
+    """Builds append-only prompts so the LLM server can reuse its KV cache between turns.
+
+    Every prompt starts with the previous prompt plus the previous response, so only the
+    new turn has to be prefilled. Document chunks are pinned into the conversation the
+    first time they are retrieved instead of being re-sent in front of the history.
+
+    The history is kept within HISTORY_TOKEN_BUDGET by folding old turns into a summary
+    in a background thread; CONTEXT_TOKEN_BUDGET is a hard cap enforced by dropping the
+    oldest turns if a summary hasn't landed in time.
+    """
+
+    def __init__(self, system_text: str = SYSTEM_PROMPT, slot_id: Optional[int] = None,
+                 count: Callable[[str], int] = count_tokens,
+                 summarize: Optional[Callable[[str], str]] = summarize_with_llm,
+                 session_id: Optional[str] = None):
+        self.system_text = system_text
+        self.slot_id = slot_id
+        # routes the conversation's requests back to the LLM server holding its KV cache
+        self.session_id = session_id or uuid.uuid4().hex
+        self.count = count
+        self.summarize = summarize
+        self.summary = ""
+        self.turns: List[str] = []
+        self.pinned_chunks: List[str] = []
+        self._pending: Optional[str] = None
+        self._last_prompt = ""
+        self.reused_chars = 0
+        self.prompt_tokens = 0
+        # guards summary/turns against the background compaction
+        self._lock = threading.Lock()
+        self._compacting = False
+        self._generation = 0
+        self._dropped = 0
+
+    def build(self, question: str, chunks: Iterable[str] = ()) -> str:
+        """Return the prompt for a new question, pinning chunks not already in the prefix."""
+        with self._lock:
+            # take chunks in rank order until the per-turn chunk budget is spent
+            new_chunks = []
+            chunk_tokens = 0
+            for chunk in chunks:
+                if chunk in self.pinned_chunks or chunk in new_chunks:
+                    continue
+                tokens = self.count(chunk)
+                if chunk_tokens + tokens > CHUNK_TOKEN_BUDGET:
+                    break
+                new_chunks.append(chunk)
+                chunk_tokens += tokens
+            self.pinned_chunks.extend(new_chunks)
+
+            segment = ""
+            if new_chunks:
+                segment += "Context from document:\n" + "\n\n".join(new_chunks) + "\n\n"
+            segment += f"Human: {question}\nAssistant:"
+            # a turn without a response (e.g. an interrupted stream) is replaced, not kept
+            self._pending = segment
+
+            segment_tokens = self.count(segment)
+            self._enforce_context_budget(segment_tokens)
+            prompt = self._prefix() + segment
+            self.prompt_tokens = self._prefix_tokens() + segment_tokens
+        # how much of the prompt the server already has cached from the last turn
+        self.reused_chars = len(os.path.commonprefix([self._last_prompt, prompt]))
+        self._last_prompt = prompt
+        return prompt
+
+    def add_response(self, response: str) -> None:
+        """Append the response to the pending turn so it becomes part of the prefix."""
+        if self._pending is None:
+            return
+        with self._lock:
+            self.turns.append(f"{self._pending} {response}")
+        self._pending = None
+        # the server has cached the prompt followed by the generated response
+        self._last_prompt += f" {response}"
+        self._maybe_compact()
+
+    def reset(self) -> None:
+        """Drop the conversation and pinned document context."""
+        with self._lock:
+            # invalidates any summary still being generated
+            self._generation += 1
+            self._compacting = False
+            self.summary = ""
+            self.turns = []
+            self.pinned_chunks = []
+            self._pending = None
+        self._last_prompt = ""
+        self.reused_chars = 0
+        self.prompt_tokens = 0
+
+    def history_tokens(self) -> int:
+        """Return the token count of the summary and completed turns."""
+        with self._lock:
+            parts = [self.summary] + self.turns if self.summary else list(self.turns)
+        # counts are cached per part, so only new turns are tokenized
+        return sum(self.count(part) for part in parts)
+
+    def _prefix_parts(self) -> List[str]:
+        """Return the system text, summary and completed turns that make up the prefix."""
+        parts = [self.system_text] if self.system_text else []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        parts.extend(self.turns)
+        return parts
+
+    def _prefix(self) -> str:
+        """Return the stable part of the prompt."""
+        parts = self._prefix_parts()
+        return "\n".join(parts) + "\n" if parts else ""
+
+    def _prefix_tokens(self) -> int:
+        return sum(self.count(part) for part in self._prefix_parts())
+
+    def _enforce_context_budget(self, segment_tokens: int) -> None:
+        """Drop the oldest turns until the prompt fits CONTEXT_TOKEN_BUDGET (lock held)."""
+        dropped = False
+        while self.turns and self._prefix_tokens() + segment_tokens > CONTEXT_TOKEN_BUDGET:
+            logger.warning("Prompt over context budget, dropping the oldest turn")
+            self.turns.pop(0)
+            self._dropped += 1
+            dropped = True
+        if dropped:
+            self._unpin_removed()
+
+    def _unpin_removed(self) -> None:
+        """Forget pinned chunks whose turns are gone so they can be sent again (lock held)."""
+        self.pinned_chunks = [
+            chunk for chunk in self.pinned_chunks
+            if any(chunk in turn for turn in self.turns) or (self._pending and chunk in self._pending)
+        ]
+
+    def _maybe_compact(self) -> None:
+        """Start a background summary of old turns once the history is over budget."""
+        if self.summarize is None or self._compacting:
+            return
+        if self.history_tokens() <= HISTORY_TOKEN_BUDGET:
+            return
+        with self._lock:
+            count = len(self.turns) - SUMMARY_KEEP_TURNS
+            if count <= 0:
+                return
+            old = ([f"Earlier summary: {self.summary}"] if self.summary else []) + self.turns[:count]
+            self._compacting = True
+            generation = self._generation
+            dropped = self._dropped
+        threading.Thread(
+            target=self._compact, args=(generation, dropped, count, "\n".join(old)), daemon=True
+        ).start()
+
+    def _compact(self, generation: int, dropped: int, count: int, text: str) -> None:
+        """Replace the first count turns with a summary of them."""
+        try:
+            summary = self.summarize(text).strip()
+        except OverloadedError as e:
+            # try again after a later turn; the hard cap keeps the prompt in bounds meanwhile
+            logger.info(f"Skipped summarizing conversation history: {str(e)}")
+            summary = None
+        except Exception as e:
+            logger.warning(f"Could not summarize conversation history: {str(e)}")
+            summary = None
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._compacting = False
+            if summary is None:
+                return
+            self.summary = summary
+            # turns are only appended while we summarize, but the hard cap may have
+            # dropped some of the summarized ones from the front in the meantime
+            remaining = max(count - (self._dropped - dropped), 0)
+            self.turns = self.turns[remaining:]
+            self._unpin_removed()
+        logger.info(f"Compacted {count} turns into a summary")
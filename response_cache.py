@@ -0,0 +1,159 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+from config import (
+    RESPONSE_CACHE_FILE, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIMILARITY
+)
+from logger import logger
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+class ResponseCache:
+    """LLM responses keyed by document index, retrieved chunk ids and normalized question.
+
+    The semantic tier also serves a response whose question embedding is at least
+    `similarity` (cosine) to the new question's, for the same document index. Entries
+    expire after `ttl` seconds and the least recently used are evicted beyond
+    `max_entries`. Entries are appended to a JSONL file and reloaded on startup; the
+    file is compacted once it holds twice `max_entries` lines.
+    """
+
+    def __init__(self, path: Optional[Path] = RESPONSE_CACHE_FILE, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl: float = RESPONSE_CACHE_TTL, similarity: Optional[float] = RESPONSE_CACHE_SIMILARITY):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        # lines in the cache file; it is rewritten once they pass twice max_entries
+        self._lines = 0
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self._load()
+
+    def key_for(self, index_id: Optional[str], chunk_ids: Iterable[int], question: str) -> str:
+        """Build the exact-match key."""
+        parts = [index_id, [int(i) for i in chunk_ids], normalize_question(question)]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str, index_id: Optional[str] = None,
+            query_embedding: Optional[np.ndarray] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Return (response, "exact" or "semantic"), or (None, None) on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                return entry["response"], "exact"
+            if self.similarity is None or query_embedding is None:
+                return None, None
+
+            # semantic tier: nearest earlier question about the same document
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if e["index_id"] == index_id and e["embedding"] is not None and not self._expired(e, now)
+            ]
+            if not candidates:
+                return None, None
+            matrix = np.stack([e["embedding"] for _, e in candidates])
+            scores = matrix @ np.asarray(query_embedding, dtype=np.float32)
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None, None
+            best_key, entry = candidates[best]
+            self._entries.move_to_end(best_key)
+            return entry["response"], "semantic"
+
+    def put(self, key: str, response: str, index_id: Optional[str] = None,
+            query_embedding: Optional[np.ndarray] = None, question: str = "") -> None:
+        """Store a response and append it to the cache file."""
+        entry = {
+            "response": response,
+            "index_id": index_id,
+            "question": question,
+            "created": time.time(),
+            "embedding": None if query_embedding is None else np.asarray(query_embedding, dtype=np.float32)
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path is not None:
+                try:
+                    if self._lines >= 2 * self.max_entries:
+                        self._compact(time.time())
+                    else:
+                        with open(self.path, 'a', encoding='utf-8') as f:
+                            f.write(json.dumps(self._serialize(key, entry)) + '\n')
+                        self._lines += 1
+                except OSError as e:
+                    logger.warning(f"Could not persist response cache entry: {str(e)}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._lines = 0
+            if self.path is not None and self.path.exists():
+                self.path.unlink()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return self.ttl is not None and now - entry["created"] > self.ttl
+
+    def _serialize(self, key: str, entry: dict) -> dict:
+        embedding = entry["embedding"]
+        return dict(entry, key=key, embedding=None if embedding is None else embedding.tolist())
+
+    def _load(self) -> None:
+        """Replay the cache file, dropping expired entries, and rewrite it compacted."""
+        if not self.path.exists():
+            return
+        now = time.time()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        stored = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a partly written last line from an interrupted run
+                        continue
+                    key = stored.pop("key")
+                    if stored["embedding"] is not None:
+                        stored["embedding"] = np.asarray(stored["embedding"], dtype=np.float32)
+                    if self._expired(stored, now):
+                        self._entries.pop(key, None)
+                        continue
+                    self._entries[key] = stored
+                    self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._compact(now)
+            logger.info(f"Loaded {len(self._entries)} cached responses")
+        except (OSError, KeyError) as e:
+            logger.warning(f"Could not load response cache: {str(e)}")
+
+    def _compact(self, now: float) -> None:
+        """Rewrite the cache file with only the live entries (lock held)."""
+        for key in [k for k, e in self._entries.items() if self._expired(e, now)]:
+            del self._entries[key]
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, entry in self._entries.items():
+                f.write(json.dumps(self._serialize(key, entry)) + '\n')
+        os.replace(tmp_path, self.path)
+        self._lines = len(self._entries)
@@ -0,0 +1,237 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from config import LLM_SLOTS, LLM_URLS, LLM_QUEUE_SLO, LLM_BATCH_QUEUE_SLO
+from system_monitor import system_monitor
+
+# Request priorities (lower is served first)
+INTERACTIVE = 0
+BATCH = 1
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed because it would wait longer than the queue SLO."""
+
+
+class _Ticket:
+    """A queued request waiting for a free slot."""
+
+    def __init__(self, priority, seq, event=None, future=None, loop=None):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.cancelled = False
+        self.event = event
+        self.future = future
+        self.loop = loop
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """Admission control in front of the LLM server.
+
+    At most `slots` requests run at once (the parallel slots of all LLM servers together).
+    Waiting requests are served by priority, then arrival. A request is shed with
+    OverloadedError when its estimated or actual queue wait exceeds the SLO for
+    its priority. Works from threads (slot/stream) and asyncio (slot_async/stream_async).
+    """
+
+    def __init__(self, slots=LLM_SLOTS, queue_slo=LLM_QUEUE_SLO, batch_queue_slo=LLM_BATCH_QUEUE_SLO):
+        self.slots = slots
+        self.slo = {INTERACTIVE: queue_slo, BATCH: batch_queue_slo}
+        self._lock = threading.Lock()
+        self._free = slots
+        self._queue = []
+        self._seq = itertools.count()
+        # moving average of how long a request holds a slot
+        self.avg_service_time = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+
+    def acquire(self, priority=INTERACTIVE):
+        """Block until a slot is free and return the time spent queued."""
+        with self._lock:
+            if self._try_take():
+                return self._admit(0.0)
+            ticket = self._enqueue(priority, event=threading.Event())
+        if not ticket.event.wait(self.slo.get(priority)):
+            self._give_up(ticket)
+        return self._admit(time.perf_counter() - ticket.enqueued)
+
+    async def acquire_async(self, priority=INTERACTIVE):
+        """Asyncio version of acquire."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_take():
+                return self._admit(0.0)
+            ticket = self._enqueue(priority, future=loop.create_future(), loop=loop)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.slo.get(priority))
+        except asyncio.TimeoutError:
+            self._give_up(ticket)
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+        return self._admit(time.perf_counter() - ticket.enqueued)
+
+    def release(self, service_time=None):
+        """Free a slot, handing it straight to the next waiting request."""
+        with self._lock:
+            if service_time is not None:
+                self.avg_service_time = (
+                    service_time if self.avg_service_time == 0
+                    else 0.8 * self.avg_service_time + 0.2 * service_time
+                )
+            if not self._grant_next():
+                self._free += 1
+
+    def resize(self, slots):
+        """Change how many requests run at once, e.g. when LLM endpoints are added."""
+        with self._lock:
+            # may go negative when shrinking: running requests finish before new ones start
+            self._free += slots - self.slots
+            self.slots = slots
+            while self._free > 0 and self._grant_next():
+                self._free -= 1
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        """Hold a slot for the duration of the block."""
+        self.acquire(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def slot_async(self, priority=INTERACTIVE):
+        await self.acquire_async(priority)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stream(self, make_stream, priority=INTERACTIVE):
+        """Yield from make_stream() while holding a slot; shed requests yield an error message."""
+        try:
+            self.acquire(priority)
+        except OverloadedError as e:
+            yield f"Error: {str(e)}"
+            return
+        start = time.perf_counter()
+        try:
+            yield from make_stream()
+        finally:
+            self.release(time.perf_counter() - start)
+
+    async def stream_async(self, make_stream, priority=INTERACTIVE):
+        """Asyncio version of stream."""
+        try:
+            await self.acquire_async(priority)
+        except OverloadedError as e:
+            yield f"Error: {str(e)}"
+            return
+        start = time.perf_counter()
+        try:
+            async for piece in make_stream():
+                yield piece
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def get_stats(self):
+        """Return queue statistics."""
+        with self._lock:
+            waiting = sum(1 for ticket in self._queue if not ticket.cancelled)
+        return {
+            "slots": self.slots,
+            "waiting": waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_queue_time": self.total_queue_time / self.admitted if self.admitted else 0,
+            "max_queue_time": self.max_queue_time,
+            "avg_service_time": self.avg_service_time
+        }
+
+    def _grant_next(self):
+        """Hand a slot to the first waiting request; return False if none is waiting (lock held)."""
+        while self._queue:
+            ticket = heapq.heappop(self._queue)
+            if ticket.cancelled:
+                continue
+            ticket.granted = True
+            if ticket.event is not None:
+                ticket.event.set()
+            else:
+                ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+            return True
+        return False
+
+    def _try_take(self):
+        """Take a free slot if nobody is queued ahead (lock held)."""
+        if self._free > 0 and not self._queue:
+            self._free -= 1
+            return True
+        return False
+
+    def _enqueue(self, priority, **waiter):
+        """Queue a request, shedding it up front if it would clearly miss the SLO (lock held)."""
+        slo = self.slo.get(priority)
+        if slo is not None and self.avg_service_time > 0:
+            ahead = sum(1 for t in self._queue if not t.cancelled and t.priority <= priority)
+            estimated_wait = (ahead + 1) / self.slots * self.avg_service_time
+            if estimated_wait > slo:
+                self._shed(estimated_wait, slo)
+        ticket = _Ticket(priority, next(self._seq), **waiter)
+        heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _give_up(self, ticket):
+        """Shed a request whose wait ran past the SLO, unless a slot arrived meanwhile."""
+        with self._lock:
+            if ticket.granted:
+                return
+            ticket.cancelled = True
+            self._shed(time.perf_counter() - ticket.enqueued, self.slo.get(ticket.priority))
+
+    def _abandon(self, ticket):
+        """Withdraw a cancelled waiter, passing on a slot it was granted but never used."""
+        with self._lock:
+            if not ticket.granted:
+                ticket.cancelled = True
+                return
+        self.release()
+
+    def _shed(self, wait, slo):
+        self.shed += 1
+        system_monitor.annotate(shed=True)
+        raise OverloadedError(
+            f"LLM server is overloaded (queue wait {wait:.1f}s over the {slo:.1f}s limit), please try again shortly"
+        )
+
+    def _admit(self, queue_time):
+        self.admitted += 1
+        self.total_queue_time += queue_time
+        self.max_queue_time = max(self.max_queue_time, queue_time)
+        system_monitor.annotate(queue_time=queue_time)
+        system_monitor.add_span("queue", time.perf_counter() - queue_time, queue_time)
+        return queue_time
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Create a global instance with every endpoint's slots
+llm_scheduler = LLMScheduler(LLM_SLOTS * len(LLM_URLS))
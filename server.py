@@ -0,0 +1,235 @@
+# server.py
+import argparse
+import asyncio
+import itertools
+import os
+import shutil
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web, WSMsgType
+from config import (
+    UPLOAD_DIR, SESSION_UPLOAD_DIR, LLM_URLS, LLM_SLOTS, TOP_K_CHUNKS, EMBED_WORKERS,
+    SERVER_HOST, SERVER_PORT
+)
+from document_processor import DocumentProcessor
+from embedding_model import get_embedding_model
+from llm import AsyncLLMClient, count_tokens
+from prompt_builder import PromptBuilder, summarize_with_llm
+from scheduler import llm_scheduler, OverloadedError, INTERACTIVE, BATCH
+from system_monitor import system_monitor
+from logger import logger
+
+
+class ChatSession:
+    """One user's conversation and document index."""
+
+    def __init__(self, session_id, slot_id, llm_urls):
+        self.session_id = session_id
+        # tokens are counted and history summarized by the same servers that answer
+        self.builder = PromptBuilder(
+            slot_id=slot_id, session_id=session_id, count=partial(count_tokens, url=llm_urls),
+            summarize=partial(summarize_with_llm, url=llm_urls)
+        )
+        self.processor = None
+        self.file_path = None
+        # files uploaded in this session, so sessions never overwrite each other's
+        self.upload_dir = os.path.join(SESSION_UPLOAD_DIR, session_id)
+        # turns of one session are answered in order
+        self.lock = asyncio.Lock()
+
+    def close(self):
+        """Delete the files uploaded in this session."""
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+
+@system_monitor.monitor
+async def answer(question, session, llm, executor, stream=False, priority=INTERACTIVE):
+    """Answer a question within a session, optionally as an async stream of text pieces."""
+    loop = asyncio.get_running_loop()
+    chunks = []
+    if session.processor is not None:
+        # queries from concurrent sessions are encoded together, off the event loop
+        with system_monitor.span("retrieval"):
+            results = await asyncio.wrap_future(session.processor.submit_search(question, TOP_K_CHUNKS))
+        chunks = [chunk for chunk, score in results]
+    with system_monitor.span("prompt"):
+        prompt = await loop.run_in_executor(executor, session.builder.build, question, chunks)
+    system_monitor.annotate(
+        chat_session=session.session_id,
+        prompt_chars=len(prompt),
+        prompt_tokens=session.builder.prompt_tokens,
+        reused_prompt_chars=session.builder.reused_chars
+    )
+    slot_id = session.builder.slot_id
+    if stream:
+        return llm_scheduler.stream_async(
+            lambda: llm.stream(prompt, slot_id=slot_id, session=session.session_id), priority
+        )
+    try:
+        async with llm_scheduler.slot_async(priority):
+            return await llm.complete(prompt, slot_id=slot_id, session=session.session_id)
+    except OverloadedError as e:
+        logger.warning(str(e))
+        return f"Error: {str(e)}"
+
+
+class ChatServer:
+    """HTTP/WebSocket server hosting many concurrent chat sessions.
+
+    All sessions share one embedding model and thread pool, and one pooled
+    client to the LLM servers that keeps each session on the same server.
+    """
+
+    def __init__(self, llm_url=LLM_URLS):
+        self.sessions = {}
+        self.model = None
+        self.executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS)
+        self.llm = AsyncLLMClient(llm_url)
+        # every server adds its slots to the admission limit
+        llm_scheduler.resize(LLM_SLOTS * len(self.llm.urls))
+        self._slots = itertools.cycle(range(LLM_SLOTS))
+
+    def app(self):
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.on_startup.append(self._startup)
+        app.on_cleanup.append(self._cleanup)
+        app.add_routes([
+            web.get('/health', self.health),
+            web.post('/sessions', self.create_session),
+            web.delete('/sessions/{session_id}', self.delete_session),
+            web.post('/sessions/{session_id}/document', self.add_document),
+            web.post('/sessions/{session_id}/chat', self.chat),
+            web.get('/sessions/{session_id}/ws', self.chat_ws),
+        ])
+        return app
+
+    async def _startup(self, app):
+        loop = asyncio.get_running_loop()
+        self.model = await loop.run_in_executor(self.executor, get_embedding_model)
+        await self.llm.start()
+
+    async def _cleanup(self, app):
+        await self.llm.close()
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        self.executor.shutdown(wait=False)
+        system_monitor.save_summary()
+
+    def _session(self, request):
+        session = self.sessions.get(request.match_info['session_id'])
+        if session is None:
+            raise web.HTTPNotFound(text="Unknown session")
+        return session
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok", "sessions": len(self.sessions), "queue": llm_scheduler.get_stats(),
+            "llm_endpoints": self.llm.endpoints.status(),
+            "llm_affinity": self.llm.endpoints.affinity_stats()
+        })
+
+    async def create_session(self, request):
+        session_id = uuid.uuid4().hex
+        session = ChatSession(session_id, next(self._slots), self.llm.urls)
+        self.sessions[session_id] = session
+        return web.json_response({"session_id": session_id, "slot_id": session.builder.slot_id})
+
+    async def delete_session(self, request):
+        session = self.sessions.pop(request.match_info['session_id'], None)
+        if session is not None:
+            session.close()
+        return web.json_response({"deleted": True})
+
+    async def add_document(self, request):
+        """Index a document for a session.
+
+        Send either JSON {"file_name": ...} naming a file in the uploads directory, or
+        the raw file as the body with a ?filename= query parameter. Uploaded files are
+        kept in the session's own directory until the session is deleted.
+        """
+        session = self._session(request)
+        if request.content_type == 'application/json':
+            file_name = (await request.json()).get("file_name", "")
+            body = None
+        else:
+            file_name = request.query.get("filename", "")
+            body = await request.read()
+
+        # only files inside the uploads directory are ever read
+        file_name = os.path.basename(file_name)
+        if not file_name.lower().endswith(('.pdf', '.txt')):
+            raise web.HTTPBadRequest(text="Expected a .pdf or .txt file")
+        if body is not None:
+            os.makedirs(session.upload_dir, exist_ok=True)
+            file_path = os.path.join(session.upload_dir, file_name)
+            with open(file_path, 'wb') as f:
+                f.write(body)
+        else:
+            file_path = os.path.join(UPLOAD_DIR, file_name)
+            if not os.path.exists(file_path):
+                raise web.HTTPNotFound(text=f"File not found: {file_name}")
+
+        processor = DocumentProcessor(model=self.model)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, processor.process_document, file_path)
+        session.processor = processor
+        session.file_path = file_path
+        return web.json_response({"file_name": file_name, "chunks": len(processor.chunks)})
+
+    async def chat(self, request):
+        """Answer one message; send {"priority": "batch"} for requests nobody is waiting on."""
+        session = self._session(request)
+        body = await request.json()
+        message = (body.get("message") or "").strip()
+        if not message:
+            raise web.HTTPBadRequest(text="Empty message")
+        priority = BATCH if body.get("priority") == "batch" else INTERACTIVE
+        async with session.lock:
+            response = await answer(message, session, self.llm, self.executor, priority=priority)
+            if response.startswith("Error:"):
+                raise web.HTTPServiceUnavailable(text=response)
+            # counting the history's tokens may call /tokenize, so keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, session.builder.add_response, response
+            )
+        return web.json_response({"response": response})
+
+    async def chat_ws(self, request):
+        """Stream answers over a WebSocket: send {"message"}, receive {"token"}s then {"done"}."""
+        session = self._session(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            message = (msg.json().get("message") or "").strip()
+            if not message:
+                await ws.send_json({"error": "Empty message"})
+                continue
+            async with session.lock:
+                pieces = []
+                async for token in await answer(message, session, self.llm, self.executor, stream=True):
+                    pieces.append(token)
+                    await ws.send_json({"token": token})
+                response = "".join(pieces).strip()
+                if response.startswith("Error:"):
+                    await ws.send_json({"error": response})
+                    continue
+                await asyncio.get_running_loop().run_in_executor(
+                    self.executor, session.builder.add_response, response
+                )
+            await ws.send_json({"done": True, "response": response})
+        return ws
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-session chat server")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--llm-url", nargs="+", default=LLM_URLS,
+                        help="completion endpoints to balance requests across")
+    args = parser.parse_args()
+
+    web.run_app(ChatServer(args.llm_url).app(), host=args.host, port=args.port)
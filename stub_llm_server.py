@@ -0,0 +1,148 @@
+# stub_llm_server.py
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_TEXT = (
+    "This is a canned answer from the stub LLM server. It stands in for llamafile "
+    "so the chat pipeline can be exercised and benchmarked without a real model."
+).split(" ")
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Minimal llamafile-compatible /completion endpoint with configurable timing."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # keep benchmark output quiet
+        pass
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json({"status": "ok"})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/tokenize":
+            # one token per 4 characters, matching CHARS_PER_TOKEN
+            self._send_json({"tokens": list(range(len(body.get("content", "")) // 4))})
+            return
+        if self.path != "/completion":
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        # like llamafile, requests beyond the parallel slots wait for one to free up
+        with self.server.slots:
+            with self.server.lock:
+                self.server.active += 1
+                self.server.max_active = max(self.server.max_active, self.server.active)
+            try:
+                self._complete(body)
+            finally:
+                with self.server.lock:
+                    self.server.active -= 1
+
+    def _complete(self, body):
+        n_tokens = min(int(body.get("n_predict", self.server.max_tokens)), self.server.max_tokens)
+        tokens = [(" " if i else "") + STUB_TEXT[i % len(STUB_TEXT)] for i in range(n_tokens)]
+        stats = self._prompt_stats(body, "".join(tokens), n_tokens)
+        # simulate prompt processing before the first token
+        time.sleep(self.server.latency)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            # chunked like llamafile, so clients see each event as soon as it is written
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(self.server.token_delay)
+                self._send_event({"content": token, "stop": False})
+            self._send_event({"content": "", "stop": True, "tokens_predicted": n_tokens, **stats})
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            time.sleep(self.server.token_delay * n_tokens)
+            self._send_json({"content": "".join(tokens), "stop": True, "tokens_predicted": n_tokens, **stats})
+
+    def _prompt_stats(self, body, content, n_tokens):
+        """Mimic llamafile's prompt token counts and timings, treating 4 characters as a token."""
+        prompt = body.get("prompt", "")
+        slot = body.get("id_slot", body.get("slot_id", -1))
+        with self.server.lock:
+            cached = self.server.slot_prompts.get(slot, "") if body.get("cache_prompt") else ""
+            self.server.slot_prompts[slot] = prompt + content
+        reused = len(os.path.commonprefix([cached, prompt]))
+        return {
+            "tokens_evaluated": len(prompt) // 4,
+            "timings": {
+                "prompt_n": (len(prompt) - reused) // 4,
+                "predicted_n": len(content) // 4,
+                "prompt_ms": self.server.latency * 1000,
+                "predicted_ms": self.server.token_delay * n_tokens * 1000
+            }
+        }
+
+    def _send_event(self, event):
+        data = f"data: {json.dumps(event)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.05, tokens_per_second=100.0, max_tokens=32,
+                      slots=64):
+    """Start a stub server in a daemon thread and return (server, completion_url).
+
+    server.max_active records the most completions that were ever served at once.
+    """
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_delay = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+    server.max_tokens = max_tokens
+    server.slot_prompts = {}
+    server.lock = threading.Lock()
+    server.slots = threading.BoundedSemaphore(slots)
+    server.active = 0
+    server.max_active = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://{host}:{server.server_address[1]}/completion"
+    return server, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub llamafile server for testing and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--slots", type=int, default=64, help="completions served in parallel")
+    parser.add_argument("--instances", type=int, default=1, help="servers to start on consecutive ports")
+    args = parser.parse_args()
+
+    for i in range(args.instances):
+        server, url = start_stub_server(
+            args.host, args.port + i, args.latency, args.tokens_per_second, args.max_tokens, args.slots
+        )
+        print(f"Stub LLM server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -3,90 +3,361 @@ import time
 import psutil
 import json
 import os
+import atexit
+import inspect
+import contextvars
+import queue
+import threading
 from datetime import datetime
+from collections import deque
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
 from functools import wraps
+from config import METRICS_FLUSH_INTERVAL, METRICS_BUFFER_SIZE, METRICS_MAX_OUTPUT_CHARS
+from logger import logger
+
+
+def _to_json(value):
+    """JSON fallback for annotated values: NumPy scalars and arrays, anything else as text."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
 
 class SystemMonitor:
-    """Class to monitor the system and the LLM."""
+    """Class to monitor the system and the LLM.
+
+    Monitored calls only update counters and queue their metrics; a background thread
+    writes them to logs/metrics_<session>.jsonl in batches every flush_interval seconds,
+    sampling memory usage once per batch. The last buffer_size metrics are kept in
+    self.metrics, and logged outputs are cut to max_output_chars if set. With
+    background=False every query is written immediately.
+    """
     
-    def __init__(self):
-        self.metrics = []
+    def __init__(self, log_dir='logs', flush_interval=METRICS_FLUSH_INTERVAL, buffer_size=METRICS_BUFFER_SIZE,
+                 max_output_chars=METRICS_MAX_OUTPUT_CHARS, background=True):
+        self.metrics = deque(maxlen=buffer_size)
         self.total_queries = 0
         self.total_chars = 0
         self.errors = 0
         self.total_inference_time = 0
+        self.streamed_queries = 0
+        self.total_time_to_first_token = 0
+        self.rated_queries = 0
+        self.total_tokens_per_second = 0
+        self.scheduled_queries = 0
+        self.total_queue_time = 0
+        self.shed_queries = 0
+        self.cache_lookups = 0
+        self.cache_hits = 0
         self.start_time = datetime.now().isoformat()
         self.current_memory_usage_mb = 0
         self.session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.max_output_chars = max_output_chars
+        self.background = background
+        # extra per-query fields reported from inside the monitored call
+        self._extra = contextvars.ContextVar('monitor_extra', default=None)
+        # perf_counter start of the monitored query and name of the innermost open span
+        self._query_start = contextvars.ContextVar('monitor_query_start', default=None)
+        self._span = contextvars.ContextVar('monitor_span', default=None)
+        self._process = psutil.Process()
+        # metrics waiting for the writer thread (flush requests are threading.Events)
+        self._pending = queue.SimpleQueue()
+        self._writer = None
+        # set by flush() to cut the writer's wait short
+        self._wake = threading.Event()
+        self._writer_lock = threading.Lock()
+        # guards the counters and the ring buffer, which every query's thread updates
+        self._lock = threading.Lock()
         
         # Ensure logs directory exists
-        os.makedirs('logs', exist_ok=True)
+        os.makedirs(self.log_dir, exist_ok=True)
     
     def monitor(self, func):
-        """Monitor the system and the LLM."""
+        """Monitor the system and the LLM.
+
+        Works for plain and async functions; streamed results (iterators or async
+        iterators) are recorded once the caller has consumed them.
+        """
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_time, current_query, extra = self._begin(args)
+                try:
+                    result = await func(*args, **kwargs)
+                    if isinstance(result, AsyncIterator):
+                        return self._monitor_async_stream(result, current_query, start_time, extra)
+                    self._record(current_query, result, start_time, extra)
+                    return result
+                except Exception as e:
+                    self._count_error()
+                    raise e
+            return async_wrapper
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            start_time = datetime.now().isoformat()
-            start_memory = psutil.Process().memory_info().rss / 1024 / 1024  # MB
+            start_time, current_query, extra = self._begin(args)
             
             try:
-                # Get the current query (last line of the prompt)
-                prompt = args[0] if args else ""
-                current_query = prompt.split('\n')[-2].replace('Human: ', '') if '\n' in prompt else prompt
-                
                 result = func(*args, **kwargs)
                 
-
-                end_time = datetime.now().isoformat()
-                end_memory = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-                
-                # Calculate inference time
-                start_dt = datetime.fromisoformat(start_time)
-                end_dt = datetime.fromisoformat(end_time)
-                inference_time = (end_dt - start_dt).total_seconds()
-                memory_usage = end_memory
-                
-                # Count characters
-                input_chars = len(current_query)
-                output_chars = len(result)
-                total_chars = input_chars + output_chars
-                
-                # Update metrics
-                self.total_queries += 1
-                self.total_inference_time += inference_time
-                self.total_chars += total_chars
-                self.current_memory_usage_mb = memory_usage
-                
-                # Log metrics
-                metric = {
-                    "timestamp": datetime.now().isoformat(),
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "inference_time": inference_time,
-                    "memory_usage": memory_usage,
-                    "input_chars": input_chars,
-                    "output_chars": output_chars,
-                    "total_chars": total_chars,
-                    "input": f"Human: {current_query}\nAssistant:",
-                    "output": result,
-                    "session_id": self.session_id
-                }
-                
-                self.metrics.append(metric)
-                
-                # Save metrics to session-specific file
-                metrics_file = f"logs/metrics_{self.session_id}.jsonl"
-                with open(metrics_file, 'a') as f:
-                    f.write(json.dumps(metric) + '\n')
+                # Streaming results are recorded once the caller has consumed them
+                if isinstance(result, Iterator):
+                    return self._monitor_stream(result, current_query, start_time, extra)
                 
+                self._record(current_query, result, start_time, extra)
                 return result
                 
             except Exception as e:
-                self.errors += 1
+                self._count_error()
                 raise e
         
         return wrapper
     
+    def _count_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def annotate(self, **fields):
+        """Attach extra fields to the metrics of the query currently being monitored."""
+        extra = self._extra.get()
+        if extra is not None:
+            extra.update(fields)
+    
+    @contextmanager
+    def span(self, name):
+        """Time a stage of the query currently being monitored.
+
+        Spans nest: each is recorded in the query's "spans" list with its parent's name,
+        its start relative to the query start and its duration, in seconds.
+        """
+        if self._extra.get() is None:
+            yield
+            return
+        parent = self._span.get()
+        self._span.set(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # set rather than reset: a span in a generator may close in another context
+            self._span.set(parent)
+            self.add_span(name, start, time.perf_counter() - start, parent)
+    
+    def add_span(self, name, start, duration, parent=None):
+        """Record an already timed stage (start is a perf_counter value) of the current query."""
+        extra = self._extra.get()
+        query_start = self._query_start.get()
+        if extra is None or query_start is None:
+            return
+        extra.setdefault("spans", []).append({
+            "name": name,
+            "parent": parent if parent is not None else self._span.get(),
+            "start": start - query_start,
+            "duration": duration
+        })
+    
+    def _begin(self, args):
+        """Start monitoring a call: return its start time (perf_counter_ns), query and extra-fields dict."""
+        start_time = time.perf_counter_ns()
+        # Get the current query (last line of the prompt)
+        prompt = args[0] if args else ""
+        current_query = prompt.split('\n')[-2].replace('Human: ', '') if '\n' in prompt else prompt
+        # a context variable keeps concurrent threads and asyncio tasks apart
+        extra = {}
+        self._extra.set(extra)
+        self._query_start.set(start_time / 1e9)
+        self._span.set(None)
+        return start_time, current_query, extra
+    
+    def _monitor_stream(self, tokens, current_query, start_time, extra):
+        """Pass streamed tokens through while timing the first token and the token rate."""
+        first_token_at = None
+        pieces = []
+        try:
+            for token in tokens:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                pieces.append(token)
+                yield token
+        except Exception:
+            self._count_error()
+            raise
+        finally:
+            # also runs when the caller stops early, so partial answers are still logged
+            self._record_stream(current_query, pieces, first_token_at, start_time, extra)
+    
+    async def _monitor_async_stream(self, tokens, current_query, start_time, extra):
+        """Async version of _monitor_stream."""
+        first_token_at = None
+        pieces = []
+        try:
+            async for token in tokens:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                pieces.append(token)
+                yield token
+        except Exception:
+            self._count_error()
+            raise
+        finally:
+            self._record_stream(current_query, pieces, first_token_at, start_time, extra)
+    
+    def _record_stream(self, current_query, pieces, first_token_at, start_time, extra):
+        """Record a streamed response with its time-to-first-token and token rate.
+
+        Time to first token runs from the start of the monitored call, so retrieval and
+        prompt building count, as the user waits through them. Cached answers and errors
+        arrive as a single piece without waiting for the LLM and get no time to first token.
+        """
+        end = time.perf_counter()
+        time_to_first_token = None
+        tokens_per_second = None
+        generated = not (extra.get("cache_hit") or extra.get("error") or extra.get("shed")
+                         or (pieces and pieces[0].startswith("Error")))
+        if first_token_at is not None and generated:
+            time_to_first_token = first_token_at - start_time / 1e9
+            # the rate excludes the wait for the first token
+            generation_time = end - first_token_at
+            if len(pieces) > 1 and generation_time > 0:
+                tokens_per_second = (len(pieces) - 1) / generation_time
+        self._record(
+            current_query, "".join(pieces).strip(), start_time, extra,
+            time_to_first_token=time_to_first_token,
+            tokens_per_second=tokens_per_second,
+            output_tokens=len(pieces)
+        )
+    
+    def _record(self, current_query, result, start_time, extra=None, time_to_first_token=None,
+                tokens_per_second=None, output_tokens=None):
+        """Update the counters and queue one query's metrics for the session file."""
+        inference_time = (time.perf_counter_ns() - start_time) / 1e9
+        end_time = time.time()
+        
+        # Count characters
+        input_chars = len(current_query)
+        output_chars = len(result)
+        total_chars = input_chars + output_chars
+        
+        # Update metrics
+        extra = extra or {}
+        with self._lock:
+            self.total_queries += 1
+            self.total_inference_time += inference_time
+            self.total_chars += total_chars
+            if time_to_first_token is not None:
+                self.streamed_queries += 1
+                self.total_time_to_first_token += time_to_first_token
+            if tokens_per_second is not None:
+                self.rated_queries += 1
+                self.total_tokens_per_second += tokens_per_second
+            if extra.get("queue_time") is not None:
+                self.scheduled_queries += 1
+                self.total_queue_time += extra["queue_time"]
+            if extra.get("shed"):
+                self.shed_queries += 1
+            if extra.get("error"):
+                # failures reported as an "Error: ..." response rather than raised
+                self.errors += 1
+            if "cache_hit" in extra:
+                self.cache_lookups += 1
+                if extra["cache_hit"]:
+                    self.cache_hits += 1
+        
+        output = result
+        if self.max_output_chars is not None and output_chars > self.max_output_chars:
+            output = result[:self.max_output_chars]
+            extra["output_truncated"] = True
+        
+        # timestamps and memory usage are filled in by the writer
+        metric = {
+            "timestamp": end_time,
+            "start_time": end_time - inference_time,
+            "end_time": end_time,
+            "inference_time": inference_time,
+            "time_to_first_token": time_to_first_token,
+            "tokens_per_second": tokens_per_second,
+            "output_tokens": output_tokens,
+            "memory_usage": None,
+            "input_chars": input_chars,
+            "output_chars": output_chars,
+            "total_chars": total_chars,
+            "input": f"Human: {current_query}\nAssistant:",
+            "output": output,
+            "session_id": self.session_id
+        }
+        metric.update(extra)
+        
+        with self._lock:
+            self.metrics.append(metric)
+        if self.background:
+            self._pending.put(metric)
+            self._ensure_writer()
+        else:
+            self._write([metric])
+    
+    def flush(self, timeout=None):
+        """Block until every metric recorded so far is written to the session file."""
+        if self._writer is None:
+            return
+        done = threading.Event()
+        self._pending.put(done)
+        self._wake.set()
+        done.wait(timeout)
+    
+    def _ensure_writer(self):
+        """Start the writer thread on first use."""
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="metrics-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush, timeout=5)
+    
+    def _write_loop(self):
+        """Collect queued metrics and write them in batches."""
+        while True:
+            items = [self._pending.get()]
+            # let a batch build up, then take everything queued meanwhile
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            while True:
+                try:
+                    items.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write([item for item in items if isinstance(item, dict)])
+            except Exception as e:
+                # drop this batch but keep the writer alive for the next ones
+                logger.error(f"Could not write metrics: {str(e)}")
+            finally:
+                for item in items:
+                    if isinstance(item, threading.Event):
+                        item.set()
+    
+    def _write(self, batch):
+        """Fill in timestamps and memory usage, then append a batch to the session file."""
+        if not batch:
+            return
+        memory_usage = self._process.memory_info().rss / 1024 / 1024  # MB
+        self.current_memory_usage_mb = memory_usage
+        lines = []
+        for metric in batch:
+            for field in ("timestamp", "start_time", "end_time"):
+                if isinstance(metric[field], float):
+                    metric[field] = datetime.fromtimestamp(metric[field]).isoformat()
+            metric["memory_usage"] = memory_usage
+            lines.append(json.dumps(metric, default=_to_json) + '\n')
+        
+        # Save metrics to session-specific file
+        metrics_file = os.path.join(self.log_dir, f"metrics_{self.session_id}.jsonl")
+        with open(metrics_file, 'a') as f:
+            f.writelines(lines)
+    
     def get_summary(self):
         """Get a summary of the current session."""
         # add isoformat to the start_time and end_time for better streamlit compatibility
@@ -95,10 +366,21 @@ class SystemMonitor:
         end_dt = datetime.fromisoformat(current_time)
         session_duration = (end_dt - start_dt).total_seconds()
         
+        with self._lock:
+            return self._summary(current_time, session_duration)
+
+    def _summary(self, current_time, session_duration):
+        """Build the summary from the counters (lock held)."""
         return {
             "session_id": self.session_id,
             "total_queries": self.total_queries,
             "avg_inference_time": self.total_inference_time / self.total_queries if self.total_queries > 0 else 0,
+            "avg_time_to_first_token": self.total_time_to_first_token / self.streamed_queries if self.streamed_queries > 0 else 0,
+            "avg_tokens_per_second": self.total_tokens_per_second / self.rated_queries if self.rated_queries > 0 else 0,
+            "avg_queue_time": self.total_queue_time / self.scheduled_queries if self.scheduled_queries > 0 else 0,
+            "shed_queries": self.shed_queries,
+            "cache_hits": self.cache_hits,
+            "cache_hit_rate": self.cache_hits / self.cache_lookups if self.cache_lookups > 0 else 0,
             "total_chars": self.total_chars,
             "avg_chars_per_query": self.total_chars / self.total_queries if self.total_queries > 0 else 0,
             "errors": self.errors,
@@ -110,8 +392,10 @@ class SystemMonitor:
     
     def save_summary(self):
         """Save the session summary to a file."""
+        # don't hang on exit if the writer is stuck, e.g. on a full disk
+        self.flush(timeout=5)
         summary = self.get_summary()
-        summary_file = f"logs/summary_{self.session_id}.json"
+        summary_file = os.path.join(self.log_dir, f"summary_{self.session_id}.json")
         
         with open(summary_file, 'w') as f:
             json.dump(summary, f, indent=2)
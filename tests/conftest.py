@@ -0,0 +1,35 @@
+# tests/conftest.py
+import os
+import socket
+import sys
+import pytest
+
+# the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_llm_server import start_stub_server
+
+
+@pytest.fixture
+def stub_server():
+    """Start stub LLM servers on demand; return (server, completion_url) per call."""
+    servers = []
+
+    def start(**options):
+        server, url = start_stub_server(**options)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def dead_url():
+    """A completion URL nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/completion"
@@ -0,0 +1,31 @@
+# tests/test_corpus_index.py
+import numpy as np
+from corpus_index import CorpusIndex
+
+
+def add_document(corpus, n, rows):
+    source = f"doc{n}.pdf"
+    meta = [{"source": source, "page": i + 1} for i in range(len(rows))]
+    return corpus.add_chunks(source, [f"{source} chunk {i}" for i in range(len(rows))], rows, meta)
+
+
+def test_switches_to_ivf_and_retrains_as_the_corpus_doubles():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    corpus = CorpusIndex(min_ann_chunks=200, nprobe=1000)
+    trained_sizes = []
+    for n in range(5):
+        add_document(corpus, n, vectors[n * 100:(n + 1) * 100])
+        trained_sizes.append(corpus._trained_size)
+
+    # exact below 200 chunks, trained at 200, added to at 300, retrained at 400
+    assert trained_sizes == [0, 200, 200, 400, 400]
+    assert len(corpus.documents) == 5
+
+    # scanning every list gives the exact answer, with each chunk's source
+    query = vectors[321]
+    ids, scores = corpus.search_embedding(query, 3)
+    assert ids[0] == 321
+    assert corpus.chunk_meta[ids[0]] == {"source": "doc3.pdf", "page": 22}
+    assert np.allclose(scores, np.sort(corpus.embeddings @ query)[::-1][:3], atol=1e-5)
@@ -0,0 +1,49 @@
+# tests/test_document_processor.py
+from document_processor import pdf_page_hashes, extract_pdf_pages
+
+
+def form_pdf(text, font_entries=b""):
+    """One page drawing its text through a Form XObject (/Fm0 Do)."""
+    form = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /XObject << /Fm0 5 0 R >> /Font << /F1 6 0 R >> >> >>",
+        b"<< /Length 8 >>\nstream\n/Fm0 Do\nendstream",
+        b"<< /Type /XObject /Subtype /Form /BBox [0 0 612 792] /Resources << /Font << /F1 6 0 R >> >> /Length "
+        + str(len(form)).encode() + b" >>\nstream\n" + form + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica" + font_entries + b" >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def page_hash(tmp_path, name, pdf):
+    path = tmp_path / name
+    path.write_bytes(pdf)
+    return pdf_page_hashes(str(path))[0]
+
+
+def test_page_hash_covers_text_drawn_from_form_xobjects(tmp_path):
+    before = page_hash(tmp_path, "before.pdf", form_pdf("Hello world"))
+    after = page_hash(tmp_path, "after.pdf", form_pdf("Goodbye all"))
+
+    assert extract_pdf_pages(str(tmp_path / "after.pdf"), workers=1) == ["Goodbye all"]
+    # the page's own content stream (/Fm0 Do) is the same in both
+    assert before != after
+
+
+def test_page_hash_covers_font_encoding(tmp_path):
+    plain = page_hash(tmp_path, "plain.pdf", form_pdf("Hello world"))
+    encoded = page_hash(tmp_path, "encoded.pdf", form_pdf("Hello world", b" /Encoding /WinAnsiEncoding"))
+    assert plain != encoded
+    assert page_hash(tmp_path, "again.pdf", form_pdf("Hello world")) == plain
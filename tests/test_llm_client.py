@@ -0,0 +1,112 @@
+# tests/test_llm_client.py
+import threading
+import time
+import pytest
+import llm
+from endpoints import CLOSED, OPEN, HALF_OPEN
+from llm import LLMClient, LLMError, RetriableLLMError
+from stub_llm_server import start_stub_server
+
+
+def test_fails_over_to_healthy_endpoint_without_backoff(monkeypatch, stub_server, dead_url):
+    # any backoff before the failover would show up in the elapsed time
+    monkeypatch.setattr(llm, "backoff_delay", lambda attempt: 1.0)
+    _, url = stub_server(latency=0, tokens_per_second=0)
+    client = LLMClient([dead_url, url])
+    dead, live = client.endpoints.endpoints
+
+    start = time.perf_counter()
+    data = client.complete("hello")
+    elapsed = time.perf_counter() - start
+
+    assert data["content"]
+    assert elapsed < 0.5
+    assert dead.breaker.failures == 1
+    assert live.requests == 1
+    assert dead.outstanding == live.outstanding == 0
+    # the failing endpoint is avoided while it has failures
+    client.complete("hello again")
+    assert dead.requests == 1
+    assert live.requests == 2
+
+
+def test_client_error_is_not_retried(stub_server):
+    _, url = stub_server(latency=0, tokens_per_second=0)
+    client = LLMClient([url.replace("/completion", "/missing")])
+    endpoint = client.endpoints.endpoints[0]
+
+    with pytest.raises(LLMError) as error:
+        client.complete("hello")
+
+    assert not isinstance(error.value, RetriableLLMError)
+    assert endpoint.requests == 1
+    # the server answered, so its circuit stays healthy
+    assert endpoint.breaker.failures == 0
+    assert endpoint.breaker.state == CLOSED
+
+
+def test_breaker_opens_then_half_opens_then_closes(monkeypatch, dead_url):
+    monkeypatch.setattr(llm, "backoff_delay", lambda attempt: 0)
+    client = LLMClient([dead_url])
+    client.endpoints.health_interval = 60
+    endpoint = client.endpoints.endpoints[0]
+    endpoint.breaker.cooldown = 0.1
+
+    # MAX_RETRIES connection failures reach the failure threshold
+    with pytest.raises(RetriableLLMError):
+        client.complete("hello")
+    assert endpoint.breaker.state == OPEN
+    with pytest.raises(LLMError, match="circuit is open"):
+        client.complete("hello")
+
+    # the server comes back; after the cooldown a health check lets one trial through
+    port = int(dead_url.split(":")[2].split("/")[0])
+    server, _ = start_stub_server(port=port, latency=0, tokens_per_second=0)
+    try:
+        time.sleep(endpoint.breaker.cooldown)
+        client.endpoints.check_health()
+        assert endpoint.breaker.state == HALF_OPEN
+        assert client.complete("hello")["content"]
+        assert endpoint.breaker.state == CLOSED
+        assert endpoint.breaker.failures == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_half_open_admits_a_single_trial(dead_url):
+    client = LLMClient([dead_url])
+    pool = client.endpoints
+    endpoint = pool.endpoints[0]
+    endpoint.breaker.state = HALF_OPEN
+
+    assert pool.acquire() is endpoint
+    assert pool.acquire() is None
+    pool.record(endpoint, False)
+    assert endpoint.breaker.state == OPEN
+
+
+def test_least_outstanding_routing_under_concurrency(stub_server):
+    servers = [stub_server(latency=0.3, tokens_per_second=0) for _ in range(2)]
+    client = LLMClient([url for _, url in servers])
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def ask():
+        barrier.wait()
+        try:
+            client.complete("hello")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=ask) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert [endpoint.requests for endpoint in client.endpoints.endpoints] == [4, 4]
+    assert [server.max_active for server, _ in servers] == [4, 4]
+    assert all(endpoint.outstanding == 0 for endpoint in client.endpoints.endpoints)
+
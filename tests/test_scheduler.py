@@ -0,0 +1,102 @@
+# tests/test_scheduler.py
+import asyncio
+import threading
+import time
+import pytest
+from scheduler import LLMScheduler, OverloadedError, INTERACTIVE, BATCH
+
+
+def wait_for_waiting(scheduler, count, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while scheduler.get_stats()["waiting"] < count:
+        assert time.monotonic() < deadline, "requests never queued"
+        time.sleep(0.005)
+
+
+def test_request_past_the_slo_is_shed():
+    scheduler = LLMScheduler(slots=1, queue_slo=0.1)
+    scheduler.acquire()
+
+    start = time.perf_counter()
+    with pytest.raises(OverloadedError):
+        scheduler.acquire(INTERACTIVE)
+
+    assert time.perf_counter() - start >= 0.1
+    assert scheduler.shed == 1
+    # the shed request gave up its place in the queue
+    assert scheduler.get_stats()["waiting"] == 0
+    scheduler.release()
+    assert scheduler.acquire() == 0.0
+
+
+def test_request_that_would_miss_the_slo_is_shed_up_front():
+    scheduler = LLMScheduler(slots=1, queue_slo=0.5)
+    scheduler.acquire()
+    scheduler.release(service_time=1.0)
+    scheduler.acquire()
+
+    start = time.perf_counter()
+    with pytest.raises(OverloadedError):
+        scheduler.acquire(INTERACTIVE)
+    assert time.perf_counter() - start < 0.1
+
+
+def test_interactive_requests_are_served_before_batch():
+    scheduler = LLMScheduler(slots=1, queue_slo=None, batch_queue_slo=None)
+    scheduler.acquire()
+    order = []
+
+    def request(name, priority):
+        scheduler.acquire(priority)
+        order.append(name)
+        scheduler.release()
+
+    threads = []
+    for count, (name, priority) in enumerate(
+            [("batch 1", BATCH), ("batch 2", BATCH), ("interactive 1", INTERACTIVE), ("interactive 2", INTERACTIVE)],
+            start=1):
+        thread = threading.Thread(target=request, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        # queue them one at a time so arrival order is known
+        wait_for_waiting(scheduler, count)
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=2)
+
+    assert order == ["interactive 1", "interactive 2", "batch 1", "batch 2"]
+    assert scheduler.shed == 0
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    async def run():
+        scheduler = LLMScheduler(slots=1, queue_slo=None)
+        await scheduler.acquire_async()
+        waiter = asyncio.create_task(scheduler.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        scheduler.release()
+        await asyncio.wait_for(scheduler.acquire_async(), 1)
+
+    asyncio.run(run())
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_passed_on():
+    async def run():
+        scheduler = LLMScheduler(slots=1, queue_slo=None)
+        await scheduler.acquire_async()
+        waiter = asyncio.create_task(scheduler.acquire_async())
+        await asyncio.sleep(0.01)
+        # the slot is granted, but the waiter is cancelled before it resumes
+        scheduler.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        await asyncio.wait_for(scheduler.acquire_async(), 1)
+
+    asyncio.run(run())
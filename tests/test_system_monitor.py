@@ -0,0 +1,89 @@
+# tests/test_system_monitor.py
+import json
+import os
+import time
+import numpy as np
+from system_monitor import SystemMonitor
+
+
+def read_metrics(monitor):
+    path = os.path.join(monitor.log_dir, f"metrics_{monitor.session_id}.jsonl")
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_numpy_annotations_are_written(tmp_path):
+    monitor = SystemMonitor(log_dir=str(tmp_path), flush_interval=0.01)
+
+    @monitor.monitor
+    def answer(question):
+        monitor.annotate(score=np.float32(0.5), ids=np.arange(3))
+        return "ok"
+
+    answer("q")
+    monitor.flush(timeout=2)
+    metric, = read_metrics(monitor)
+    assert metric["score"] == 0.5
+    assert metric["ids"] == [0, 1, 2]
+
+
+def test_writer_survives_a_failed_batch(tmp_path):
+    monitor = SystemMonitor(log_dir=str(tmp_path), flush_interval=0.01)
+    write = monitor._write
+    calls = []
+
+    def failing_once(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        write(batch)
+
+    monitor._write = failing_once
+
+    @monitor.monitor
+    def answer(question):
+        return "ok"
+
+    answer("lost")
+    monitor.flush(timeout=2)
+    answer("kept")
+    monitor.flush(timeout=2)
+
+    assert monitor._writer.is_alive()
+    assert [m["input"] for m in read_metrics(monitor)] == ["Human: kept\nAssistant:"]
+    monitor.save_summary()
+    assert os.path.exists(os.path.join(str(tmp_path), f"summary_{monitor.session_id}.json"))
+
+
+def test_time_to_first_token_includes_work_before_the_stream(tmp_path):
+    monitor = SystemMonitor(log_dir=str(tmp_path), background=False)
+
+    @monitor.monitor
+    def answer(question):
+        time.sleep(0.1)  # retrieval and prompt building
+        return iter(["Hello", " world"])
+
+    assert "".join(answer("q")) == "Hello world"
+    metric, = read_metrics(monitor)
+    assert metric["time_to_first_token"] >= 0.1
+    assert monitor.get_summary()["avg_time_to_first_token"] >= 0.1
+
+
+def test_cache_hits_and_errors_have_no_time_to_first_token(tmp_path):
+    monitor = SystemMonitor(log_dir=str(tmp_path), background=False)
+
+    @monitor.monitor
+    def answer(question, cached=False):
+        if cached:
+            monitor.annotate(cache_hit="exact")
+            return iter(["cached answer"])
+        if question == "down":
+            return iter(["Error: Could not connect to LLM server"])
+        time.sleep(0.05)
+        return iter(["generated", " answer"])
+
+    for question, cached in [("q", False), ("q", True), ("down", False)]:
+        list(answer(question, cached))
+
+    assert [m["time_to_first_token"] is None for m in read_metrics(monitor)] == [False, True, True]
+    assert monitor.get_summary()["avg_time_to_first_token"] >= 0.05
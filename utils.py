@@ -1,15 +1,114 @@
 # utils.py
+import queue
+import random
+import threading
 import time
-from config import MAX_RETRIES, RETRY_DELAY
+from concurrent.futures import Future
+import numpy as np
+from config import RETRY_DELAY
 
-def retry(func):
-    """Retry decorator with exponential backoff."""
-    def wrapper(*args, **kwargs):
-        for attempt in range(MAX_RETRIES):
+def backoff_delay(attempt, delay=RETRY_DELAY):
+    """Exponential backoff with full jitter: a random wait of up to delay * 2**attempt seconds."""
+    return random.uniform(0, delay * (2 ** attempt))
+
+def top_k_indices(scores, k):
+    """Return the indices of the k highest scores, best first, without a full sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+def top_k_rows(scores, k):
+    """Row-wise top_k_indices for a 2-D score matrix (one row per query)."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(np.take_along_axis(scores, candidates, axis=1), axis=1)[:, ::-1]
+    return np.take_along_axis(candidates, order, axis=1)
+
+class EmbeddingMatrix:
+    """Preallocated float32 matrix that rows are appended to, grown by doubling."""
+
+    def __init__(self, capacity=1024):
+        self._buffer = None
+        self._capacity = capacity
+        self.size = 0
+
+    def append(self, rows):
+        """Append rows; existing rows are only copied when the buffer has to grow."""
+        rows = np.asarray(rows, dtype=np.float32)
+        if len(rows) == 0:
+            return
+        needed = self.size + len(rows)
+        if self._buffer is None or needed > len(self._buffer):
+            capacity = max(needed, 2 * (len(self._buffer) if self._buffer is not None else 0), self._capacity)
+            buffer = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+            if self.size:
+                buffer[:self.size] = self._buffer[:self.size]
+            self._buffer = buffer
+        self._buffer[self.size:needed] = rows
+        self.size = needed
+
+    def view(self):
+        """Return the filled rows without copying."""
+        if self._buffer is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._buffer[:self.size]
+
+class MicroBatcher:
+    """Collects items submitted from many threads and processes them together.
+
+    A batch is handed to process(items), which returns one result per item, once
+    max_batch items are waiting or max_wait seconds after its first item arrived.
+    """
+
+    def __init__(self, process, max_batch=64, max_wait=0.005):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result."""
+        future = Future()
+        self._queue.put((item, future))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                    self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                # items that queued up during the last batch are taken without waiting
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            items = [item for item, _ in batch]
             try:
-                return func(*args, **kwargs)
+                results = self.process(items)
             except Exception as e:
-                if attempt == MAX_RETRIES - 1:
-                    raise
-                time.sleep(RETRY_DELAY * (2 ** attempt))
-    return wrapper
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)